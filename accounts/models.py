@@ -33,6 +33,7 @@ class User(AbstractUser):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._team_at = {}
+        self._attendance_at = {}
 
     def get_display_name(self):
         return self.username
@@ -40,7 +41,10 @@ class User(AbstractUser):
     def attendance_at(self, event):
         # This should exist due to the event middleware, but in the case of the login view the middleware
         # won't have done anything because at time of execution request.user was AnonymousUser
+        if event in self._attendance_at:
+            return self._attendance_at[event]
         attendance, _ = self.attendance_set.get_or_create(event=event)
+        self._attendance_at[event] = attendance
         return attendance
 
     def get_absolute_url(self):
@@ -56,6 +60,11 @@ class User(AbstractUser):
         self._team_at[event] = team
         return team
 
+    def set_identity_at(self, event, team, attendance):
+        """Record the user's team and attendance at an event, so that they aren't looked up again"""
+        self._team_at[event] = team
+        self._attendance_at[event] = attendance
+
 
 class UserPrivacyMeta:
     fields = ['username', 'email', 'picture', 'contact']
@@ -19,3 +19,4 @@ class EventsConfig(AppConfig):
 
     def ready(self):
         super(EventsConfig, self).ready()
+        from . import signals  # noqa: F401
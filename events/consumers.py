@@ -13,6 +13,8 @@
 from channels.consumer import get_handler_name
 from channels.db import database_sync_to_async
 
+from hunter2.instrumentation import measure
+
 
 def activate_tenant(f):
     """Decorator for use on methods which must be run with an active tenant, but which are not run through tenant middleware"""
@@ -37,8 +39,10 @@ class EventMixin:
         # dispatch because that is *also* decorated with sync_to_async, so the handler will run in
         # another thread... and the whole point here is to activate the tenant for the thread
         # the handler will run in!
-        handler = getattr(self, get_handler_name(message), None)
+        handler_name = get_handler_name(message)
+        handler = getattr(self, handler_name, None)
         if handler:
-            handler(message)
+            with measure(f'{self.__class__.__name__}.{handler_name}'):
+                handler(message)
         else:
             self.close(4401)
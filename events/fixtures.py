@@ -32,6 +32,21 @@ def session_settings():
     wrapper.finalize()
 
 
+@pytest.fixture(autouse=True)
+def local_caches():
+    """Discard the copies of events and the configuration kept by this process after each test
+
+    They would otherwise outlive changes which are rolled back at the end of a test, since rolling back doesn't send
+    any signals.
+    """
+    yield
+
+    from hunter2.models import configurations
+    from .models import domains
+    configurations.clear()
+    domains.clear()
+
+
 @pytest.fixture(scope='session')
 def public_schema(django_db_setup, django_db_blocker):
     """ Initialize public schema. """
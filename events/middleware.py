@@ -32,13 +32,14 @@ class EventMiddleware(object):
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         if request.user.is_authenticated and request.tenant is not None:
-            request.user.attendance_set.get_or_create(
-                event=request.tenant,
-            )
+            request.user.attendance_at(request.tenant)
         return
 
 
 class TenantMiddleware(TenantMainMiddleware):
+    def get_tenant(self, domain_model, hostname):
+        return domain_model.get_tenant(hostname)
+
     def process_request(self, request):
         try:
             super().process_request(request)
@@ -59,7 +60,7 @@ class TenantMiddleware(TenantMainMiddleware):
 def get_tenant(scope):
     domain = scope['domain']
     try:
-        return Domain.objects.get(domain=domain).tenant
+        return Domain.get_tenant(domain)
     except Domain.DoesNotExist:
         return None
 
@@ -9,6 +9,8 @@
 # PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+import copy
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
@@ -20,10 +22,33 @@ from django_tenants.utils import tenant_context
 from .fields import SingleTrueBooleanField
 
 import hunter2.models
+from hunter2.cache import BroadcastLocalCache
+
+# Every request and websocket connection needs the event for its domain, so each process keeps a copy
+DOMAIN_CACHE_SIZE = 256
+DOMAIN_CACHE_TIMEOUT = 60
+
+domains = BroadcastLocalCache('domains', maxsize=DOMAIN_CACHE_SIZE, timeout=DOMAIN_CACHE_TIMEOUT)
 
 
 class Domain(DomainMixin):
-    pass
+    @classmethod
+    def get_tenant(cls, domain):
+        """Return the event, with its files, at the domain from this process's copy if it has one
+
+        Raises Domain.DoesNotExist if there is no event at the domain, which is remembered in the same way.
+        """
+        def get():
+            try:
+                return cls.objects.select_related('tenant', 'tenant__script_file', 'tenant__style_file').get(domain=domain).tenant
+            except cls.DoesNotExist:
+                return None
+
+        tenant = domains.get_or_set(domain, get)
+        if tenant is None:
+            raise cls.DoesNotExist(f'No event at {domain}')
+        # Each request gets its own copy, which it is free to modify
+        return copy.copy(tenant)
 
 
 class Event(TenantMixin):
@@ -66,13 +91,17 @@ class Event(TenantMixin):
     def save(self, verbosity=0, *args, **kwargs):
         super().save(verbosity, *args, **kwargs)
 
+    @staticmethod
+    def files_map_name(event_id):
+        return f'files-map:event:{event_id}'
+
     def files_map(self, request):
         if not hasattr(request, 'event_files'):
-            site_files = hunter2.models.Configuration.get_solo().files_map(request)
-            event_files = {
+            site_files = hunter2.models.Configuration.get_cached().files_map(request)
+            event_files = hunter2.models.files_maps.get_or_set(self.files_map_name(self.id), lambda: {
                 f.slug: f.file.url
                 for f in self.eventfile_set.filter(slug__isnull=False)
-            }
+            })
             request.event_files = {
                 **site_files,
                 **event_files,
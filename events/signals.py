@@ -0,0 +1,33 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from hunter2.models import invalidate_files_map
+from . import models
+
+
+@receiver(post_save, sender=models.EventFile)
+@receiver(post_delete, sender=models.EventFile)
+def event_file_changed(sender, instance, *args, **kwargs):
+    invalidate_files_map(models.Event.files_map_name(instance.event_id))
+    # The event's script and style files are cached along with it
+    models.domains.invalidate()
+
+
+@receiver(post_save, sender=models.Event)
+@receiver(post_delete, sender=models.Event)
+@receiver(post_save, sender=models.Domain)
+@receiver(post_delete, sender=models.Domain)
+def domain_changed(sender, instance, *args, **kwargs):
+    models.domains.invalidate()
@@ -21,7 +21,7 @@ from django.test import TestCase
 from django.urls import reverse
 
 from events.factories import AttendanceFactory, EventFactory, EventFileFactory
-from events.models import Event, EventFile
+from events.models import Domain, Event, EventFile
 from hunter2.tests import MockTTY, mock_inputs
 from . import factories
 from .management.commands import createevent
@@ -199,6 +199,24 @@ class CreateEventManagementCommandTests(EventAwareTestCase):
         self.assertEqual(Event.objects.filter(current=True).count(), 1, "More than a single event with current set as True")
 
 
+class DomainTests(EventTestCase):
+    def test_get_tenant_cached(self):
+        domain = self.tenant.get_primary_domain().domain
+        self.assertEqual(Domain.get_tenant(domain), self.tenant)
+        with self.assertNumQueries(0):
+            self.assertEqual(Domain.get_tenant(domain), self.tenant)
+
+        self.tenant.about_text = '__test__'
+        self.tenant.save()
+        self.assertEqual(Domain.get_tenant(domain).about_text, '__test__')
+
+    def test_get_tenant_missing(self):
+        with self.assertRaises(Domain.DoesNotExist):
+            Domain.get_tenant('missing.test')
+        with self.assertNumQueries(0), self.assertRaises(Domain.DoesNotExist):
+            Domain.get_tenant('missing.test')
+
+
 class EventContentTests(EventTestCase):
     def test_can_load_about(self):
         self.tenant.about_text = '__test__'
@@ -19,4 +19,4 @@ class Hunter2Config(AppConfig):
 
     def ready(self):
         super(Hunter2Config, self).ready()
-        from . import privacy  # noqa
+        from . import privacy, signals  # noqa
@@ -0,0 +1,274 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+# How long to wait before subscribing again after losing the connection to Redis
+RESUBSCRIBE_DELAY = 5
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """A bounded, thread-safe, process-local cache which evicts the least recently used entry when full
+
+    Unlike functools.lru_cache this is keyed explicitly, so entries can be discarded individually when the thing they were
+    derived from changes.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        """Return the value for key, calling factory to create (and cache) it if it is not present
+
+        Exceptions raised by factory are propagated and nothing is cached.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            # Deliberately called outside the lock: factories may be slow, and computing the same value twice is harmless
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
+def _version_key(name):
+    return f'hunter2:version:{name}'
+
+
+def get_version(name):
+    """Return the current version stamp of the named data from the shared cache, creating one if there isn't one yet
+
+    Versions are random rather than counters so that a stamp can never be reused, even if the shared cache is flushed.
+    """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, None):
+            # Another process got there first
+            version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Invalidate everything cached against the current version of the named data, in every process"""
+    cache.set(_version_key(name), uuid.uuid4().hex, None)
+
+
+class VersionedLocalCache:
+    """A process-local cache whose entries are invalidated in every process by bumping their version in the shared cache
+
+    This is for data which is expensive to build but cheap to check: each lookup costs a fetch of the version stamp from
+    the shared cache, rather than rebuilding the data from the database. If shared_timeout is given, values are also kept
+    in the shared cache for that many seconds, so that each version only has to be built by one process.
+    """
+
+    def __init__(self, maxsize=128, shared_timeout=None):
+        self._cache = LRUCache(maxsize=maxsize)
+        self.shared_timeout = shared_timeout
+
+    def get_or_set(self, name, factory, key=None):
+        """Return the value for the named data, calling factory to build it if there isn't one for the current version
+
+        key distinguishes different values derived from the same data, which are all invalidated together. It defaults
+        to the name.
+        """
+        key = name if key is None else key
+        version = get_version(name)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        if self.shared_timeout is None:
+            # If the version is bumped while we're building, the next lookup will see the new version and rebuild
+            value = factory()
+        else:
+            shared_key = f'hunter2:versioned:{key}:{version}'
+            missing = object()
+            value = cache.get(shared_key, missing)
+            if value is missing:
+                value = factory()
+                cache.set(shared_key, value, self.shared_timeout)
+        self._cache.set(key, (version, value))
+        return value
+
+    def invalidate(self, name):
+        self._cache.discard(name)
+        bump_version(name)
+
+    def clear(self):
+        self._cache.clear()
+
+    def cache_info(self):
+        return self._cache.cache_info()
+
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.INVALIDATION_URL)
+    return _client
+
+
+class BroadcastLocalCache:
+    """A process-local cache whose entries are discarded in every process by a message published over Redis
+
+    Unlike VersionedLocalCache, lookups don't leave the process at all, which suits small amounts of data needed by nearly
+    every request which almost never change. Each process subscribes to the channel in a background thread the first
+    time the cache is used. Messages published while a process isn't subscribed are lost, so everything is discarded
+    when the subscription is made again after losing the connection, and entries also expire after `timeout` seconds in case that isn't enough.
+
+    Keys must be strings.
+    """
+
+    def __init__(self, channel, maxsize=128, timeout=60):
+        self.channel = f'hunter2:invalidate:{channel}'
+        self.timeout = timeout
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pid = None
+        # Counts invalidations, so that values built from data which changed while they were being built aren't kept
+        self._generation = 0
+
+    def get_or_set(self, key, factory):
+        """Return the value for key, calling factory to build it if it isn't cached or has expired"""
+        self._subscribe()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        generation = self._generation
+        value = factory()
+        with self._lock:
+            if generation == self._generation:
+                self._cache.set(key, (time.monotonic() + self.timeout, value))
+        return value
+
+    def invalidate(self, key=None):
+        """Discard the entry for key, or every entry if key is None
+
+        The entry is discarded from this process immediately, and from every process once the current transaction
+        commits.
+        """
+        self._discard(key)
+        transaction.on_commit(lambda: self._publish(key))
+
+    def clear(self):
+        self._discard(None)
+
+    def cache_info(self):
+        return self._cache.cache_info()
+
+    def _discard(self, key):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.discard(key)
+
+    def _publish(self, key):
+        try:
+            client().publish(self.channel, '' if key is None else key)
+        except redis.ConnectionError:
+            # Other processes will pick up the change when their entries expire
+            logger.exception(f'Failed to publish invalidation on {self.channel}')
+
+    def _subscribe(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # Threads don't survive forking, so a process forked after using the cache needs a subscriber of its own
+            self._pid = pid
+        threading.Thread(target=self._listen, name=f'subscriber {self.channel}', daemon=True).start()
+
+    def _listen(self):
+        resubscribing = False
+        while True:
+            pubsub = None
+            try:
+                pubsub = client().pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe' and resubscribing:
+                        self._discard(None)
+                    elif message['type'] == 'message':
+                        self._discard(message['data'].decode() or None)
+            except Exception:
+                # Whatever went wrong, this thread is all that keeps the process's entries fresh, so it must not die
+                logger.exception(f'Lost subscription to {self.channel}')
+                resubscribing = True
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+                time.sleep(RESUBSCRIBE_DELAY)
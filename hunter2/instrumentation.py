@@ -0,0 +1,122 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+handler_queries = Histogram(
+    'hunter2_handler_queries', 'Database queries run while handling a request or websocket event', ('handler', ),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, float('inf')),
+)
+handler_db_seconds = Histogram('hunter2_handler_db_seconds', 'Time spent in the database while handling a request or websocket event', ('handler', ))
+handler_seconds = Histogram('hunter2_handler_seconds', 'Time taken to handle a request or websocket event', ('handler', ))
+handler_over_budget = Counter('hunter2_handler_over_budget', 'Requests and websocket events which went over their budget', ('handler', 'measure'))
+
+Measurement = namedtuple('Measurement', ('queries', 'db_seconds', 'seconds'))
+
+
+class Overrun(namedtuple('Overrun', ('handler', 'measure', 'value', 'limit'))):
+    """A measure which a handler went over its budget for"""
+
+    def __str__(self):
+        return f'{self.handler} went over budget: {self.measure} was {self.value:g}, budget is {self.limit:g}'
+
+
+# Lists which overruns are appended to while assert_within_budget is in use
+_overrun_collectors = []
+_overrun_collectors_lock = threading.Lock()
+
+
+class QueryRecorder:
+    """A database execute wrapper which counts queries and the time spent running them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+def budget_for(handler):
+    """Return the budget for the named handler, as a Measurement whose fields are None where there is no limit
+
+    Budgets come from the PERFORMANCE_BUDGETS setting, where entries for particular handlers override the "default" entry.
+    """
+    budget = {
+        **settings.PERFORMANCE_BUDGETS.get('default', {}),
+        **settings.PERFORMANCE_BUDGETS.get(handler, {}),
+    }
+    return Measurement(*(budget.get(field) for field in Measurement._fields))
+
+
+def record(handler, measurement):
+    handler_queries.labels(handler).observe(measurement.queries)
+    handler_db_seconds.labels(handler).observe(measurement.db_seconds)
+    handler_seconds.labels(handler).observe(measurement.seconds)
+
+    budget = budget_for(handler)
+    overruns = [
+        Overrun(handler, field, value, limit)
+        for field, value, limit in zip(Measurement._fields, measurement, budget)
+        if limit is not None and value > limit
+    ]
+    for overrun in overruns:
+        handler_over_budget.labels(handler, overrun.measure).inc()
+        logger.warning(str(overrun))
+        with _overrun_collectors_lock:
+            for collector in _overrun_collectors:
+                collector.append(overrun)
+
+
+@contextmanager
+def measure(handler):
+    """Record the queries run and the time taken inside the block against the named handler"""
+    recorder = QueryRecorder()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(recorder):
+            yield
+    finally:
+        record(handler, Measurement(recorder.queries, recorder.seconds, time.perf_counter() - start))
+
+
+@contextmanager
+def assert_within_budget():
+    """Fail if any request or websocket event handled inside the block goes over its budget
+
+    Handlers are measured in whichever thread they run in, so this also catches websocket consumers run by a test communicator.
+    """
+    overruns = []
+    with _overrun_collectors_lock:
+        _overrun_collectors.append(overruns)
+    try:
+        yield
+    finally:
+        with _overrun_collectors_lock:
+            _overrun_collectors[:] = [collector for collector in _overrun_collectors if collector is not overruns]
+    if overruns:
+        raise AssertionError('\n'.join(str(overrun) for overrun in overruns))
@@ -10,6 +10,11 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+
+from django.db import connection
+
+from .instrumentation import Measurement, QueryRecorder, record
 from .models import Configuration
 
 
@@ -18,5 +23,25 @@ class ConfigurationMiddleware(object):
         self.get_response = get_response
 
     def __call__(self, request):
-        request.site_configuration = Configuration.get_solo()
+        request.site_configuration = Configuration.get_cached()
         return self.get_response(request)
+
+
+class InstrumentationMiddleware:
+    """Records the queries run and the time taken by each view, labelled with the name of its URL pattern
+
+    This should come as early as possible so that the queries run by other middleware are included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        # Requests which didn't match a URL have nothing to be labelled with
+        if request.resolver_match is not None:
+            record(request.resolver_match.view_name, Measurement(recorder.queries, recorder.seconds, time.perf_counter() - start))
+        return response
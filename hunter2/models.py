@@ -10,11 +10,34 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
 import uuid
 
-from django.db import models
+from django.db import models, transaction
 from solo.models import SingletonModel
 
+from .cache import BroadcastLocalCache, VersionedLocalCache
+
+# Enough for the site, a few events and every puzzle in them
+FILES_MAP_CACHE_SIZE = 1024
+# The maps are also kept in the shared cache, so that each version is only built once
+FILES_MAP_TIMEOUT = 24 * 60 * 60
+
+SITE_FILES_MAP = 'files-map:site'
+
+files_maps = VersionedLocalCache(maxsize=FILES_MAP_CACHE_SIZE, shared_timeout=FILES_MAP_TIMEOUT)
+
+# The site configuration is needed by every request, so each process keeps a copy
+CONFIGURATION_TIMEOUT = 60
+
+configurations = BroadcastLocalCache('configuration', maxsize=1, timeout=CONFIGURATION_TIMEOUT)
+
+
+def invalidate_files_map(name):
+    # Bumped again on commit, since another process could cache a map of the old files before the transaction finishes
+    files_maps.invalidate(name)
+    transaction.on_commit(lambda: files_maps.invalidate(name))
+
 
 def file_path(instance, filename):
     return f'site/{filename}'
@@ -58,10 +81,18 @@ class Configuration(SingletonModel):
     )
     captcha_answer = models.TextField(blank=True, help_text='The answer required to be given to the captcha question. Answer is case insensitive.')
 
+    @classmethod
+    def get_cached(cls):
+        """Return the configuration, with its files, from this process's copy if it has one"""
+        def get():
+            return cls.objects.select_related('script_file', 'style_file').get_or_create(pk=cls.singleton_instance_id)[0]
+        # Each request gets its own copy, which it is free to modify
+        return copy.copy(configurations.get_or_set('configuration', get))
+
     def files_map(self, request):
         if not hasattr(request, 'site_files'):
-            request.site_files = {
+            request.site_files = files_maps.get_or_set(SITE_FILES_MAP, lambda: {
                 f.slug: f.file.url
                 for f in File.objects.filter(slug__isnull=False)
-            }
+            })
         return request.site_files
@@ -51,6 +51,30 @@ SENDFILE_BACKEND   = env.str       ('H2_SENDFILE',      default='django_sendfile
 
 ACCOUNT_EMAIL_VERIFICATION       = env.str('H2_EMAIL_VERIFICATION', default='mandatory')
 
+# Lua interpreters are pooled per thread and replaced after a number of uses
+LUA_POOL_SIZE        = env.int     ('H2_LUA_POOL_SIZE',        default=1)
+LUA_POOL_MAX_USES    = env.int     ('H2_LUA_POOL_MAX_USES',    default=1000)
+LUA_CHUNK_CACHE_SIZE = env.int     ('H2_LUA_CHUNK_CACHE_SIZE', default=128)
+
+# Guesses can be evaluated by guessworker processes instead of while handling the request
+ASYNC_GUESSES        = env.bool    ('H2_ASYNC_GUESSES',        default=False)
+GUESS_QUEUE_URL      = env.str     ('H2_GUESS_QUEUE_URL',      default='redis://redis:6379/3')
+
+# Finishing positions are kept in sorted sets here as teams solve puzzles
+LEADERBOARD_URL      = env.str     ('H2_LEADERBOARD_URL',      default='redis://redis:6379/4')
+
+# Processes are told to discard their local copies of events, domains and the site configuration here when they change
+INVALIDATION_URL     = env.str     ('H2_INVALIDATION_URL',     default='redis://redis:6379/5')
+
+# Views (by URL name) and websocket events (by consumer and handler) which go over these log a warning. Entries for
+# particular handlers override the default, and a limit of None means there is no limit.
+PERFORMANCE_BUDGETS = {
+    'default': {
+        'queries': env.int  ('H2_QUERY_BUDGET', default=50),
+        'seconds': env.float('H2_TIME_BUDGET',  default=1.0),
+    },
+}
+
 try:
     DATABASES = {
         'default': env.db('H2_DATABASE_URL')
@@ -214,6 +238,7 @@ MEDIA_URL = '/media/'
 
 MIDDLEWARE = (
     'django_prometheus.middleware.PrometheusBeforeMiddleware',
+    'hunter2.middleware.InstrumentationMiddleware',
     'events.middleware.TenantMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.http.ConditionalGetMiddleware',
@@ -22,7 +22,7 @@ from io import StringIO
 import builtins
 import sys
 from unittest import expectedFailure
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import freezegun
 import pytest
@@ -30,16 +30,21 @@ from allauth.account.models import EmailAddress
 from allauth.socialaccount.models import SocialAccount
 from django.contrib.sites.models import Site
 from django.core.management import CommandError, call_command
-from django.test import TestCase, override_settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
 from django.utils import timezone
 from faker import Faker
 from gdpr_assist.upgrading import check_migrate_gdpr_anonymised
+from prometheus_client import REGISTRY
 from xmlrunner.extra.djangotestrunner import XMLTestRunner
 
 from teams.factories import TeamMemberFactory
 from hunter2.management.commands import setupsite, anonymise
 from events.test import EventTestCase
+from accounts.models import User
+from .cache import BroadcastLocalCache, LRUCache, VersionedLocalCache
 from .factories import FileFactory
+from .instrumentation import Measurement, assert_within_budget, budget_for, measure
 from .utils import generate_secret_key, load_or_create_secret_key
 
 
@@ -221,6 +226,164 @@ class SecretKeyGenerationTests(TestCase):
             self.assertEqual(secret_key1, secret_key2)
 
 
+class LRUCacheTests(SimpleTestCase):
+    def test_get_or_set(self):
+        cache = LRUCache(maxsize=2)
+        self.assertEqual(cache.get_or_set('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_set('a', lambda: 2), 1)
+        self.assertEqual(cache.cache_info().hits, 1)
+        self.assertEqual(cache.cache_info().misses, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_factory_exception_not_cached(self):
+        cache = LRUCache()
+
+        def factory():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            cache.get_or_set('a', factory)
+        self.assertNotIn('a', cache)
+
+    def test_discard(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.discard('a')
+        cache.discard('b')
+        self.assertEqual(len(cache), 0)
+
+
+class VersionedLocalCacheTests(SimpleTestCase):
+    def test_invalidate(self):
+        cache = VersionedLocalCache()
+        name = f'test:{random.random()}'
+        self.assertEqual(cache.get_or_set(name, lambda: 1), 1)
+        self.assertEqual(cache.get_or_set(name, lambda: 2), 1)
+        cache.invalidate(name)
+        self.assertEqual(cache.get_or_set(name, lambda: 3), 3)
+
+    def test_keys_share_version(self):
+        cache = VersionedLocalCache()
+        name = f'test:{random.random()}'
+        self.assertEqual(cache.get_or_set(name, lambda: 1, key=f'{name}:a'), 1)
+        self.assertEqual(cache.get_or_set(name, lambda: 2, key=f'{name}:b'), 2)
+        cache.invalidate(name)
+        self.assertEqual(cache.get_or_set(name, lambda: 3, key=f'{name}:a'), 3)
+        self.assertEqual(cache.get_or_set(name, lambda: 4, key=f'{name}:b'), 4)
+
+    def test_shared(self):
+        name = f'test:{random.random()}'
+        self.assertEqual(VersionedLocalCache(shared_timeout=60).get_or_set(name, lambda: 1), 1)
+        # Another process finds the value in the shared cache rather than building it again
+        self.assertEqual(VersionedLocalCache(shared_timeout=60).get_or_set(name, lambda: 2), 1)
+        self.assertEqual(VersionedLocalCache().get_or_set(name, lambda: 3), 3)
+
+
+class BroadcastLocalCacheTests(SimpleTestCase):
+    def test_invalidate(self):
+        cache = BroadcastLocalCache('test')
+        self.assertEqual(cache.get_or_set('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_set('b', lambda: 2), 2)
+        cache.invalidate('a')
+        self.assertEqual(cache.get_or_set('a', lambda: 3), 3)
+        self.assertEqual(cache.get_or_set('b', lambda: 4), 2)
+        cache.invalidate()
+        self.assertEqual(cache.get_or_set('b', lambda: 5), 5)
+
+    def test_expiry(self):
+        cache = BroadcastLocalCache('test', timeout=0)
+        self.assertEqual(cache.get_or_set('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_set('a', lambda: 2), 2)
+
+    def test_invalidated_while_building(self):
+        cache = BroadcastLocalCache('test')
+
+        def factory():
+            cache.invalidate('a')
+            return 1
+
+        self.assertEqual(cache.get_or_set('a', factory), 1)
+        # The value may have been built from the old data, so it wasn't kept
+        self.assertEqual(cache.get_or_set('a', lambda: 2), 2)
+
+    def test_listen_survives_errors(self):
+        class Stop(BaseException):
+            pass
+
+        cache = BroadcastLocalCache('test')
+        cache._subscribe = lambda: None
+        self.assertEqual(cache.get_or_set('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_set('b', lambda: 2), 2)
+        broken = MagicMock()
+        broken.listen.side_effect = ValueError
+        working = MagicMock()
+        working.listen.return_value = iter([
+            {'type': 'subscribe', 'data': 1},
+            {'type': 'message', 'data': b'b'},
+        ])
+        redis_client = MagicMock()
+        redis_client.pubsub.side_effect = [broken, working, Stop]
+        with patch('hunter2.cache.client', return_value=redis_client), \
+                patch('hunter2.cache.time.sleep'), \
+                self.assertLogs('hunter2.cache', 'ERROR'), \
+                self.assertRaises(Stop):
+            cache._listen()
+        broken.close.assert_called_once()
+        # Resubscribing discarded everything, since invalidations could have been missed in between
+        self.assertEqual(cache.get_or_set('a', lambda: 3), 3)
+        self.assertEqual(cache.get_or_set('b', lambda: 4), 4)
+
+
+class InstrumentationTests(EventTestCase):
+    def test_measure(self):
+        with patch('hunter2.instrumentation.record') as record:
+            with measure('test'):
+                User.objects.count()
+                User.objects.count()
+        handler, measurement = record.call_args[0]
+        self.assertEqual(handler, 'test')
+        self.assertEqual(measurement.queries, 2)
+        self.assertGreater(measurement.seconds, measurement.db_seconds)
+
+    def test_view_recorded(self):
+        def count():
+            return REGISTRY.get_sample_value('hunter2_handler_queries_count', {'handler': 'event'}) or 0
+
+        self.client.force_login(TeamMemberFactory())
+        before = count()
+        response = self.client.get(reverse('event'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count(), before + 1)
+
+    @override_settings(PERFORMANCE_BUDGETS={'default': {'queries': 5, 'seconds': 1}, 'test': {'queries': 1}})
+    def test_budget_for(self):
+        self.assertEqual(budget_for('test'), Measurement(1, None, 1))
+        self.assertEqual(budget_for('other'), Measurement(5, None, 1))
+
+    @override_settings(PERFORMANCE_BUDGETS={'default': {'queries': 1}})
+    def test_over_budget(self):
+        with assert_within_budget():
+            with measure('test'):
+                User.objects.count()
+
+        with self.assertLogs('hunter2.instrumentation', 'WARNING') as logs:
+            with self.assertRaisesRegex(AssertionError, 'test went over budget: queries was 2, budget is 1'):
+                with assert_within_budget():
+                    with measure('test'):
+                        User.objects.count()
+                        User.objects.count()
+        self.assertEqual(len(logs.output), 1)
+
+
 class SetupSiteManagementCommandTests(TestCase):
     TEST_SITE_NAME   = "Test Site"
     TEST_SITE_DOMAIN = "test-domain.local"
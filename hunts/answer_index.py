@@ -0,0 +1,199 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from hunter2.cache import VersionedLocalCache
+from .runtimes import Runtime
+
+# Enough for every puzzle of a large event
+ANSWER_INDEX_CACHE_SIZE = 512
+
+_indexes = VersionedLocalCache(maxsize=ANSWER_INDEX_CACHE_SIZE)
+
+
+class StaticIndex:
+    """Maps normalised guesses to the IDs of the static validators which accept them
+
+    Validators with the same options normalise guesses the same way, so there is one dictionary per distinct set of
+    options and checking a guess costs one lookup per set of options in use on the puzzle.
+    """
+
+    def __init__(self):
+        self._tables = {}
+
+    def add(self, runtime, validator, id):
+        key = (runtime.case_handling, runtime.strip)
+        if key not in self._tables:
+            self._tables[key] = (runtime, defaultdict(set))
+        _, table = self._tables[key]
+        table[runtime.normalise(validator)].add(id)
+
+    def matches(self, guess):
+        ids = set()
+        for runtime, table in self._tables.values():
+            ids |= table.get(runtime.normalise(guess), set())
+        return ids
+
+
+class RegexIndex:
+    """Matches a guess against many regular expressions at once
+
+    Patterns with the same flags are combined into an alternation, which rejects most guesses in a single scan. Guesses
+    which get through are matched against a second pattern which tries each of the patterns in a lookahead anchored at
+    the start of the guess, with a named group in each lookahead recording which of them matched the whole guess. Patterns
+    which would behave differently once combined are matched separately.
+    """
+
+    # Backreferences, named groups, conditionals and global inline flags would all be affected by combining
+    UNMERGEABLE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)')
+
+    def __init__(self):
+        self._patterns = defaultdict(list)
+        self._combined = []
+        self._separate = []
+
+    def add(self, runtime, validator, id):
+        self._patterns[runtime.flags].append((id, validator))
+
+    def build(self):
+        for flags, patterns in self._patterns.items():
+            mergeable = []
+            for id, pattern in patterns:
+                match = self._compile(pattern, flags)
+                # Invalid patterns could otherwise change the meaning of their neighbours, e.g. by closing a group early
+                if match is None or self.UNMERGEABLE.search(pattern):
+                    self._separate.append((id, match or self._fail(pattern, flags)))
+                else:
+                    mergeable.append((id, pattern, match))
+            if not mergeable:
+                continue
+            try:
+                any_pattern = re.compile('|'.join(f'(?:{pattern})' for _, pattern, _ in mergeable), flags=flags)
+                which_patterns = re.compile(
+                    ''.join(fr'(?:(?=(?P<_{id}>(?:{pattern})\Z))|)' for id, pattern, _ in mergeable),
+                    flags=flags,
+                )
+            except re.error:
+                self._separate.extend((id, match) for id, _, match in mergeable)
+            else:
+                self._combined.append((any_pattern.fullmatch, which_patterns.match))
+
+    @staticmethod
+    def _compile(pattern, flags):
+        try:
+            return re.compile(pattern, flags=flags).fullmatch
+        except re.error:
+            return None
+
+    @staticmethod
+    def _fail(pattern, flags):
+        try:
+            re.compile(pattern, flags=flags)
+        except re.error as error:
+            message = str(error)
+
+        # Raise the same error as the runtime when the pattern is actually used
+        def fail(guess):
+            raise SyntaxError(message)
+        return fail
+
+    def matches(self, guess):
+        ids = set()
+        for any_match, which_match in self._combined:
+            if any_match(guess):
+                groups = which_match(guess).groupdict()
+                ids.update(int(name[1:]) for name, value in groups.items() if value is not None)
+        ids.update(id for id, match in self._separate if match(guess))
+        return ids
+
+
+class AnswerIndex:
+    """Finds the answers and unlock answers on a puzzle which match a guess without validating each in turn
+
+    Static validators are looked up by their normalised text, and regex validators are matched all at once. Other
+    validators are still checked one at a time.
+    """
+
+    def __init__(self, answers, unlockanswers):
+        self.answers = {answer.id: answer for answer in answers}
+        self._static_answers = StaticIndex()
+        self._static_unlockanswers = StaticIndex()
+        self._regex_answers = RegexIndex()
+        self._regex_unlockanswers = RegexIndex()
+        # Kept in ID order, which is the order the answers are preferred in
+        self._other_answers = []
+        self._other_unlockanswers = []
+
+        for answer in sorted(answers, key=lambda a: a.id):
+            if answer.runtime == Runtime.STATIC:
+                self._static_answers.add(answer.runtime.create(answer.options), answer.answer, answer.id)
+            elif answer.runtime == Runtime.REGEX:
+                self._regex_answers.add(answer.runtime.create(answer.options), answer.answer, answer.id)
+            else:
+                self._other_answers.append(answer)
+
+        for unlockanswer in sorted(unlockanswers, key=lambda u: u.id):
+            if unlockanswer.runtime == Runtime.STATIC:
+                self._static_unlockanswers.add(unlockanswer.runtime.create(unlockanswer.options), unlockanswer.guess, unlockanswer.id)
+            elif unlockanswer.runtime == Runtime.REGEX:
+                self._regex_unlockanswers.add(unlockanswer.runtime.create(unlockanswer.options), unlockanswer.guess, unlockanswer.id)
+            else:
+                self._other_unlockanswers.append(unlockanswer)
+
+        self._regex_answers.build()
+        self._regex_unlockanswers.build()
+
+    def correct_answer(self, guess):
+        """Return the first Answer the guess is correct for, or None"""
+        matches = self._static_answers.matches(guess.guess) | self._regex_answers.matches(guess.guess)
+        for answer in self._other_answers:
+            if matches and min(matches) < answer.id:
+                break
+            if answer.validate_guess(guess):
+                matches.add(answer.id)
+                break
+        return self.answers[min(matches)] if matches else None
+
+    def unlockanswer_ids(self, guess):
+        """Return the set of IDs of the UnlockAnswers which the guess matches"""
+        matches = self._static_unlockanswers.matches(guess.guess) | self._regex_unlockanswers.matches(guess.guess)
+        matches.update(u.id for u in self._other_unlockanswers if u.validate_guess(guess))
+        return matches
+
+
+def _index_name(puzzle_id):
+    return f'answer-index:{connection.schema_name}:{puzzle_id}'
+
+
+def answer_index(puzzle_id):
+    """Return the AnswerIndex for a puzzle, building it if this process doesn't have an up-to-date copy"""
+    from .models import Answer, UnlockAnswer
+
+    def build():
+        return AnswerIndex(
+            list(Answer.objects.filter(for_puzzle_id=puzzle_id)),
+            list(UnlockAnswer.objects.filter(unlock__puzzle_id=puzzle_id)),
+        )
+
+    return _indexes.get_or_set(_index_name(puzzle_id), build)
+
+
+def invalidate_answer_index(puzzle_id):
+    name = _index_name(puzzle_id)
+    # Invalidate now so that the rest of this transaction sees the change, and again once it is committed in case another
+    # process rebuilt the index from the old data in the meantime.
+    _indexes.invalidate(name)
+    transaction.on_commit(lambda: _indexes.invalidate(name))
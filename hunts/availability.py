@@ -0,0 +1,244 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import Http404
+
+from hunter2.cache import VersionedLocalCache, bump_version, get_version
+
+# Ledgers are invalidated whenever they change, so this only bounds how long a missed invalidation could last
+AVAILABILITY_TIMEOUT = 60 * 60
+
+# The structure of an event is shared by all its teams, so each process only needs a few
+EVENT_STRUCTURE_CACHE_SIZE = 16
+
+_structures = VersionedLocalCache(maxsize=EVENT_STRUCTURE_CACHE_SIZE)
+
+
+def _structure_name():
+    return f'availability-structure:{connection.schema_name}'
+
+
+def structure_version():
+    """Return a stamp which changes whenever the episodes or puzzles of the current event do"""
+    return get_version(_structure_name())
+
+
+def _ledger_key(team_id):
+    return f'hunter2:availability:{connection.schema_name}:ledger:{team_id}'
+
+
+class EventStructure:
+    """The episodes and puzzles of an event and how they depend on each other, which is the same for every team"""
+
+    def __init__(self, episodes, puzzles, prequels, headstart_from):
+        # Episodes as (id, start_date, parallel) tuples, in the order they are numbered
+        self.episodes = episodes
+        # Puzzles of each episode as (id, start_date, order, headstart_granted) tuples, in the order they are numbered
+        self.puzzles = puzzles
+        # The IDs of the prequels of each episode, and of the episodes each episode gets its headstart from
+        self.prequels = prequels
+        self.headstart_from = headstart_from
+        self._episodes = {episode[0]: episode for episode in episodes}
+        self._puzzles = {puzzle[0]: (episode_id, puzzle) for episode_id, puzzles in puzzles.items() for puzzle in puzzles}
+        self._episode_numbers = {episode[0]: n for n, episode in enumerate(episodes, start=1)}
+        self._puzzle_numbers = {puzzle[0]: n for puzzles in puzzles.values() for n, puzzle in enumerate(puzzles, start=1)}
+
+    @classmethod
+    def build(cls, event):
+        from .models import Episode, EpisodePrequel, Puzzle
+
+        episodes = list(Episode.objects.filter(event=event).order_by('start_date').values_list('id', 'start_date', 'parallel'))
+        episode_ids = [episode[0] for episode in episodes]
+
+        puzzles = defaultdict(list)
+        for episode_id, *puzzle in Puzzle.objects.filter(episode__in=episode_ids).order_by(
+            'episode', 'start_date', 'order'
+        ).values_list('episode_id', 'id', 'start_date', 'order', 'headstart_granted'):
+            puzzles[episode_id].append(tuple(puzzle))
+
+        prequels = defaultdict(set)
+        for parent_id, child_id in EpisodePrequel.objects.filter(child__in=episode_ids).values_list('parent_id', 'child_id'):
+            prequels[child_id].add(parent_id)
+
+        headstart_from = defaultdict(set)
+        for episode_id, from_id in Episode.headstart_from.through.objects.filter(
+            from_episode__in=episode_ids
+        ).values_list('from_episode_id', 'to_episode_id'):
+            headstart_from[episode_id].add(from_id)
+
+        return cls(episodes, dict(puzzles), dict(prequels), dict(headstart_from))
+
+    def episode_id(self, episode_number):
+        """Return the ID of the episode with the given (1-based) number, raising Http404 if there is no such episode"""
+        n = int(episode_number)
+        if not 0 < n <= len(self.episodes):
+            raise Http404
+        return self.episodes[n - 1][0]
+
+    def puzzle_id(self, episode_number, puzzle_number):
+        """Return the ID of the puzzle with the given (1-based) numbers, raising Http404 if there is no such puzzle"""
+        puzzles = self.puzzles.get(self.episode_id(episode_number), [])
+        n = int(puzzle_number)
+        if not 0 < n <= len(puzzles):
+            raise Http404
+        return puzzles[n - 1][0]
+
+    def episode_number(self, episode_id):
+        """Return the (1-based) number of an episode, or None if it isn't part of the event"""
+        return self._episode_numbers.get(episode_id)
+
+    def puzzle_number(self, puzzle_id):
+        """Return the (1-based) number of a puzzle within its episode, or None if it isn't part of the event"""
+        return self._puzzle_numbers.get(puzzle_id)
+
+
+class TeamLedger:
+    """The parts of a team's progress which decide what it can access: the puzzles it has solved and its headstart adjustments
+
+    This doesn't depend on the structure of the event, so it stays valid when that changes.
+    """
+
+    def __init__(self, solved, adjustments):
+        self.solved = solved
+        self.adjustments = adjustments
+
+    @classmethod
+    def build(cls, team):
+        from .models import Headstart, TeamPuzzleProgress
+
+        solved = set(TeamPuzzleProgress.objects.filter(
+            team=team, solved_by__isnull=False
+        ).values_list('puzzle_id', flat=True))
+        adjustments = dict(Headstart.objects.filter(team=team).values_list('episode_id', 'headstart_adjustment'))
+        return cls(solved, adjustments)
+
+
+class TeamAvailability:
+    """Everything needed to work out which episodes and puzzles a team can access, without further queries
+
+    This mirrors `Episode.available`, `Puzzle.available` and the related methods, combining the structure of the event with
+    the team's ledger. Neither depends on the time, so both can be cached until something they were built from changes.
+    """
+
+    def __init__(self, structure, ledger):
+        self.structure = structure
+        self.ledger = ledger
+        self._headstarts = {}
+
+    @classmethod
+    def build(cls, event, team):
+        return cls(EventStructure.build(event), TeamLedger.build(team))
+
+    @property
+    def episodes(self):
+        return self.structure.episodes
+
+    @property
+    def puzzles(self):
+        return self.structure.puzzles
+
+    def episode_id(self, episode_number):
+        return self.structure.episode_id(episode_number)
+
+    def puzzle_id(self, episode_number, puzzle_number):
+        return self.structure.puzzle_id(episode_number, puzzle_number)
+
+    def headstart(self, episode_id):
+        """The headstart the team has on an episode, as `Episode.headstart_applied`"""
+        if episode_id not in self._headstarts:
+            solved = self.ledger.solved
+            granted = sum(
+                (puzzle[3] for from_id in self.structure.headstart_from.get(episode_id, ())
+                 for puzzle in self.structure.puzzles.get(from_id, ()) if puzzle[0] in solved),
+                start=timedelta(0),
+            )
+            self._headstarts[episode_id] = granted + self.ledger.adjustments.get(episode_id, timedelta(0))
+        return self._headstarts[episode_id]
+
+    def episode_started(self, episode_id, now):
+        _, start_date, _ = self.structure._episodes[episode_id]
+        return start_date - self.headstart(episode_id) < now
+
+    def episode_available(self, episode_id, now):
+        """Whether the team can access an episode, as `Episode.available` before the event ends"""
+        if not self.episode_started(episode_id, now):
+            return False
+        return all(
+            puzzle[0] in self.ledger.solved
+            for prequel_id in self.structure.prequels.get(episode_id, ()) for puzzle in self.structure.puzzles.get(prequel_id, ())
+        )
+
+    def puzzle_started(self, puzzle_id, now):
+        episode_id, (_, start_date, _, _) = self.structure._puzzles[puzzle_id]
+        return (start_date or self.structure._episodes[episode_id][1]) - self.headstart(episode_id) < now
+
+    def puzzle_available(self, puzzle_id, now):
+        """Whether the team can access a puzzle, as `Puzzle.available` before the event ends"""
+        episode_id, (_, start_date, order, _) = self.structure._puzzles[puzzle_id]
+        if not self.episode_available(episode_id, now):
+            return False
+        if self.structure._episodes[episode_id][2]:
+            return self.puzzle_started(puzzle_id, now)
+
+        # The puzzles before this one in the linear episode must all be solved. As in the database, puzzles without a
+        # start date are only compared to each other.
+        def before(other_start_date, other_order):
+            if start_date is None or other_start_date is None:
+                return start_date is None and other_start_date is None and other_order < order
+            return other_start_date < start_date or (other_start_date == start_date and other_order < order)
+
+        return self.puzzle_started(puzzle_id, now) and all(
+            puzzle[0] in self.ledger.solved for puzzle in self.structure.puzzles[episode_id] if before(puzzle[1], puzzle[2])
+        )
+
+
+def event_structure(event):
+    """Return the EventStructure of the current event, from this process's cache if it is up to date
+
+    `event` can be the event or its ID.
+    """
+    return _structures.get_or_set(_structure_name(), lambda: EventStructure.build(event))
+
+
+def team_ledger(team):
+    """Return the TeamLedger for a team, from the cache if possible"""
+    key = _ledger_key(team.id)
+    ledger = cache.get(key)
+    if ledger is None:
+        ledger = TeamLedger.build(team)
+        cache.set(key, ledger, AVAILABILITY_TIMEOUT)
+    return ledger
+
+
+def team_availability(event, team):
+    """Return the TeamAvailability for a team at the current event, building only the parts which aren't cached"""
+    return TeamAvailability(event_structure(event), team_ledger(team))
+
+
+def invalidate_team_availability(team_id):
+    key = _ledger_key(team_id)
+    # Invalidate now so that the rest of this transaction sees the change, and again once it is committed in case another
+    # request cached the old state in the meantime.
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def invalidate_availability():
+    """Invalidate the structure of the current event, for when its episodes or puzzles change"""
+    name = _structure_name()
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
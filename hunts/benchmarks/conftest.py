@@ -0,0 +1,72 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import statistics
+import time
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Benchmarks are slow and their results are only meaningful when compared, so they only run when asked for:
+#   H2_BENCHMARK=1 pytest hunts/benchmarks
+if not os.environ.get('H2_BENCHMARK'):
+    collect_ignore_glob = ['test_*.py']
+
+_results = []
+
+
+class Benchmark:
+    def __init__(self, name):
+        self.name = name
+        self.timings = []
+        self.queries = None
+
+    def __call__(self, func, *args, rounds=5, iterations=1, count_queries=False, **kwargs):
+        """Time func over a number of rounds and return its result
+
+        With count_queries, func is called once more beforehand to count the database queries it makes, so that the timings
+        don't include the overhead of capturing them.
+        """
+        if count_queries:
+            with CaptureQueriesContext(connection) as queries:
+                func(*args, **kwargs)
+            self.queries = len(queries)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = func(*args, **kwargs)
+            self.timings.append((time.perf_counter() - start) / iterations)
+        _results.append(self)
+        return result
+
+    @property
+    def median(self):
+        return statistics.median(self.timings)
+
+
+@pytest.fixture
+def benchmark(request):
+    return Benchmark(request.node.nodeid)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _results:
+        return
+    terminalreporter.section('benchmarks')
+    width = max(len(result.name) for result in _results)
+    for result in _results:
+        queries = '' if result.queries is None else f'  queries {result.queries:5d}'
+        terminalreporter.write_line(
+            f'{result.name:<{width}}  min {min(result.timings) * 1000:9.3f}ms  median {result.median * 1000:9.3f}ms{queries}'
+        )
@@ -0,0 +1,102 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from accounts.factories import UserFactory
+from hunts.factories import AnswerFactory, EpisodeFactory, GuessFactory, HintFactory, PuzzleFactory, UnlockFactory
+from hunts.models import Puzzle, TeamPuzzleProgress
+from hunts.runtimes import Runtime
+from hunts.utils import finishing_positions
+from teams.factories import TeamFactory
+
+Scale = namedtuple('Scale', ('teams', 'puzzles', 'hints', 'guesses'))
+Hunt = namedtuple('Hunt', ('episode', 'team', 'puzzle', 'solved', 'finished'))
+
+# Hints are per puzzle and guesses are per team per puzzle reached
+SCALES = {
+    'small': Scale(teams=4, puzzles=4, hints=2, guesses=2),
+    'medium': Scale(teams=10, puzzles=10, hints=5, guesses=5),
+    'large': Scale(teams=30, puzzles=20, hints=10, guesses=10),
+}
+
+
+@pytest.fixture(params=SCALES.keys())
+def hunt(request, event):
+    """A linear, winning episode which half the teams have finished and the rest are part way through
+
+    Each puzzle has an unlock, hints which alternately start at the start of the puzzle and after the unlock, and one hint
+    made obsolete by the unlock. Every team unlocks the unlock on each puzzle they reach. The team benchmarked is a quarter of
+    the way down the list, so it is about half way through the episode.
+    """
+    scale = SCALES[request.param]
+    episode = EpisodeFactory(start_date=timezone.now() - timedelta(days=1), parallel=False, winning=True)
+    puzzles = []
+    for _ in range(scale.puzzles):
+        puzzle = PuzzleFactory(episode=episode, answer_set=None)
+        AnswerFactory(for_puzzle=puzzle, runtime=Runtime.STATIC, answer='answer')
+        unlock = UnlockFactory(puzzle=puzzle, answer__guess='unlock')
+        for h in range(scale.hints):
+            hint = HintFactory(puzzle=puzzle, time=timedelta(minutes=h), start_after=unlock if h % 2 else None)
+        hint.obsoleted_by.add(unlock)
+        puzzles.append(puzzle)
+
+    teams = []
+    for t in range(scale.teams):
+        user = UserFactory()
+        team = TeamFactory(members=user)
+        solved = min(scale.puzzles, 2 * t * scale.puzzles // scale.teams)
+        for puzzle in puzzles[:solved + 1]:
+            for g in range(scale.guesses):
+                GuessFactory(for_puzzle=puzzle, by=user, guess='unlock' if g == 0 else f'wrong{g}')
+            if puzzle in puzzles[:solved]:
+                GuessFactory(for_puzzle=puzzle, by=user, guess='answer')
+        teams.append((team, solved))
+
+    team, solved = teams[scale.teams // 4]
+    finished = sum(1 for _, s in teams if s == scale.puzzles)
+    return Hunt(episode, team, puzzles[solved], solved, finished)
+
+
+def test_progress_hints(benchmark, hunt):
+    # Fetch the progress each time, as a view would, so that nothing is cached on the instance between rounds
+    def hints():
+        return TeamPuzzleProgress.objects.get(team=hunt.team, puzzle=hunt.puzzle).hints()
+
+    assert benchmark(hints, count_queries=True)
+
+
+def test_hint_unlocks_at(benchmark, hunt):
+    def unlocks_at():
+        progress = TeamPuzzleProgress.objects.get(team=hunt.team, puzzle=hunt.puzzle)
+        return [hint.unlocks_at(hunt.team, progress) for hint in hunt.puzzle.hint_set.all()]
+
+    assert all(benchmark(unlocks_at, count_queries=True))
+
+
+def test_episode_next_puzzle(benchmark, hunt):
+    assert benchmark(hunt.episode.next_puzzle, hunt.team, count_queries=True) == hunt.solved + 1
+
+
+def test_puzzle_available(benchmark, hunt):
+    def available():
+        return Puzzle.objects.get(pk=hunt.puzzle.pk).available(hunt.team)
+
+    assert benchmark(available, count_queries=True)
+
+
+def test_finishing_positions(benchmark, event, hunt):
+    assert len(benchmark(finishing_positions, event, count_queries=True)) == hunt.finished
@@ -0,0 +1,70 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import string
+
+import pytest
+
+from hunts.answer_index import RegexIndex
+from hunts.runtimes import Runtime
+
+PATTERNS = 200
+GUESSES = 5000
+
+
+@pytest.fixture(scope='module')
+def patterns():
+    rng = random.Random(0)
+    return [
+        (i, rng.choice([
+            r'{}',
+            r'{}s?',
+            r'(the )?{}',
+            r'{}\d+',
+            r'.*{}.*',
+        ]).format(''.join(rng.choices(string.ascii_lowercase, k=6))))
+        for i in range(1, PATTERNS + 1)
+    ]
+
+
+@pytest.fixture(scope='module')
+def guesses(patterns):
+    rng = random.Random(1)
+    return [
+        rng.choice(patterns)[1].replace('.*', 'xyz').replace('s?', 's').replace('(the )?', 'the ').replace(r'\d+', '42')
+        if rng.random() < 0.1 else ''.join(rng.choices(string.ascii_lowercase, k=8))
+        for _ in range(GUESSES)
+    ]
+
+
+def match_combined(patterns, guesses):
+    index = RegexIndex()
+    runtime = Runtime.REGEX.create({})
+    for id, pattern in patterns:
+        index.add(runtime, pattern, id)
+    index.build()
+    return [index.matches(guess) for guess in guesses]
+
+
+def match_each(patterns, guesses):
+    runtime = Runtime.REGEX.create({})
+    validators = [(id, runtime.compile_validator(pattern)) for id, pattern in patterns]
+    return [{id for id, validate in validators if validate(guess)} for guess in guesses]
+
+
+def test_combined(benchmark, patterns, guesses):
+    assert benchmark(match_combined, patterns, guesses) == match_each(patterns, guesses)
+
+
+def test_each(benchmark, patterns, guesses):
+    benchmark(match_each, patterns, guesses)
@@ -0,0 +1,89 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from datetime import timedelta
+from math import floor
+
+import pytest
+
+from hunts.stats.puzzle_times import PuzzleTimesGenerator
+from hunts.stats.ranking import Ranking
+
+TEAMS = 1000
+PUZZLES = 200
+
+
+@pytest.fixture(scope='module')
+def solve_times():
+    """Solve times in the form the solve time generators aggregate them, for an event where every team solved every puzzle"""
+    rng = random.Random(0)
+    return {
+        puzzle_id: {
+            team_id: timedelta(seconds=rng.lognormvariate(8, 1))
+            for team_id in rng.sample(range(1, TEAMS + 1), TEAMS)
+        } for puzzle_id in range(1, PUZZLES + 1)
+    }
+
+
+def summarise_ranked(solve_times):
+    summaries = {}
+    for puzzle_id, times in solve_times.items():
+        ranking = Ranking(times)
+        summaries[puzzle_id] = (
+            {team_id: (position, PuzzleTimesGenerator.format_solve_time(time)) for position, team_id, time in ranking},
+            ranking.quantile(0.75),
+            ranking.quantile(0.9),
+        )
+    return summaries
+
+
+def _percentile(values, q):
+    N = len(values) - 1
+    idx = q * N
+    lo = floor(idx)
+    h = idx - lo
+    a = values[lo]
+    if h == 0:
+        return a
+    else:
+        b = values[min(lo + 1, N)]
+        return a + h * (b - a)
+
+
+def _format_solve_time(d):
+    hours, r = divmod(d, timedelta(hours=1))
+    minutes, r = divmod(r, timedelta(minutes=1))
+    seconds, _ = divmod(r, timedelta(seconds=1))
+    if hours > 0:
+        return f'{hours:d}:{minutes:02d}:{seconds:02d}'
+    else:
+        return f'{minutes:d}:{seconds:02d}'
+
+
+def summarise_each(solve_times):
+    # How the generators did this before they shared a ranking
+    summaries = {}
+    for puzzle_id, times in solve_times.items():
+        ordered = sorted(times.items(), key=lambda x: x[1])
+        by_team = {team_id: (position, _format_solve_time(time)) for position, (team_id, time) in enumerate(ordered, start=1)}
+        values = list(dict(ordered).values())
+        summaries[puzzle_id] = (by_team, _percentile(values, 0.75), _percentile(values, 0.9))
+    return summaries
+
+
+def test_ranked(benchmark, solve_times):
+    assert benchmark(summarise_ranked, solve_times) == summarise_each(solve_times)
+
+
+def test_each(benchmark, solve_times):
+    benchmark(summarise_each, solve_times)
@@ -0,0 +1,67 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+# The most groups sent to at once when a batch is flushed
+MAX_CONCURRENT_SENDS = 50
+
+_batches = threading.local()
+
+
+def group_send(group, message):
+    """Send a message to a channel layer group, or add it to the current batch if there is one"""
+    batch = getattr(_batches, 'current', None)
+    if batch is None:
+        async_to_sync(get_channel_layer().group_send)(group, message)
+    else:
+        batch.setdefault(group, []).append(message)
+
+
+@contextmanager
+def batched_sends():
+    """Collect the messages sent with group_send inside the block and send them together when it exits
+
+    Each call to group_send outside a batch costs a round-trip to the channel layer, which adds up when a change has to
+    be sent to every team. Batched messages are sent concurrently, except that messages to the same group are still sent
+    in order. Nested batches are merged into the outermost one.
+    """
+    if getattr(_batches, 'current', None) is not None:
+        yield
+        return
+
+    _batches.current = OrderedDict()
+    try:
+        yield
+        batch = _batches.current
+    finally:
+        _batches.current = None
+    if batch:
+        async_to_sync(_send_batch)(batch)
+
+
+async def _send_batch(batch):
+    layer = get_channel_layer()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+    async def send_to_group(group, messages):
+        async with semaphore:
+            for message in messages:
+                await layer.group_send(group, message)
+
+    await asyncio.gather(*(send_to_group(group, messages) for group, messages in batch.items()))
@@ -11,23 +11,26 @@
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 from itertools import chain
+from urllib.parse import quote_plus
 
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import JsonWebsocketConsumer
-from channels.layers import get_channel_layer
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import connections, transaction
 from django.db.models import Prefetch
 from django.db.models.signals import pre_save, post_save, pre_delete, m2m_changed, post_delete
 from django.dispatch import receiver
+from django.urls import reverse
 from django.utils import timezone
 from django_tenants.utils import get_tenant_database_alias
 
 from events.consumers import EventMixin
-from teams.models import Team
 from teams.consumers import TeamMixin
+from .availability import team_availability
+from .broadcast import batched_sends, group_send
 from .models import Guess, TeamPuzzleProgress
 from . import models, utils
 
@@ -36,17 +39,17 @@ def pre_save_handler(func):
     """The purpose of this decorator is to connect signal handlers to consumer class methods.
 
     Before the normal signature of the signal handler, func is passed the class (as a normal classmethod) and "old",
-    the instance in the database before save was called (or None). func will then be called after the current
+    the instance in the database before save was called (or None). The instance must be of a model using
+    TrackedFieldsMixin, so that "old" can usually be provided without a query. func will then be called after the current
     transaction has been successfully committed, ensuring that the instance argument is stored in the database and
-    accessible via database connections in other threads, and that data is ready to be sent to clients."""
+    accessible via database connections in other threads, and that data is ready to be sent to clients. Messages func
+    sends to the channel layer are batched."""
     def inner(cls, sender, instance, *args, **kwargs):
-        try:
-            old = type(instance).objects.get(pk=instance.pk)
-        except ObjectDoesNotExist:
-            old = None
+        old = instance.saved_instance()
 
         def after_commit():
-            func(cls, old, sender, instance, *args, **kwargs)
+            with batched_sends():
+                func(cls, old, sender, instance, *args, **kwargs)
 
         if transaction.get_autocommit():
             # in this case we want to wait until *post* save so the new object is in the db, which on_commit
@@ -93,8 +96,7 @@ class HuntWebsocket(EventMixin, TeamMixin, JsonWebsocketConsumer):
 
     @classmethod
     def _send_message(cls, group, message):
-        layer = get_channel_layer()
-        async_to_sync(layer.group_send)(group, {'type': 'send_json_msg', 'content': message})
+        group_send(group, {'type': 'send_json_msg', 'content': message})
 
     def send_json_msg(self, content, close=False):
         # For some reason consumer dispatch doesn't strip off the outer dictionary with 'type': 'send_json'
@@ -164,7 +166,10 @@ class PuzzleEventWebsocket(HuntWebsocket):
         keywords = self.scope['url_route']['kwargs']
         episode_number = keywords['episode_number']
         puzzle_number = keywords['puzzle_number']
-        self.episode, self.puzzle = utils.event_episode_puzzle(self.scope['tenant'], episode_number, puzzle_number)
+        puzzle_id = team_availability(self.scope['tenant'], self.team).puzzle_id(episode_number, puzzle_number)
+        self.puzzle = models.Puzzle.objects.select_related('episode').get(id=puzzle_id)
+        self.episode = self.puzzle.episode
+        self.episode.event = self.scope['tenant']
         async_to_sync(self.channel_layer.group_add)(
             self._puzzle_groupname(self.puzzle, self.team.id), self.channel_name
         )
@@ -397,8 +402,9 @@ class PuzzleEventWebsocket(HuntWebsocket):
         if raw:  # nocover
             return
 
-        if progress.solved_by and (not old or not old.solved_by):
+        if progress.solved_by_id and (not old or not old.solved_by_id):
             cls.send_solved(progress)
+            AdminWebsocket.send_solved(progress)
 
     # handler: Guess.pre_save
     @pre_save_handler
@@ -409,8 +415,12 @@ class PuzzleEventWebsocket(HuntWebsocket):
             return
         if old:
             return
+        # The guess worker will send this once it has been evaluated
+        if guess.queued:
+            return
 
         cls.send_new_guess(guess)
+        AdminWebsocket.send_new_guess(guess)
 
     def send_old_guesses(self, start):
         guesses = Guess.objects.filter(for_puzzle=self.puzzle, by_team=self.team).order_by('given')
@@ -492,14 +502,14 @@ class PuzzleEventWebsocket(HuntWebsocket):
             return
 
         cls.send_new_unlock(teamunlock)
-        layer = get_channel_layer()
+        AdminWebsocket.send_new_unlock(teamunlock)
         groupname = cls._puzzle_groupname(
             teamunlock.team_puzzle_progress.puzzle,
             teamunlock.team_puzzle_progress.team_id
         )
 
         hints = chain(teamunlock.unlockanswer.unlock.hint_set.all(), teamunlock.unlockanswer.unlock.obsoletes.all())
-        async_to_sync(layer.group_send)(groupname, {
+        group_send(groupname, {
             'type': 'schedule_hint_msg',
             'hint_uids': [str(hint.id) for hint in hints],
             'send_expired': True
@@ -507,18 +517,21 @@ class PuzzleEventWebsocket(HuntWebsocket):
 
     @classmethod
     def _deleted_teamunlock(cls, sender, instance, *args, **kwargs):
-        teamunlock = instance
+        with batched_sends():
+            cls._send_deleted_teamunlock(instance)
+
+    @classmethod
+    def _send_deleted_teamunlock(cls, teamunlock):
         # TODO: this incurs at least one query each time this handler runs, which runs many times in some situations
         # like if the unlock itself is deleted, and/or teams had several guesses unlocking it multiple times
 
-        layer = get_channel_layer()
         unlock = teamunlock.unlockanswer.unlock
         guess = teamunlock.unlocked_by
         progress = teamunlock.team_puzzle_progress
         groupname = cls._puzzle_groupname(progress.puzzle, progress.team_id)
         # First handle dependendent hints
         for hint in unlock.hint_set.seal().all():
-            async_to_sync(layer.group_send)(groupname, {
+            group_send(groupname, {
                 'type': 'cancel_scheduled_hint',
                 'hint_uid': str(hint.id)
             })
@@ -553,7 +566,7 @@ class PuzzleEventWebsocket(HuntWebsocket):
         if not old:
             return
 
-        if unlock.puzzle != old.puzzle:
+        if unlock.puzzle_id != old.puzzle_id:
             raise ValueError("Cannot move unlocks between puzzles")
         # Get list of teams which can see this unlock
         team_ids = models.TeamUnlock.objects.filter(
@@ -571,33 +584,25 @@ class PuzzleEventWebsocket(HuntWebsocket):
         if raw:  # nocover
             return
         hint = instance
-        if old and hint.puzzle != old.puzzle:
+        if old and hint.puzzle_id != old.puzzle_id:
             raise NotImplementedError
 
-        tpps = TeamPuzzleProgress.objects.filter(
-            puzzle=hint.puzzle
-        ).select_related(
-            'team', 'puzzle'
-        ).prefetch_related(
-            'accepted_hints',
-            'teamunlock_set__unlockanswer'
-        ).seal()
-        for progress in tpps:
-            layer = get_channel_layer()
-            if hint.unlocked_by(progress.team, progress):
-                async_to_sync(layer.group_send)(
+        for progress in cls._hint_progresses(hint.puzzle):
+            unlocked_unlocks = cls._unlocked_unlocks(progress)
+            if hint.unlocked_by(progress.team, progress, unlocked_unlocks=unlocked_unlocks):
+                group_send(
                     cls._puzzle_groupname(hint.puzzle, progress.team_id),
                     {'type': 'cancel_scheduled_hint', 'hint_uid': str(hint.id)}
                 )
                 accepted = hint in progress.accepted_hints.all()
-                obsolete = hint.obsolete_for(progress.team, progress)
+                obsolete = hint.obsolete_for(progress.team, progress, unlocked_unlocks)
                 # Rather than try to work out whether the client should change what it's displaying and only update
                 # it if so, just send the info and let it decide.
                 cls.send_new_hint_to_team(progress.team_id, hint, accepted, obsolete)
             else:
-                if old and old.unlocked_by(progress.team, progress):
+                if old and old.unlocked_by(progress.team, progress, unlocked_unlocks=unlocked_unlocks):
                     cls.send_delete_hint(progress.team_id, hint)
-                async_to_sync(layer.group_send)(
+                group_send(
                     cls._puzzle_groupname(hint.puzzle, progress.team_id),
                     {'type': 'schedule_hint_msg', 'hint_uids': [str(hint.id)], 'send_expired': True}
                 )
@@ -607,14 +612,37 @@ class PuzzleEventWebsocket(HuntWebsocket):
     def _deleted_hint(cls, sender, instance, *arg, **kwargs):
         hint = instance
 
-        for team in Team.objects.all():
-            try:
-                progress = hint.puzzle.teampuzzleprogress_set.get(team=team)
-            except TeamPuzzleProgress.DoesNotExist:
-                continue
+        with batched_sends():
+            for progress in cls._hint_progresses(hint.puzzle):
+                if hint.unlocked_by(progress.team, progress, unlocked_unlocks=cls._unlocked_unlocks(progress)):
+                    cls.send_delete_hint(progress.team_id, hint)
+
+    @classmethod
+    def _hint_progresses(cls, puzzle):
+        """Return every team's progress on a puzzle, with what is needed to work out which hints they can see"""
+        return TeamPuzzleProgress.objects.filter(
+            puzzle=puzzle
+        ).select_related(
+            'team', 'puzzle'
+        ).prefetch_related(
+            'accepted_hints',
+            'teamunlock_set__unlockanswer__unlock',
+            'teamunlock_set__unlocked_by',
+        ).seal()
+
+    @staticmethod
+    def _unlocked_unlocks(progress):
+        """Return a mapping from the IDs of the unlocks a team has unlocked to when they unlocked them
 
-            if hint.unlocked_by(team, progress):
-                cls.send_delete_hint(team.id, hint)
+        The progress must have its team unlocks prefetched, as from `_hint_progresses`.
+        """
+        unlocked = {}
+        for teamunlock in progress.teamunlock_set.all():
+            unlock_id = teamunlock.unlockanswer.unlock_id
+            given = teamunlock.unlocked_by.given
+            if unlock_id not in unlocked or given < unlocked[unlock_id]:
+                unlocked[unlock_id] = given
+        return unlocked
 
     # handler: TeamPuzzleProgress.accepted_hints.through.m2m_changed
     @classmethod
@@ -627,6 +655,128 @@ class PuzzleEventWebsocket(HuntWebsocket):
                 cls.send_new_hint_to_team(team.id, hint, True, obsolete)
 
 
+class AdminWebsocket(EventMixin, TeamMixin, JsonWebsocketConsumer):
+    """Tells event admins about guesses, solves and unlocks as they happen
+
+    Each message is built once, when the change is committed, and the channel layer passes it on to every admin, so the
+    admin pages can keep up to date without repeatedly querying for what has changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected = False
+
+    def connect(self):
+        if not self.team.is_admin:
+            self.close()
+            return
+        async_to_sync(self.channel_layer.group_add)(self._admin_groupname(self.scope['tenant'].id), self.channel_name)
+        self.connected = True
+        self.accept()
+
+    def disconnect(self, close_code):
+        if not self.connected:
+            return
+        async_to_sync(self.channel_layer.group_discard)(self._admin_groupname(self.scope['tenant'].id), self.channel_name)
+
+    @classmethod
+    def _admin_groupname(cls, event_id):
+        return f'event-{event_id}.admin'
+
+    @classmethod
+    def _send_message(cls, event_id, message):
+        # The channel layer can only carry plain JSON types
+        message = json.loads(DjangoJSONEncoder().encode(message))
+        group_send(cls._admin_groupname(event_id), {'type': 'send_json_msg', 'content': message})
+
+    def send_json_msg(self, content, close=False):
+        super().send_json(content['content'])
+
+    #
+    # These class methods define the JS server -> client protocol of the websocket
+    #
+
+    @classmethod
+    def guess_json(cls, guess, seat, unlocked, time_on_puzzle):
+        """Describe a guess as it is shown in the admin guess list"""
+        puzzle = guess.for_puzzle
+        return {
+            'add_answer_url': f'{reverse("admin:hunts_answer_add")}?for_puzzle={puzzle.id}&answer={quote_plus(guess.guess)}',
+            'add_unlock_url': f'{reverse("admin:hunts_unlock_add")}?puzzle={puzzle.id}&new_guess={quote_plus(guess.guess)}',
+            'correct': bool(guess.get_correct_for()),
+            'cursor': utils.encode_guess_cursor(guess),
+            'episode': {
+                'id': puzzle.episode.id,
+                'name': puzzle.episode.name,
+            },
+            'given': guess.given,
+            'guess': guess.guess,
+            'puzzle': {
+                'id': puzzle.id,
+                'title': puzzle.title,
+                'admin_url': reverse('admin:hunts_puzzle_change', kwargs={'object_id': puzzle.id}),
+                'site_url': puzzle.get_absolute_url(),
+            },
+            'team': {
+                'id': guess.by_team.id,
+                'name': guess.by_team.name,
+            },
+            'team_admin_view': f'{reverse("admin_team_detail", kwargs={"team_id": guess.by_team.id})}#puzzle-{puzzle.id}',
+            'time_on_puzzle': time_on_puzzle,
+            'user': {
+                'id': guess.by.id,
+                'name': guess.by.username,
+                'seat': seat,
+            },
+            'unlocked': unlocked,
+        }
+
+    @classmethod
+    def send_new_guess(cls, guess):
+        """Describe a new guess to admins
+
+        This happens for every guess, so it is built from what recording the guess already loaded: the user's attendance
+        is remembered from the request, and the progress and whether it unlocked anything are kept on the guess.
+        """
+        event = guess.for_puzzle.episode.event
+        seat = guess.by.attendance_at(event).seat
+        unlocked = getattr(guess, 'unlocked', None)
+        if unlocked is None:
+            unlocked = models.TeamUnlock.objects.filter(unlocked_by=guess).exists()
+        cls._send_message(event.id, {
+            'type': 'new_guess',
+            'content': cls.guess_json(guess, seat, unlocked, guess.time_on_puzzle()),
+        })
+
+    @classmethod
+    def send_solved(cls, progress):
+        # As in Guess.time_on_puzzle, which this can't use without looking up the progress again
+        time_on = progress.solved_by.given - progress.start_time if progress.start_time else timedelta(0)
+        cls._send_message(progress.puzzle.episode.event_id, {
+            'type': 'solved',
+            'content': {
+                'team_id': progress.team_id,
+                'puzzle_id': progress.puzzle_id,
+                'guess': progress.solved_by.guess,
+                'time_on': time_on.total_seconds(),
+            },
+        })
+
+    @classmethod
+    def send_new_unlock(cls, teamunlock):
+        progress = teamunlock.team_puzzle_progress
+        cls._send_message(progress.puzzle.episode.event_id, {
+            'type': 'new_unlock',
+            'content': {
+                'team_id': progress.team_id,
+                'puzzle_id': progress.puzzle_id,
+                'guess': teamunlock.unlocked_by.guess,
+                'unlock': teamunlock.unlockanswer.unlock.text,
+                'unlock_uid': teamunlock.unlockanswer.unlock.compact_id,
+            },
+        })
+
+
 pre_save.connect(PuzzleEventWebsocket._saved_teampuzzleprogress, sender=models.TeamPuzzleProgress)
 pre_save.connect(PuzzleEventWebsocket._saved_teamunlock, sender=models.TeamUnlock)
 pre_save.connect(PuzzleEventWebsocket._saved_guess, sender=models.Guess)
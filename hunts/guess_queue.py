@@ -0,0 +1,144 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django_tenants.utils import schema_context
+
+from events.models import Event
+from . import models
+from .consumers import AdminWebsocket, PuzzleEventWebsocket
+from .signals.progress import evaluate_guess, progress_for, record_guess
+
+QUEUE_KEY = 'hunter2:guesses'
+# Guesses which could not be evaluated are kept here for inspection
+FAILED_KEY = 'hunter2:guesses:failed'
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        # Connections come from a thread-safe pool, so one client serves every thread
+        _client = redis.Redis.from_url(settings.GUESS_QUEUE_URL)
+    return _client
+
+
+def submit_guess(guess):
+    """Save a new guess and have it evaluated
+
+    Normally the guess is evaluated by signal handlers as it is saved. If ASYNC_GUESSES is set it is only saved, and is
+    queued for a guess worker once the current transaction commits.
+    """
+    if not settings.ASYNC_GUESSES:
+        guess.save()
+        return
+
+    guess.queued = True
+    guess.save()
+    transaction.on_commit(lambda: enqueue(guess.id))
+
+
+def enqueue(guess_id):
+    item = json.dumps({'schema': connection.schema_name, 'guess': str(guess_id)})
+    try:
+        client().rpush(QUEUE_KEY, item)
+    except redis.ConnectionError:
+        # Evaluate the guess here instead, as if guesses weren't being queued, rather than leave it waiting for a requeue
+        logger.exception(f'Failed to queue guess {guess_id}')
+        process_guess(guess_id)
+
+
+def send_new_guess(guess):
+    PuzzleEventWebsocket.send_new_guess(guess)
+    AdminWebsocket.send_new_guess(guess)
+
+
+def process_guess(guess_id):
+    """Evaluate a queued guess, record the team's progress and tell the team about it
+
+    Any of the team's guesses on the puzzle which were given before this one and are still waiting are processed first,
+    so that each team's guesses are processed in order however many workers there are. Guesses which have already been
+    processed are skipped, so it is safe to queue a guess more than once.
+    """
+    guess = models.Guess.objects.select_related('for_puzzle', 'by_team').get(id=guess_id)
+    with transaction.atomic():
+        # Other workers wait here until this one has finished with the team's guesses on the puzzle
+        progress, _ = progress_for(guess, lock=True)
+        waiting = models.Guess.objects.filter(
+            by_team=guess.by_team_id, for_puzzle=guess.for_puzzle_id, given__lte=guess.given, queued=True,
+        ).select_related('for_puzzle', 'for_puzzle__episode', 'for_puzzle__episode__event', 'by', 'by_team').order_by('given', 'id')
+        for waiting_guess in waiting:
+            evaluate_guess(waiting_guess)
+            waiting_guess.queued = False
+            # Update rather than save so that the guess's signal handlers don't run again
+            models.Guess.objects.filter(id=waiting_guess.id).update(
+                correct_for=waiting_guess.correct_for, correct_current=True, queued=False,
+            )
+            # Registered first so that the guess is sent before any messages about the progress it made
+            transaction.on_commit(lambda g=waiting_guess: send_new_guess(g))
+            # The guess was counted in the progress summary when it was queued
+            record_guess(waiting_guess, counted=True, progress=progress)
+
+
+def requeue():
+    """Queue every guess which is still waiting to be evaluated, in every event, and return how many there were
+
+    This picks up guesses which never reached the queue or were lost from it, and those which failed to be evaluated.
+    """
+    # Guesses which failed are still waiting, so they are queued again with the rest
+    client().delete(FAILED_KEY)
+    count = 0
+    for event in Event.objects.all():
+        with schema_context(event.schema_name):
+            guess_ids = models.Guess.objects.filter(queued=True).order_by('given', 'id').values_list('id', flat=True)
+            items = [json.dumps({'schema': event.schema_name, 'guess': str(guess_id)}) for guess_id in guess_ids]
+        if items:
+            client().rpush(QUEUE_KEY, *items)
+        count += len(items)
+    return count
+
+
+def work(stop, timeout=1):
+    """Process queued guesses until `stop` is set
+
+    `timeout` is how often, in seconds, to check whether to stop while the queue is empty.
+    """
+    while not stop.is_set():
+        try:
+            popped = client().blpop(QUEUE_KEY, timeout=timeout)
+        except redis.ConnectionError:
+            logger.exception('Lost connection to the guess queue')
+            stop.wait(timeout)
+            continue
+        if popped is None:
+            continue
+        _, item = popped
+        close_old_connections()
+        data = json.loads(item)
+        try:
+            with schema_context(data['schema']):
+                process_guess(data['guess'])
+        except models.Guess.DoesNotExist:
+            # The guess was deleted before we got to it; there's nothing left to do
+            pass
+        except Exception:
+            logger.exception(f'Failed to process queued guess {data["guess"]}')
+            client().rpush(FAILED_KEY, item)
+    connection.close()
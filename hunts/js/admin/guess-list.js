@@ -1,54 +1,108 @@
-import { ElPagination } from 'element-plus'
 import URI from 'urijs'
 
 import HumanDateTime from '../human-datetime.vue'
 import HumanDuration from '../human-duration.vue'
+import {connectAdminSocket} from './socket'
 
 export default {
   components: {
-    'el-pagination': ElPagination,
     'human-datetime': HumanDateTime,
     'human-duration': HumanDuration,
   },
   created: function() {
     this.updateData(true)
+    connectAdminSocket(
+      {'new_guess': this.newGuess},
+      () => {
+        this.live = true
+        // Catch up on anything we missed while we were disconnected
+        this.updateData()
+      },
+      () => {
+        this.live = false
+        this.updateData()
+      },
+    )
   },
   data: function() {
     let search = URI(window.location).search(true)
-    let page = 'page' in search ? search.page : 1
-    delete search.page
+    let cursor = 'cursor' in search ? search.cursor : null
+    delete search.cursor
     return {
-      autoUpdate: true,
-      currentPage: page,
+      autoUpdate: cursor === null,
+      cursor: cursor,
+      // Cursors of the newer pages we have come from, so that we can go back to them
+      newerCursors: [],
       filter: search,
       guesses: [],
+      latest: null,
+      // Whether new guesses are being pushed to us, so that we needn't poll for them
+      live: false,
       rows: 0,
       seating: false,
     }
   },
+  computed: {
+    olderCursor: function() {
+      return this.guesses.length >= this.perPage ? this.guesses[this.guesses.length - 1].cursor : null
+    },
+  },
   methods: {
-    changePage: function(page) {
-      this.autoUpdate = page === 1
-      this.currentPage = page
+    changePage: function(cursor) {
+      this.autoUpdate = cursor === null
+      this.cursor = cursor
       let new_uri = URI(window.location)
-      if (page == 1) {
-        new_uri.removeSearch('page')
+      if (cursor === null) {
+        new_uri.removeSearch('cursor')
       } else {
-        new_uri.setSearch('page', page)
+        new_uri.setSearch('cursor', cursor)
       }
       window.history.pushState('', '', new_uri)
       this.updateData(true)
     },
+    olderPage: function() {
+      this.newerCursors.push(this.cursor)
+      this.changePage(this.olderCursor)
+    },
+    newerPage: function() {
+      this.changePage(this.newerCursors.length ? this.newerCursors.pop() : null)
+    },
+    newestPage: function() {
+      this.newerCursors = []
+      this.changePage(null)
+    },
+    newGuess: function(guess) {
+      if (!this.autoUpdate || this.latest === null) {
+        return
+      }
+      let ids = {episode: guess.episode.id, puzzle: guess.puzzle.id, team: guess.team.id, user: guess.user.id}
+      for (let [type, value] of Object.entries(this.filter)) {
+        if (type in ids && String(ids[type]) !== String(value)) {
+          return
+        }
+      }
+      this.rows += this.prepend([guess])
+      this.latest = guess.cursor
+    },
+    prepend: function(guesses) {
+      // The same guess can arrive over the websocket and in a response
+      let known = new Set(this.guesses.map(g => g.cursor))
+      guesses = guesses.filter(g => !known.has(g.cursor))
+      this.guesses = guesses.concat(this.guesses).slice(0, this.perPage)
+      return guesses.length
+    },
     addFilter: function(type, value) {
       this.filter[type] = value
-      this.currentPage = 1
-      let new_uri = URI(window.location).setSearch(type, value).removeSearch('page')
+      this.cursor = null
+      this.newerCursors = []
+      let new_uri = URI(window.location).setSearch(type, value).removeSearch('cursor')
       window.history.pushState('', '', new_uri)
       this.updateData(true)
     },
     clearFilters: function() {
       this.autoUpdate = true
-      this.currentPage = 1
+      this.cursor = null
+      this.newerCursors = []
       this.filter = {}
       let new_uri = URI(window.location).search({})
       window.history.pushState('', '', new_uri)
@@ -56,20 +110,33 @@ export default {
     },
     updateData: function(force) {
       clearTimeout(this.timer)
-      let page = this.currentPage
       if (force || this.autoUpdate) {
-        let guesses_url = URI(this.href).search({...this.filter, 'page': page})
+        // While following the newest guesses, only fetch the ones we haven't already got
+        let since = !force && this.autoUpdate && this.latest ? this.latest : null
+        let search = {...this.filter}
+        if (since !== null) {
+          search.since = since
+        } else if (this.cursor !== null) {
+          search.cursor = this.cursor
+        }
+        let guesses_url = URI(this.href).search(search)
         let v = this
         fetch(guesses_url).then(
           response => response.json(),
         ).then(
           data => {
-            v.guesses = data.guesses
-            v.rows = data.rows
+            if (since !== null) {
+              // The total isn't sent with new guesses, so keep it up to date ourselves
+              v.rows += v.prepend(data.guesses)
+            } else {
+              v.guesses = data.guesses
+              v.rows = data.rows
+            }
+            v.latest = data.latest
             v.seating = data.seating
           },
         )
-        if (this.autoUpdate) {
+        if (this.autoUpdate && !this.live) {
           this.timer = setTimeout(this.updateData, 5000)
         }
       }
@@ -88,7 +155,11 @@ export default {
   watch: {
     autoUpdate: function(on) {
       if (on) {
-        this.updateData()
+        if (this.cursor === null) {
+          this.updateData()
+        } else {
+          this.newestPage()
+        }
       }
     },
   },
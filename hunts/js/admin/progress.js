@@ -3,6 +3,7 @@ import 'bootstrap/js/dist/collapse'
 import ProgressState from './state.vue'
 import {DateTime, Duration} from 'luxon'
 import { ElSlider } from 'element-plus'
+import {connectAdminSocket} from './socket'
 
 export default {
   components: {
@@ -72,6 +73,20 @@ export default {
   },
   created: function() {
     this.updateData(true)
+    connectAdminSocket(
+      {
+        'new_guess': this.newGuess,
+        'solved': this.solved,
+      },
+      () => {
+        this.live = true
+        this.updateData()
+      },
+      () => {
+        this.live = false
+        this.updateData()
+      },
+    )
   },
   props: ['href'],
   data () {
@@ -79,6 +94,8 @@ export default {
       puzzles: [],
       team_progress: [],
       autoUpdate: true,
+      // Whether guesses and solves are being pushed to us, so that we only need to refresh occasionally
+      live: false,
       filters: {
         episodes: [],
         open_puzzles: [-Infinity, Infinity],
@@ -90,6 +107,35 @@ export default {
   },
   methods: {
     now: DateTime.local,
+    puzzleState: function(team_id, puzzle_id) {
+      let team = this.team_progress.find(team => team.id === team_id)
+      return team === undefined ? undefined : team.progress.find(state => state.puzzle_id === puzzle_id)
+    },
+    newGuess: function(guess) {
+      if (!this.autoUpdate) return
+      let state = this.puzzleState(guess.team.id, guess.puzzle.id)
+      if (state === undefined || state.state === 'not_opened') {
+        // We don't know enough about the team's progress to fill in, so fetch it
+        this.updateData()
+        return
+      }
+      state.guesses += 1
+      if (state.state === 'open') {
+        state.latest_guess = guess.given
+      }
+    },
+    solved: function(content) {
+      if (!this.autoUpdate) return
+      let state = this.puzzleState(content.team_id, content.puzzle_id)
+      if (state === undefined) {
+        this.updateData()
+        return
+      }
+      state.state = 'solved'
+      state.time_on = content.time_on
+      state.latest_guess = null
+      state.hints_scheduled = null
+    },
     clearFilters: function() {
       this.filters = {
         episodes: [],
@@ -168,7 +214,8 @@ export default {
           },
         )
         if (this.autoUpdate) {
-          this.timer = setTimeout(this.updateData, 5000)
+          // Hints and the time teams have spent on puzzles still have to be refreshed while we're live
+          this.timer = setTimeout(this.updateData, this.live ? 60000 : 5000)
         }
       }
     },
@@ -0,0 +1,26 @@
+import RobustWebSocket from 'robust-websocket'
+
+// Connect to the admin websocket, which sends guesses, solves and unlocks as they happen.
+// `handlers` maps message types to functions which are passed the message content.
+export function connectAdminSocket(handlers, onOpen, onClose) {
+  let ws_scheme = (window.location.protocol == 'https:' ? 'wss' : 'ws') + '://'
+  let sock = new RobustWebSocket(
+    ws_scheme + window.location.host + '/ws/hunt/admin/', undefined,
+    {
+      timeout: 30000,
+      shouldReconnect: function(event, ws) {
+        if (event.code === 1008 || event.code === 1011) return
+        return (ws.attempts < 7 ? Math.pow(2, ws.attempts) * 500 : 32000) * (1 + Math.random() * 0.1)
+      },
+    },
+  )
+  sock.onmessage = function(e) {
+    let data = JSON.parse(e.data)
+    if (data.type in handlers) {
+      handlers[data.type](data.content)
+    }
+  }
+  sock.onopen = onOpen
+  sock.onclose = onClose
+  return sock
+}
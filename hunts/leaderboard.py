@@ -0,0 +1,212 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Finishing positions of teams, kept up to date in Redis sorted sets as they solve puzzles
+
+There is a sorted set for each episode and one for the whole event, each in two variants: one which includes teams who
+finished late, and one which doesn't. Teams are scored by the time they finished, so a team's position is its rank in
+the set. The sets are built from the database the first time they are needed after the event's structure changes, and
+updated a team at a time after that.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+from django_tenants.utils import schema_context
+
+from teams.models import TeamRole
+from .availability import structure_version
+
+# The sets are rebuilt from scratch at least this often, so this bounds how long a missed update could last
+LEADERBOARD_TIMEOUT = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        # Connections come from a thread-safe pool, so one client serves every thread
+        _client = redis.Redis.from_url(settings.LEADERBOARD_URL)
+    return _client
+
+
+def _prefix():
+    # Changes to the event's structure can change who has finished anything, so they start a fresh set of leaderboards
+    return f'hunter2:leaderboard:{connection.schema_name}:{structure_version()}'
+
+
+def _key(prefix, episode_id, include_late):
+    scope = 'event' if episode_id is None else f'episode:{episode_id}'
+    return f'{prefix}:{scope}:{"late" if include_late else "on-time"}'
+
+
+def _built_key(prefix):
+    return f'{prefix}:built'
+
+
+def _episodes():
+    """Return a dictionary of {episode_id: (winning, number of puzzles)} for the current event"""
+    from .models import Episode
+
+    return {
+        episode_id: (winning, puzzle_count)
+        for episode_id, winning, puzzle_count in Episode.objects.annotate(
+            puzzle_count=Count('puzzle'),
+        ).values_list('id', 'winning', 'puzzle_count')
+    }
+
+
+def _finishes(episodes, team_id=None):
+    """Return a dictionary of {(team_id, episode_id): (finish time, on-time finish time)} for player teams
+
+    Either time is None if the team hasn't finished the episode in that sense; as in `Episode.finished_times`, a team has
+    finished on time if it solved every puzzle in the episode without any of its progress being marked late.
+    """
+    from .models import TeamPuzzleProgress
+
+    progresses = TeamPuzzleProgress.objects.filter(solved_by__isnull=False, team__role=TeamRole.PLAYER)
+    if team_id is not None:
+        progresses = progresses.filter(team_id=team_id)
+    on_time = Q(late=False)
+    finishes = {}
+    for team, episode_id, solved, solved_on_time, last, last_on_time in progresses.order_by().values(
+        'team_id', 'puzzle__episode_id',
+    ).annotate(
+        solved=Count('id'),
+        solved_on_time=Count('id', filter=on_time),
+        last=Max('solved_by__given'),
+        last_on_time=Max('solved_by__given', filter=on_time),
+    ).values_list('team_id', 'puzzle__episode_id', 'solved', 'solved_on_time', 'last', 'last_on_time'):
+        if episode_id not in episodes:
+            continue
+        _, puzzle_count = episodes[episode_id]
+        finishes[team, episode_id] = (
+            last if solved == puzzle_count else None,
+            last_on_time if solved_on_time == puzzle_count else None,
+        )
+    return finishes
+
+
+def _standings(episodes, finishes):
+    """Return a dictionary of {(episode_id, include_late): {team_id: score}} from the output of `_finishes`
+
+    The standings for the whole event have an episode_id of None. As in `utils.finishing_positions`, a team has finished
+    the event when it has finished every winning episode, at the latest of the times it finished them.
+    """
+    standings = defaultdict(dict)
+    for (team_id, episode_id), times in finishes.items():
+        for include_late, time in zip((True, False), times):
+            if time is not None:
+                standings[episode_id, include_late][team_id] = time.timestamp()
+
+    winning = [episode_id for episode_id, (is_winning, _) in episodes.items() if is_winning]
+    if winning:
+        for include_late in (True, False):
+            for team_id in {team_id for team_id, _ in finishes}:
+                scores = [standings[episode_id, include_late].get(team_id) for episode_id in winning]
+                if None not in scores:
+                    standings[None, include_late][team_id] = max(scores)
+    return standings
+
+
+def _rebuild(prefix):
+    episodes = _episodes()
+    standings = _standings(episodes, _finishes(episodes))
+    # Replace the sets all at once, so that readers never see a partly built leaderboard
+    pipe = client().pipeline(transaction=True)
+    for episode_id in [None, *episodes]:
+        for include_late in (True, False):
+            key = _key(prefix, episode_id, include_late)
+            pipe.delete(key)
+            scores = standings.get((episode_id, include_late))
+            if scores:
+                pipe.zadd(key, scores)
+                pipe.expire(key, LEADERBOARD_TIMEOUT)
+    pipe.set(_built_key(prefix), 1, ex=LEADERBOARD_TIMEOUT)
+    pipe.execute()
+
+
+def rebuild():
+    """Build the leaderboards of the current event from the database, replacing whatever was there"""
+    _rebuild(_prefix())
+
+
+def _update_team(team_id):
+    prefix = _prefix()
+    episodes = _episodes()
+    standings = _standings(episodes, _finishes(episodes, team_id))
+    pipe = client().pipeline(transaction=True)
+    for episode_id in [None, *episodes]:
+        for include_late in (True, False):
+            key = _key(prefix, episode_id, include_late)
+            score = standings.get((episode_id, include_late), {}).get(team_id)
+            if score is None:
+                pipe.zrem(key, team_id)
+            else:
+                pipe.zadd(key, {team_id: score})
+                pipe.expire(key, LEADERBOARD_TIMEOUT)
+    pipe.execute()
+
+
+def update_team(team_id):
+    """Bring a team's positions on the leaderboards of the current event up to date with the database
+
+    This happens once the current transaction commits, since the leaderboards are shared with every other process and
+    must not show changes which could yet be rolled back.
+    """
+    schema_name = connection.schema_name
+
+    def update():
+        try:
+            with schema_context(schema_name):
+                _update_team(team_id)
+        except redis.ConnectionError:
+            # The leaderboards will pick up the change when they are next rebuilt
+            logger.exception(f'Failed to update the leaderboard positions of team {team_id}')
+
+    transaction.on_commit(update)
+
+
+def _leaderboard(episode_id, include_late):
+    prefix = _prefix()
+    if not client().exists(_built_key(prefix)):
+        _rebuild(prefix)
+    return _key(prefix, episode_id, include_late)
+
+
+def position(team_id, episode_id=None, include_late=False):
+    """Return the 0-based position in which the team finished the episode, or the event if episode_id is None
+
+    Returns None if the team hasn't finished.
+    """
+    return client().zrank(_leaderboard(episode_id, include_late), team_id)
+
+
+def finished_team_ids(episode_id=None, include_late=False):
+    """Return the IDs of the teams who have finished the episode, or the event if episode_id is None, in finishing order"""
+    return [int(team_id) for team_id in client().zrange(_leaderboard(episode_id, include_late), 0, -1)]
+
+
+def top(count, episode_id=None, include_late=False):
+    """Return a list of (team_id, finish time) for the first `count` teams to finish the episode or event"""
+    return [
+        (int(team_id), datetime.fromtimestamp(score, tz=timezone.utc))
+        for team_id, score in client().zrange(_leaderboard(episode_id, include_late), 0, count - 1, withscores=True)
+    ]
@@ -0,0 +1,325 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Simulate a live hunt against a running server, to see how it copes with a given number of teams"""
+
+import base64
+import http.client
+import json
+import os
+import random
+import secrets
+import socket
+import ssl
+import string
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from importlib import import_module
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.urls import reverse
+from django.utils import timezone
+from django_tenants.utils import tenant_context
+
+from accounts.models import User
+from events.factories import EventFactory
+from teams.factories import TeamMemberFactory
+from . import utils
+from .factories import AnswerFactory, EpisodeFactory, HintFactory, PuzzleFactory
+from .runtimes import Runtime
+from .stats.ranking import quantile
+
+Target = namedtuple('Target', ('puzzle_url', 'answer_url', 'accept_hint_url', 'episode_content_url', 'websocket_path', 'answer', 'hint_ids'))
+Scenario = namedtuple('Scenario', ('event', 'host', 'event_url', 'targets', 'users'))
+EndpointSummary = namedtuple('EndpointSummary', ('endpoint', 'count', 'errors', 'throughput', 'p50', 'p95', 'p99'))
+
+
+def build_scenario(teams, episodes, puzzles, hints):
+    """Create an event with the given number of teams, episodes, puzzles per episode and hints per puzzle
+
+    Everything in the event is open from the start, and every hint is unlocked as soon as its puzzle is, so that the teams
+    can go straight through it. Returns a Scenario describing where the teams should go and what they should say.
+    """
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    event = EventFactory(
+        name=f'Load test {stamp}',
+        schema_name=f'loadtest{stamp}',
+        end_date=timezone.now() + timedelta(days=1),
+    )
+    with tenant_context(event):
+        targets = []
+        start = timezone.now() - timedelta(days=1)
+        for e in range(episodes):
+            # Sequential, so that teams have to solve the puzzles in order as they would in a real hunt
+            episode = EpisodeFactory(start_date=start + timedelta(minutes=e), parallel=False)
+            for p in range(puzzles):
+                puzzle = PuzzleFactory(episode=episode, answer_set=None)
+                answer = AnswerFactory(for_puzzle=puzzle, runtime=Runtime.STATIC)
+                hint_ids = [
+                    utils.encode_uuid(HintFactory(puzzle=puzzle, time=timedelta(0), start_after=None).id)
+                    for _ in range(hints)
+                ]
+                kwargs = {'episode_number': e + 1, 'puzzle_number': p + 1}
+                targets.append(Target(
+                    puzzle_url=reverse('puzzle', kwargs=kwargs),
+                    answer_url=reverse('answer', kwargs=kwargs),
+                    accept_hint_url=reverse('accept_hint', kwargs=kwargs),
+                    episode_content_url=reverse('episode_content', kwargs={'episode_number': e + 1}),
+                    # Websocket routes live in their own router, which reverse() knows nothing about
+                    websocket_path=f'/ws/hunt/ep/{e + 1}/pz/{p + 1}/',
+                    answer=answer.answer,
+                    hint_ids=hint_ids,
+                ))
+        users = [TeamMemberFactory() for _ in range(teams)]
+        event_url = reverse('event')
+    return Scenario(event, event.get_primary_domain().domain, event_url, targets, users)
+
+
+def destroy_scenario(scenario):
+    user_ids = [user.id for user in scenario.users]
+    scenario.event.delete(force_drop=True)
+    User.objects.filter(id__in=user_ids).delete()
+
+
+def log_in(user):
+    """Create a session for the user directly, and return its key"""
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+class Recorder:
+    """Collects the latency of every request made during the run, by endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+        self.messages = 0
+
+    def record(self, endpoint, latency, ok):
+        with self._lock:
+            self._latencies[endpoint].append(latency)
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def message(self):
+        with self._lock:
+            self.messages += 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            return [
+                EndpointSummary(
+                    endpoint,
+                    len(latencies),
+                    self._errors[endpoint],
+                    len(latencies) / elapsed,
+                    *(quantile(sorted(latencies), q) for q in (0.5, 0.95, 0.99)),
+                )
+                for endpoint, latencies in sorted(self._latencies.items())
+            ]
+
+
+class Websocket:
+    """Just enough of an RFC 6455 client to hold a connection open and count the messages the server sends down it"""
+
+    def __init__(self, address, host, path, headers, use_ssl, on_message):
+        self._socket = socket.create_connection(address)
+        if use_ssl:
+            self._socket = ssl.create_default_context().wrap_socket(self._socket, server_hostname=host)
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        request = [
+            f'GET {path} HTTP/1.1',
+            f'Host: {host}',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            f'Sec-WebSocket-Key: {key}',
+            'Sec-WebSocket-Version: 13',
+        ] + [f'{name}: {value}' for name, value in headers.items()]
+        self._socket.sendall(('\r\n'.join(request) + '\r\n\r\n').encode('ascii'))
+        self._file = self._socket.makefile('rb')
+        status = self._file.readline().decode('latin-1')
+        if status.split()[1:2] != ['101']:
+            self._socket.close()
+            raise ConnectionError(f'Websocket handshake failed: {status.strip()}')
+        while self._file.readline() not in (b'\r\n', b''):
+            pass
+        self._on_message = on_message
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        try:
+            while True:
+                header = self._file.read(2)
+                if len(header) < 2:
+                    return
+                opcode = header[0] & 0x0F
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(self._file.read(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(self._file.read(8), 'big')
+                if header[1] & 0x80:
+                    self._file.read(4)
+                self._file.read(length)
+                if opcode == 0x8:
+                    return
+                if opcode in (0x1, 0x2):
+                    self._on_message()
+        except (OSError, ValueError):
+            # The socket was closed underneath us
+            return
+
+    def close(self):
+        try:
+            # Client frames must be masked, even when they have no payload
+            self._socket.sendall(bytes([0x88, 0x80]) + os.urandom(4))
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class SimulatedTeam:
+    """Works through the puzzles of a scenario in order as a single member of a team would, via the server's HTTP and websocket endpoints"""
+
+    def __init__(self, scenario, session_key, url, recorder, stop, think_time, correct_rate):
+        self.scenario = scenario
+        self.recorder = recorder
+        self.stop = stop
+        self.think_time = think_time
+        self.correct_rate = correct_rate
+        self.solved = 0
+
+        parts = urlsplit(url)
+        self.use_ssl = parts.scheme == 'https'
+        self.address = (parts.hostname, parts.port or (443 if self.use_ssl else 80))
+        self.origin = f'{parts.scheme}://{scenario.host}'
+        csrf_token = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(32))
+        self.headers = {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={csrf_token}',
+            'X-CSRFToken': csrf_token,
+        }
+        self._connection = None
+
+    def _connect(self):
+        Connection = http.client.HTTPSConnection if self.use_ssl else http.client.HTTPConnection
+        return Connection(*self.address, timeout=60)
+
+    def request(self, endpoint, method, path, data=None):
+        """Make a request, recording how long it took, and return the status and decoded body (or None if it failed)"""
+        headers = {'Host': self.scenario.host, 'Referer': self.origin + path, **self.headers}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self._connection is None:
+            self._connection = self._connect()
+        start = time.perf_counter()
+        try:
+            self._connection.request(method, path, body=body, headers=headers)
+            response = self._connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.recorder.record(endpoint, time.perf_counter() - start, False)
+            self._connection.close()
+            self._connection = None
+            return None, None
+        # Rejected guesses and hints are part of normal play, and only server errors count against the endpoint
+        self.recorder.record(endpoint, time.perf_counter() - start, response.status < 500)
+        return response.status, content
+
+    def websocket(self, path):
+        start = time.perf_counter()
+        try:
+            ws = Websocket(
+                self.address, self.scenario.host, path, {'Origin': self.origin, 'Cookie': self.headers['Cookie']}, self.use_ssl, self.recorder.message,
+            )
+        except OSError:
+            self.recorder.record('websocket', time.perf_counter() - start, False)
+            return None
+        self.recorder.record('websocket', time.perf_counter() - start, True)
+        return ws
+
+    def think(self):
+        """Wait for about the think time, returning True if the run has been stopped in the meantime"""
+        return self.stop.wait(random.uniform(0.5, 1.5) * self.think_time)  # nosec random is fine for simulation
+
+    def run(self):
+        try:
+            self.request('event', 'GET', self.scenario.event_url)
+            for target in self.scenario.targets:
+                if not self.solve(target):
+                    return
+        finally:
+            if self._connection is not None:
+                self._connection.close()
+
+    def solve(self, target):
+        """Play a puzzle until it is solved, returning False if the run is stopped first"""
+        self.request('puzzle', 'GET', target.puzzle_url)
+        ws = self.websocket(target.websocket_path)
+        try:
+            hint_ids = list(target.hint_ids)
+            while True:
+                if self.think():
+                    return False
+                correct = random.random() < self.correct_rate  # nosec random is fine for simulation
+                guess = target.answer if correct else secrets.token_hex(8)
+                status, content = self.request('answer', 'POST', target.answer_url, {'answer': guess})
+                if status == 422:
+                    # A queued guess was correct, and we're only finding out now
+                    break
+                if status == 200 and json.loads(content).get('correct') == 'true':
+                    break
+                if hint_ids:
+                    self.request('accept_hint', 'POST', target.accept_hint_url, {'id': hint_ids.pop(0)})
+        finally:
+            if ws is not None:
+                ws.close()
+        self.solved += 1
+        self.request('episode_content', 'GET', target.episode_content_url)
+        self.request('event', 'GET', self.scenario.event_url)
+        return True
+
+
+def run(scenario, url, duration, think_time, correct_rate, stop=None):
+    """Drive one simulated team per user in the scenario against the server for up to duration seconds
+
+    Returns the Recorder holding the results, the simulated teams, and how long the run actually lasted.
+    """
+    stop = stop or threading.Event()
+    recorder = Recorder()
+    teams = [
+        SimulatedTeam(scenario, log_in(user), url, recorder, stop, think_time, correct_rate)
+        for user in scenario.users
+    ]
+    threads = [threading.Thread(target=team.run, daemon=True) for team in teams]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    deadline = start + duration
+    for thread in threads:
+        thread.join(max(0, deadline - time.perf_counter()))
+    stop.set()
+    for thread in threads:
+        # Let in-flight requests finish so that they are recorded
+        thread.join()
+    return recorder, teams, time.perf_counter() - start
@@ -0,0 +1,61 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import signal
+import threading
+
+from django.core.management import BaseCommand
+
+from ...guess_queue import requeue, work
+
+
+class Command(BaseCommand):
+    help = 'Evaluate guesses queued by the answer view when H2_ASYNC_GUESSES is set'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t', '--threads',
+            dest='threads',
+            type=int,
+            default=4,
+            help='Number of guesses to evaluate concurrently',
+        )
+        parser.add_argument(
+            '--requeue',
+            action='store_true',
+            help='Queue every guess which is waiting to be evaluated again, including those which failed, then exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            self.stdout.write(f'Queued {requeue()} guesses')
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+
+        workers = [threading.Thread(target=work, args=(stop, ), name=f'guessworker-{i}') for i in range(options['threads'])]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Evaluating queued guesses with {len(workers)} threads')
+
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Let each worker finish the guess it is evaluating
+            stop.set()
+            for worker in workers:
+                worker.join()
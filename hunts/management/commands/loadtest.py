@@ -0,0 +1,91 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import signal
+import threading
+
+from django.core.management import BaseCommand, CommandError
+
+from ... import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Create an event and simulate teams playing it against a running server, reporting the latency of each endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            dest='url',
+            type=str,
+            default='http://localhost:8080',
+            help='Address of the server to test. Requests are sent with the host name of the event that is created',
+        )
+        parser.add_argument('--teams', dest='teams', type=int, default=20, help='Number of teams playing at once')
+        parser.add_argument('--episodes', dest='episodes', type=int, default=2, help='Number of episodes in the event')
+        parser.add_argument('--puzzles', dest='puzzles', type=int, default=5, help='Number of puzzles in each episode')
+        parser.add_argument('--hints', dest='hints', type=int, default=2, help='Number of hints on each puzzle')
+        parser.add_argument('--duration', dest='duration', type=float, default=60, help='Number of seconds to run for')
+        parser.add_argument(
+            '--think-time',
+            dest='think_time',
+            type=float,
+            default=6,
+            help='Average number of seconds each team waits between guesses. Guesses less than 5s apart are rejected by the server',
+        )
+        parser.add_argument(
+            '--correct-rate',
+            dest='correct_rate',
+            type=float,
+            default=0.2,
+            help='Proportion of guesses which are correct',
+        )
+        parser.add_argument(
+            '--keep',
+            dest='keep',
+            action='store_true',
+            help='Keep the event and its users afterwards, rather than deleting them',
+        )
+
+    def handle(self, *args, **options):
+        if min(options['teams'], options['episodes'], options['puzzles']) < 1:
+            raise CommandError('--teams, --episodes and --puzzles must be at least 1')
+        if not 0 < options['correct_rate'] <= 1:
+            raise CommandError('--correct-rate must be greater than 0 and at most 1')
+
+        self.stdout.write('Creating event...')
+        scenario = loadtest.build_scenario(options['teams'], options['episodes'], options['puzzles'], options['hints'])
+        self.stdout.write(f'Created {scenario.host} with {len(scenario.targets)} puzzles and {len(scenario.users)} teams')
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        try:
+            recorder, teams, elapsed = loadtest.run(
+                scenario, options['url'], options['duration'], options['think_time'], options['correct_rate'], stop,
+            )
+        except KeyboardInterrupt:
+            stop.set()
+            raise
+        finally:
+            if not options['keep']:
+                loadtest.destroy_scenario(scenario)
+
+        self.stdout.write(f'{"endpoint":<16}{"count":>8}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+        for row in recorder.summary(elapsed):
+            self.stdout.write(
+                f'{row.endpoint:<16}{row.count:>8}{row.errors:>8}{row.throughput:>10.2f}'
+                f'{row.p50 * 1000:>10.1f}{row.p95 * 1000:>10.1f}{row.p99 * 1000:>10.1f}'
+            )
+        solved = sum(team.solved for team in teams)
+        self.stdout.write(
+            f'{solved} puzzles solved and {recorder.messages} websocket messages received in {elapsed:.1f}s; '
+            f'{sum(team.solved == len(scenario.targets) for team in teams)} of {len(teams)} teams finished'
+        )
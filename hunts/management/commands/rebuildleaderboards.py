@@ -0,0 +1,42 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management import BaseCommand, CommandError
+from django_tenants.utils import tenant_context
+
+from events.models import Event
+from ... import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the leaderboards of finishing positions from the database, for when they might have got out of step with it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'events',
+            nargs='*',
+            type=str,
+            help='Schema names of the events to rebuild the leaderboards of (default: all events)',
+        )
+
+    def handle(self, *args, **options):
+        events = Event.objects.all()
+        if options['events']:
+            events = events.filter(schema_name__in=options['events'])
+            missing = set(options['events']) - {event.schema_name for event in events}
+            if missing:
+                raise CommandError(f'No such event: {", ".join(sorted(missing))}')
+
+        for event in events:
+            with tenant_context(event):
+                leaderboard.rebuild()
+            self.stdout.write(f'Rebuilt the leaderboards of {event.schema_name}')
@@ -0,0 +1,132 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django_tenants.utils import tenant_context
+
+from events.models import Event
+from ...models import Episode
+from ...stats import __all__ as stats_generators
+from ...stats.abstract import IncrementalGenerator
+
+
+def warm(schema_name, Generator, episode_id, rebuild):
+    """Bring one generator's cached data up to date and return its ID and how long that took"""
+    event = Event.objects.get(schema_name=schema_name)
+    with tenant_context(event):
+        episode = Episode.objects.get(id=episode_id) if episode_id is not None else None
+        generator = Generator(event=event, episode=episode)
+        start = time.perf_counter()
+        if rebuild and isinstance(generator, IncrementalGenerator):
+            generator.rebuild()
+        else:
+            generator.refresh()
+        return generator.id, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Generate the stats for each event and each of its episodes ahead of time, so that nobody has to wait for them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'events',
+            nargs='*',
+            type=str,
+            help='Schema names of the events to generate stats for (default: all events)',
+        )
+        parser.add_argument(
+            '-p', '--processes',
+            dest='processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of generators to run concurrently, each in its own process. With 1 they are run one at a time in this process',
+        )
+        parser.add_argument(
+            '-i', '--interval',
+            dest='interval',
+            type=int,
+            default=None,
+            help='Keep running, generating the stats again this many seconds after each run finishes',
+        )
+        parser.add_argument(
+            '--rebuild',
+            dest='rebuild',
+            action='store_true',
+            help='Discard the aggregates of incremental generators and consume every guess and solve again, to pick up changes to existing ones',
+        )
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+
+        pool = ProcessPoolExecutor(max_workers=options['processes']) if options['processes'] > 1 else None
+        try:
+            while True:
+                self.warm_all(options['events'], options['rebuild'], pool)
+                if options['interval'] is None or stop.wait(options['interval']):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def warm_all(self, schema_names, rebuild, pool):
+        events = Event.objects.all()
+        if schema_names:
+            events = events.filter(schema_name__in=schema_names)
+            missing = set(schema_names) - {event.schema_name for event in events}
+            if missing:
+                raise CommandError(f'No such event: {", ".join(sorted(missing))}')
+
+        jobs = []
+        for event in events:
+            with tenant_context(event):
+                episodes = [None] + list(Episode.objects.filter(no_stats=False).values_list('id', flat=True))
+            jobs += [(event.schema_name, Generator, episode, rebuild) for episode in episodes for Generator in stats_generators]
+
+        start = time.perf_counter()
+        if pool is None:
+            results = (self.attempt(warm, *job) for job in jobs)
+        else:
+            # Worker processes are forked from this one, and must not share its database connections
+            connections.close_all()
+            futures = [pool.submit(warm, *job) for job in jobs]
+            results = (self.attempt(future.result) for future in futures)
+
+        failed = 0
+        for (schema_name, Generator, episode, _), result in zip(jobs, results):
+            where = schema_name if episode is None else f'{schema_name} episode {episode}'
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f'{where}: {Generator.__name__} failed: {result!r}')
+            else:
+                id, elapsed = result
+                self.stdout.write(f'{where}: {id} took {elapsed:.2f}s')
+        self.stdout.write(f'Generated {len(jobs) - failed} of {len(jobs)} stats in {time.perf_counter() - start:.2f}s')
+
+    @staticmethod
+    def attempt(function, *args):
+        # Report failures rather than raising them, so that one broken generator doesn't stop the rest being generated
+        try:
+            return function(*args)
+        except Exception as e:
+            return e
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.16 on 2023-03-04 14:12
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_summary(apps, schema_editor):
+    Guess = apps.get_model('hunts', 'Guess')
+    Hint = apps.get_model('hunts', 'Hint')
+    HintAcceptance = apps.get_model('hunts', 'HintAcceptance')
+    TeamPuzzleProgress = apps.get_model('hunts', 'TeamPuzzleProgress')
+    TeamUnlock = apps.get_model('hunts', 'TeamUnlock')
+
+    guesses = Guess.objects.filter(
+        by_team=OuterRef('team'),
+        for_puzzle=OuterRef('puzzle'),
+    ).order_by().values('by_team')
+    TeamPuzzleProgress.objects.update(
+        guess_count=Coalesce(Subquery(guesses.annotate(count=Count('id')).values('count')), 0),
+        latest_guess_time=Subquery(guesses.annotate(latest=Max('given')).values('latest')),
+        hints_scheduled=Exists(Hint.objects.filter(
+            Exists(TeamUnlock.objects.filter(
+                team_puzzle_progress=OuterRef(OuterRef('pk')),
+                unlockanswer__unlock=OuterRef('start_after'),
+            )) | Q(start_after__isnull=True),
+            ~Exists(HintAcceptance.objects.filter(
+                team_puzzle_progress=OuterRef(OuterRef('pk')),
+                hint=OuterRef('pk'),
+            )),
+            puzzle=OuterRef('puzzle'),
+        )),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hunts', '0026_merge_0025_episode_no_stats_0025_hint_obsoleted_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teampuzzleprogress',
+            name='guess_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='teampuzzleprogress',
+            name='hints_scheduled',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='teampuzzleprogress',
+            name='latest_guess_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            code=fill_summary,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2023-03-11 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hunts', '0027_teampuzzleprogress_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='guess',
+            index=models.Index(fields=['given', 'id'], name='hunts_guess_given_id_idx'),
+        ),
+    ]
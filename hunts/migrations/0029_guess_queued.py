@@ -0,0 +1,22 @@
+# Generated by Django 3.2.16 on 2023-03-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hunts', '0028_guess_given_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guess',
+            name='queued',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='guess',
+            index=models.Index(condition=models.Q(('queued', True)), fields=['by_team', 'for_puzzle', 'given'], name='hunts_guess_queued_idx'),
+        ),
+    ]
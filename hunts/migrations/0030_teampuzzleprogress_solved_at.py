@@ -0,0 +1,37 @@
+# Generated by Django 3.2.16 on 2023-03-19 11:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_solved_at(apps, schema_editor):
+    Guess = apps.get_model('hunts', 'Guess')
+    TeamPuzzleProgress = apps.get_model('hunts', 'TeamPuzzleProgress')
+
+    # The time existing solves were recorded is not known, so use the closest thing to it
+    TeamPuzzleProgress.objects.filter(solved_by__isnull=False).update(
+        solved_at=Subquery(Guess.objects.filter(id=OuterRef('solved_by')).values('given')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hunts', '0029_guess_queued'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teampuzzleprogress',
+            name='solved_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            code=fill_solved_at,
+            reverse_code=migrations.RunPython.noop,
+        ),
+        migrations.AddIndex(
+            model_name='teampuzzleprogress',
+            index=models.Index(fields=['solved_at', 'id'], name='hunts_tpp_solved_at_id_idx'),
+        ),
+    ]
@@ -10,6 +10,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import secrets
 import uuid
 from collections import defaultdict
@@ -18,8 +19,9 @@ from datetime import timedelta
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, connections, models
 from django.db.models import Count, Exists, Max, Min, OuterRef, Q, Sum
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
 from django.urls import reverse
 from django_postgresql_dag.models import node_factory, edge_factory
@@ -31,11 +33,57 @@ from seal.query import SealableQuerySet
 
 import events
 import teams
+from hunter2.models import files_maps
 from teams.models import TeamRole
 from . import utils
+from .availability import event_structure, structure_version
 from .runtimes import Runtime
 
 
+class TrackedFieldsMixin:
+    """Remembers the values of a model instance's fields as they are in the database
+
+    This means the previous state of a changed instance can be recovered without querying the database again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_saved_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self._remember_saved_values(fields)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._remember_saved_values(kwargs.get('update_fields'))
+
+    def _remember_saved_values(self, fields=None):
+        if fields is None or not hasattr(self, '_saved_values'):
+            self._saved_values = {}
+        names = None if fields is None else set(fields)
+        for field in self._meta.concrete_fields:
+            # Deferred fields aren't in the instance dictionary until they have been loaded
+            if (names is None or field.name in names or field.attname in names) and field.attname in self.__dict__:
+                self._saved_values[field.attname] = self.__dict__[field.attname]
+
+    def saved_instance(self):
+        """Return a copy of this instance as it was last loaded from or saved to the database
+
+        Returns None for instances which have not been saved. The database is only queried if some fields were never
+        loaded, as happens with deferred fields or after bulk_create.
+        """
+        if self._state.adding:
+            return None
+        fields = self._meta.concrete_fields
+        values = getattr(self, '_saved_values', {})
+        if len(values) < len(fields):
+            return type(self)._base_manager.filter(pk=self.pk).first()
+        return type(self).from_db(self._state.db, [f.attname for f in fields], [values[f.attname] for f in fields])
+
+
 # App label qualified lazy model name is required for the django-extensions graph_models to work
 # It gets confused because the referencing field is actually in the base class in a different app
 class EpisodePrequel(edge_factory('hunts.Episode', concrete=False)):
@@ -158,12 +206,12 @@ class Episode(node_factory(EpisodePrequel), SealableModel):
 
     def get_relative_id(self):
         if not hasattr(self, 'relative_id'):
-            self.relative_id = -1
-            episodes = self.event.episode_set.all()
-            for index, e in enumerate(episodes):
-                if e == self:
-                    self.relative_id = index + 1
-                    break
+            # Numbered from the event's cached structure rather than by listing its episodes
+            number = event_structure(self.event_id).episode_number(self.id)
+            if number is None:
+                # Not in the structure (yet), so count the episodes as they stand in the database
+                number = next((i for i, e in enumerate(self.event.episode_set.all(), start=1) if e == self), -1)
+            self.relative_id = number
         return self.relative_id
 
     def finished_times(self, include_late=False):
@@ -190,7 +238,11 @@ class Episode(node_factory(EpisodePrequel), SealableModel):
 
     def finished_positions(self, include_late=False):
         """Get a list of player teams who have finished this episode in the order in which they finished."""
-        return [team for team, time in self.finished_times(include_late=include_late)]
+        from .leaderboard import finished_team_ids
+
+        team_ids = finished_team_ids(self.id, include_late=include_late)
+        teams_by_id = teams.models.Team.objects.in_bulk(team_ids)
+        return [teams_by_id[team_id] for team_id in team_ids if team_id in teams_by_id]
 
     def headstart_applied(self, team):
         """Get how much headstart the given team has acquired for the episode
@@ -340,14 +392,15 @@ class Puzzle(OrderedModel, SealableModel):
             if self.episode is None:
                 raise ValueError("Puzzle %s is not on an episode and so has no relative id" % self.title)
 
-            puzzles = self.episode.puzzle_set.all()
-
-            for i, p in enumerate(puzzles, start=1):
-                if self.pk == p.pk:
-                    self.relative_id = i
-                    return i
-
-            raise RuntimeError("Could not find Puzzle pk when iterating episode's puzzle list")
+            number = event_structure(self.episode.event_id).puzzle_number(self.pk)
+            if number is None:
+                # Not in the structure (yet), so count the episode's puzzles as they stand in the database
+                puzzles = self.episode.puzzle_set.all()
+                number = next((i for i, p in enumerate(puzzles, start=1) if self.pk == p.pk), None)
+                if number is None:
+                    raise RuntimeError("Could not find Puzzle pk when iterating episode's puzzle list")
+            self.relative_id = number
+            return number
 
     @property
     def abbr(self):
@@ -434,24 +487,47 @@ together with the time at which they completed the puzzle."""
         """Return a list of teams who have completed this puzzle at the given event in order of completion."""
         return [team for team, time in sorted(self.finished_team_times(), key=lambda x: x[1])]
 
+    @staticmethod
+    def files_map_name(puzzle_id):
+        return f'files-map:puzzle:{connection.schema_name}:{puzzle_id}'
+
+    def _cached_files_map(self, view, files):
+        # The URLs contain the episode and puzzle numbers, which change without the files changing when the structure does
+        def build():
+            structure = event_structure(self.episode.event_id)
+            kwargs = {
+                'episode_number': structure.episode_number(self.episode_id),
+                'puzzle_number': structure.puzzle_number(self.id),
+            }
+            return {
+                f.slug: reverse(view, kwargs={**kwargs, 'file_path': f.url_path})
+                for f in files.filter(slug__isnull=False)
+            }
+
+        name = self.files_map_name(self.id)
+        return files_maps.get_or_set(name, build, key=f'{name}:{view}:{structure_version()}')
+
     def files_map(self, request):
         # This assumes that a single request concerns a single puzzle, which seems reasonable for now.
         if not hasattr(request, 'puzzle_files'):
             event_files = request.tenant.files_map(request)
-            puzzle_files = {f.slug: reverse(
-                'puzzle_file',
-                kwargs={
-                    'episode_number': self.episode.get_relative_id(),
-                    'puzzle_number': self.get_relative_id(),
-                    'file_path': f.url_path,
-                }) for f in self.puzzlefile_set.filter(slug__isnull=False)
-            }
+            puzzle_files = self._cached_files_map('puzzle_file', self.puzzlefile_set)
             request.puzzle_files = {  # Puzzle files with matching slugs override hunt counterparts
                 **event_files,
                 **puzzle_files,
             }
         return request.puzzle_files
 
+    def solution_files_map(self, request):
+        if not hasattr(request, 'solution_files'):
+            puzzle_files = self.files_map(request)
+            solution_files = self._cached_files_map('solution_file', self.solutionfile_set)
+            request.solution_files = {  # Solution files override puzzle files, which override event files.
+                **puzzle_files,
+                **solution_files,
+            }
+        return request.solution_files
+
     def position(self, team):
         """Returns the position in which the given team finished this puzzle: 0 = first, None = not yet finished."""
         try:
@@ -516,7 +592,7 @@ class SolutionFile(models.Model):
         return f'{self.slug}: {self.file.name}'
 
 
-class Clue(SealableModel):
+class Clue(TrackedFieldsMixin, SealableModel):
     id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True)
     puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE)
 
@@ -628,14 +704,17 @@ class Unlock(Clue):
                 for_puzzle=self.puzzle
             ).order_by('given'))
 
-        unlockanswers = self.unlockanswer_set.all()
-        return [g for g in guesses if any([u.validate_guess(g) for u in unlockanswers])]
+        guesses = list(guesses)
+        unlocked = [False] * len(guesses)
+        for unlockanswer in self.unlockanswer_set.all():
+            unlocked = [u or v for u, v in zip(unlocked, unlockanswer.validate_guesses(guesses))]
+        return [g for g, u in zip(guesses, unlocked) if u]
 
     def __str__(self):
         return f'{self.short_compact_id}: "{self.text}"'
 
 
-class UnlockAnswer(SealableModel):
+class UnlockAnswer(TrackedFieldsMixin, SealableModel):
     unlock = models.ForeignKey(Unlock, editable=False, on_delete=models.CASCADE)
     runtime = EnumField(
         Runtime, max_length=1, default=Runtime.STATIC,
@@ -684,13 +763,14 @@ Regex:
             raise ValidationError(e) from e
 
     def validate_guess(self, guess):
-        return self.runtime.create(self.options).validate_guess(
-            self.guess,
-            guess.guess,
-        )
+        return self.runtime.validator(self.options, self.guess)(guess.guess)
+
+    def validate_guesses(self, guesses):
+        """Return a list of whether each of the supplied guesses unlocks this"""
+        return self.runtime.create(self.options).validate_guesses(self.guess, [g.guess for g in guesses])
 
 
-class Answer(models.Model):
+class Answer(TrackedFieldsMixin, models.Model):
     for_puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE)
     runtime = EnumField(
         Runtime, max_length=1, default=Runtime.STATIC,
@@ -728,23 +808,53 @@ Regex:
             raise ValidationError(e) from e
 
     def validate_guess(self, guess):
-        return self.runtime.create(self.options).validate_guess(
-            self.answer,
-            guess.guess,
-        )
+        return self.runtime.validator(self.options, self.answer)(guess.guess)
+
+    def validate_guesses(self, guesses):
+        """Return a list of whether each of the supplied guesses is correct for this answer"""
+        return self.runtime.create(self.options).validate_guesses(self.answer, [g.guess for g in guesses])
 
 
 class GuessQuerySet(SealableQuerySet):
+    # Below this many guesses counting them is cheap, and the query planner's estimate is at its least reliable
+    EXACT_COUNT_THRESHOLD = 10000
+
+    def approximate_count(self):
+        """Return the number of guesses in the queryset, as estimated by the query planner if there are a lot of them
+
+        Unlike counting, which has to visit every matching guess, the estimate costs the same however many there are.
+        """
+        sql, params = self.order_by().query.sql_with_params()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]['Plan']['Plan Rows']
+        if estimate < self.EXACT_COUNT_THRESHOLD:
+            return self.count()
+        return estimate
+
     def evaluate_correctness(self, answers):
         """Refresh the correctness cache on the guesses in the queryset against the supplied answers"""
-        for guess in self:
+        guesses = list(self)
+        for guess in guesses:
             guess.correct_current = True
             guess.correct_for = None
-            for answer in answers:
-                if answer.validate_guess(guess):
+
+        # Validate all the guesses against each answer in turn; a guess belongs to the first answer it matches.
+        remaining = guesses
+        for answer in answers:
+            if not remaining:
+                break
+            unmatched = []
+            for guess, correct in zip(remaining, answer.validate_guesses(remaining)):
+                if correct:
                     guess.correct_for = answer
-                    break
-        self.bulk_update(self, ['correct_current', 'correct_for'])
+                else:
+                    unmatched.append(guess)
+            remaining = unmatched
+        self.bulk_update(guesses, ['correct_current', 'correct_for'])
 
 
 class Relationship(models.ForeignObject):
@@ -769,7 +879,7 @@ class Relationship(models.ForeignObject):
         super().contribute_to_class(cls, name, private_only=True, **kwargs)
 
 
-class Guess(ExportModelOperationsMixin('guess'), SealableModel):
+class Guess(TrackedFieldsMixin, ExportModelOperationsMixin('guess'), SealableModel):
     id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True)
     for_puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE)
     by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -789,8 +899,17 @@ class Guess(ExportModelOperationsMixin('guess'), SealableModel):
 
     objects = GuessQuerySet.as_manager()
 
+    # Set on a new guess which is saved without being evaluated, and cleared once a guess worker has evaluated it
+    queued = models.BooleanField(default=False, editable=False)
+
     class Meta:
         verbose_name_plural = 'Guesses'
+        indexes = (
+            # For paging through guesses in the order they were given
+            models.Index(fields=('given', 'id'), name='hunts_guess_given_id_idx'),
+            # For finding the guesses waiting for a guess worker
+            models.Index(fields=('by_team', 'for_puzzle', 'given'), condition=Q(queued=True), name='hunts_guess_queued_idx'),
+        )
 
     def __str__(self):
         return f'"{self.guess}" by {self.by} ({self.by_team}) @ {self.given}'
@@ -832,7 +951,7 @@ class Guess(ExportModelOperationsMixin('guess'), SealableModel):
     def time_on_puzzle(self):
         if not self.progress.start_time:
             # This should never happen, but can do with sample progress.
-            return '0'
+            return timedelta(0)
         return self.given - self.progress.start_time
 
 
@@ -898,15 +1017,67 @@ class TeamPuzzleProgressQuerySet(SealableQuerySet):
         to which `solved_by` if the puzzle was previously solved and is still solved,
         or previously was not solved and is still not solved.
         """
+        from .availability import invalidate_team_availability
+        from .leaderboard import update_team
+
         qs = self.with_first_correct_guess().select_related('solved_by').seal()
+        changed_team_ids = set()
+        now = timezone.now()
         for pr in qs:
             # Only update if needed, i.e. if the solvedness of the puzzle has changed, or if
             # the guess which had previously solved the puzzle is now incorrect.
             # This means for example that if a new answer is added which makes an earlier guess
             # correct, we maintain the record of the guess which originally brought the team forward.
             if not (pr.solved_by_id and pr.solved_by.correct_for_id and pr.first_correct_guess_id):
+                if pr.solved_by_id != pr.first_correct_guess_id:
+                    changed_team_ids.add(pr.team_id)
+                    # As TeamPuzzleProgress.save would, which bulk_update bypasses
+                    pr.solved_at = now if pr.first_correct_guess_id else None
                 pr.solved_by_id = pr.first_correct_guess_id
-        qs.bulk_update(qs, ['solved_by_id'])
+        qs.bulk_update(qs, ['solved_by_id', 'solved_at'])
+        # bulk_update doesn't send signals, so the teams' cached availability and positions have to be updated here
+        for team_id in changed_team_ids:
+            invalidate_team_availability(team_id)
+            update_team(team_id)
+
+    def add_guess(self, guess):
+        """Count a new guess in the summary fields of these Progress objects"""
+        # Incrementing, rather than recounting, keeps the count right when a team makes guesses concurrently
+        return self.update(
+            guess_count=models.F('guess_count') + 1,
+            latest_guess_time=Greatest('latest_guess_time', models.Value(guess.given, output_field=models.DateTimeField())),
+        )
+
+    def refresh_summary(self):
+        """Recompute all the summary fields of these Progress objects from the guesses, unlocks and hints they summarise"""
+        guesses = Guess.objects.filter(
+            by_team=OuterRef('team'),
+            for_puzzle=OuterRef('puzzle'),
+        ).order_by().values('by_team')
+        return self.update(
+            guess_count=Coalesce(models.Subquery(guesses.annotate(count=Count('id')).values('count')), 0),
+            latest_guess_time=models.Subquery(guesses.annotate(latest=Max('given')).values('latest')),
+            hints_scheduled=self._hints_scheduled(),
+        )
+
+    def refresh_hints_scheduled(self):
+        """Recompute whether these Progress objects have hints which the team is yet to accept"""
+        return self.update(hints_scheduled=self._hints_scheduled())
+
+    @staticmethod
+    def _hints_scheduled():
+        # A hint is scheduled once the team has started counting down to it, until they accept it
+        return Exists(Hint.objects.filter(
+            Exists(TeamUnlock.objects.filter(
+                team_puzzle_progress=OuterRef(OuterRef('pk')),
+                unlockanswer__unlock=OuterRef('start_after'),
+            )) | Q(start_after__isnull=True),
+            ~Exists(HintAcceptance.objects.filter(
+                team_puzzle_progress=OuterRef(OuterRef('pk')),
+                hint=OuterRef('pk'),
+            )),
+            puzzle=OuterRef('puzzle'),
+        ))
 
     def headstart_granted(self):
         """Transform the queryset into a dictionary of:
@@ -926,25 +1097,47 @@ class TeamPuzzleProgressQuerySet(SealableQuerySet):
         return dict(((v['team'], v['puzzle__episode']), v['total_headstart']) for v in headstart_values)
 
 
-class TeamPuzzleProgress(SealableModel):
+class TeamPuzzleProgress(TrackedFieldsMixin, SealableModel):
     puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE)
     team = models.ForeignKey(teams.models.Team, on_delete=models.CASCADE)
     start_time = models.DateTimeField(blank=True, null=True)
     solved_by = models.ForeignKey(Guess, blank=True, null=True, on_delete=models.SET_NULL, related_name="+")
+    # When the solve was recorded, which can be long after the solving guess was given: for example when a queued guess is
+    # evaluated, or an answer is added which makes an earlier guess correct
+    solved_at = models.DateTimeField(blank=True, null=True, editable=False)
     unlockanswers = models.ManyToManyField(UnlockAnswer, through='TeamUnlock')
     # This captures whether any of the associated guesses are late
     late = models.BooleanField()
     accepted_hints = models.ManyToManyField(Hint, through='HintAcceptance')
+    # A summary of the team's guesses and hints, maintained by signal handlers so that it can be read without aggregating
+    guess_count = models.PositiveIntegerField(default=0, editable=False)
+    latest_guess_time = models.DateTimeField(blank=True, null=True, editable=False)
+    hints_scheduled = models.BooleanField(default=False, editable=False)
 
     objects = TeamPuzzleProgressQuerySet.as_manager()
 
     class Meta:
         unique_together = (('puzzle', 'team'), )
         verbose_name_plural = 'Team puzzle progresses'
+        indexes = (
+            # For consuming solves in the order they were recorded
+            models.Index(fields=('solved_at', 'id'), name='hunts_tpp_solved_at_id_idx'),
+        )
 
     def __repr__(self):
         return f'<TeamPuzzleProgress for {self.team} on {self.puzzle}>'
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        solved_by_saved = update_fields is None or bool({'solved_by', 'solved_by_id'} & set(update_fields))
+        # Deferred fields haven't been changed, so only loaded ones need comparing
+        if solved_by_saved and 'solved_by_id' in self.__dict__ and \
+                self.solved_by_id != getattr(self, '_saved_values', {}).get('solved_by_id'):
+            self.solved_at = timezone.now() if self.solved_by_id else None
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'solved_at'}
+        super().save(*args, **kwargs)
+
     @property
     def unlocks(self):
         return set(tu.unlockanswer.unlock for tu in self.teamunlock_set.all())
@@ -1001,18 +1194,15 @@ class TeamPuzzleProgress(SealableModel):
                 if some can be determined not to be correct, they can be omitted.
         """
 
-        self.solved_by = None
+        guesses = list(guesses)
+        correct = [False] * len(guesses)
+        for answer in answers:
+            correct = [c or v for c, v in zip(correct, answer.validate_guesses(guesses))]
 
-        for guess in guesses:
-            for answer in answers:
-                if answer.validate_guess(guess):
-                    self.solved_by = guess
-                    break
-            if self.solved_by_id:
-                break
+        self.solved_by = next((guess for guess, c in zip(guesses, correct) if c), None)
 
 
-class TeamUnlock(SealableModel):
+class TeamUnlock(TrackedFieldsMixin, SealableModel):
     team_puzzle_progress = models.ForeignKey(TeamPuzzleProgress, on_delete=models.CASCADE)
     unlockanswer = models.ForeignKey(UnlockAnswer, on_delete=models.CASCADE)
     unlocked_by = models.ForeignKey(Guess, on_delete=models.CASCADE)
@@ -1121,7 +1311,7 @@ class AnnouncementNotificationOption(Enum):
     UPDATE = 'U'
 
 
-class Announcement(models.Model):
+class Announcement(TrackedFieldsMixin, models.Model):
     puzzle = models.ForeignKey(Puzzle, on_delete=models.CASCADE, related_name='announcements', null=True, blank=True)
     title = models.CharField(max_length=255)
     posted = models.DateTimeField(default=timezone.now)
@@ -17,4 +17,5 @@ from . import consumers
 websocket_urlpatterns = [
     path('ws/hunt/', consumers.HuntWebsocket, name='hunt_websocket'),
     path('ws/hunt/ep/<int:episode_number>/pz/<int:puzzle_number>/', consumers.PuzzleEventWebsocket, name='puzzle_websocket'),
+    path('ws/hunt/admin/', consumers.AdminWebsocket, name='admin_websocket'),
 ]
@@ -12,14 +12,20 @@
 
 
 import inspect
+import json
 
 from enumfields.enums import Enum, EnumMeta
 
+from hunter2.cache import LRUCache
 from .iframe import IFrameRuntime
 from .lua import LuaRuntime
 from .regex import RegexRuntime
 from .static import StaticRuntime
 
+# Compiled validators are shared between every Answer and UnlockAnswer with the same runtime, options and validator text.
+VALIDATOR_CACHE_SIZE = 2048
+validator_cache = LRUCache(maxsize=VALIDATOR_CACHE_SIZE)
+
 
 # Pattern copied from label handling in django-enumfields
 class RuntimeMeta(EnumMeta):
@@ -60,6 +66,19 @@ class Runtime(Enum, metaclass=RuntimeMeta):
     def create(self, options):
         return self.type(**options)
 
+    def _validator_key(self, options, validator):
+        return self.value, json.dumps(options, sort_keys=True), validator
+
+    def validator(self, options, validator):
+        """Return a callable which checks a guess against validator, compiling it only if it is not already cached"""
+        return validator_cache.get_or_set(
+            self._validator_key(options, validator),
+            lambda: self.create(options).compile_validator(validator),
+        )
+
+    def forget_validator(self, options, validator):
+        validator_cache.discard(self._validator_key(options, validator))
+
     def is_printable(self):
         return self in (Runtime.REGEX, Runtime.STATIC)
 
@@ -10,14 +10,32 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import partial
+
 
 class AbstractRuntime:
     def check_script(self, script):
         return True
 
+    def compile_validator(self, validator):
+        """Return a callable which validates a guess against the supplied validator.
+
+        Runtimes which can do expensive preparation of the validator once, rather than on every guess, should override this.
+        """
+        return partial(self.validate_guess, validator)
+
     def evaluate(self, script, team_puzzle_data, user_puzzle_data, team_data, user_data):
         raise NotImplementedError("Abstract")
 
     # TODO: Consider changing to allow returning a result and unlock hints for this puzzle.
     def validate_guess(self, validator, guess):
         raise NotImplementedError("Abstract")
+
+    def validate_guesses(self, validator, guesses):
+        """Return a list of booleans indicating whether each of the guesses is accepted by the validator
+
+        This is for re-evaluating many guesses at once, so runtimes should override it where they can do better than
+        validating each guess in turn.
+        """
+        validate = self.compile_validator(validator)
+        return [bool(validate(guess)) for guess in guesses]
@@ -11,7 +11,6 @@
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import os
 import sys
 
 from ..abstract import AbstractRuntime
@@ -23,6 +22,8 @@ sys.setdlopenflags(258)
 import lupa  # noqa: E402
 sys.setdlopenflags(orig_dlflags)
 
+from .pool import interpreter_pool  # noqa: E402
+
 
 class LuaRuntime(AbstractRuntime):
     DEFAULT_INSTRUCTION_LIMIT = 1e6  # Instructions
@@ -31,6 +32,7 @@ class LuaRuntime(AbstractRuntime):
     ERROR_INSTRUCTION_LIMIT_EXCEEDED = "ERROR_INSTRUCTION_LIMIT_EXCEEDED"
     ERROR_MEMORY_LIMIT_EXCEEDED      = "ERROR_MEMORY_LIMIT_EXCEEDED"
     ERROR_SANDBOX_VIOLATION          = "ERROR_SANDBOX_VIOLATION"
+    ERROR_NO_RETURN_VALUE            = "ERROR_NO_RETURN_VALUE"
 
     def __init__(self):
         pass
@@ -38,6 +40,7 @@ class LuaRuntime(AbstractRuntime):
     def check_script(self, script):
         try:
             # Use the sandbox engine with a *very* restrictive limit which will prevent anything meaningful happening.
+            # The compiled chunk is cached, so it is ready when the script is first run for real.
             # TODO: look at a way to restrict this completely.
             self._sandbox_run(script, instruction_limit=10)
         except RuntimeExecutionTimeExceededError:
@@ -66,27 +69,40 @@ class LuaRuntime(AbstractRuntime):
 
         return return_values[0]
 
-    def _create_lua_runtime(self):
-        # noinspection PyArgumentList
-        lua = lupa.LuaRuntime(
-            register_eval=False,
-            register_builtins=False,
-            unpack_returned_tuples=True,
-        )
+    def validate_guesses(self, validator, guesses):
+        distinct = list(dict.fromkeys(guesses))
+        if not distinct:
+            return []
 
-        # Ensure the local is consistent and ignore system Lua paths
-        lua.execute("assert(os.setlocale('C'))")
-        lua.globals().package.path  = ';'.join([
-            os.path.join(os.path.dirname(__file__), "?.lua"),
-            "/opt/hunter2/share/lua/5.2/?.lua",
-        ])
+        try:
+            with interpreter_pool.interpreter() as interpreter:
+                chunk = interpreter.load(validator)
+                # Run every guess within a single call into Lua
+                success, result = interpreter.sandbox.run_batch(
+                    chunk, 'guess', interpreter.lua.table(*distinct), self.DEFAULT_INSTRUCTION_LIMIT, self.DEFAULT_MEMORY_LIMIT
+                )
+                if success:
+                    correct = {guess for i, guess in enumerate(distinct, 1) if result[i]}
+        except lupa.LuaError as error:
+            # An error has occurred in the sandbox runtime itself
+            raise RuntimeExecutionError("Sandbox") from error
 
-        # TODO: Support cross platform libraries
-        lua.globals().package.cpath = ';'.join([
-            "/opt/hunter2/lib/lua/5.2/?.so",
-        ])
+        if not success:
+            if result == self.ERROR_NO_RETURN_VALUE:
+                raise RuntimeExecutionError("Lua script did not return a value")
+            self._raise_script_error(result)
 
-        return lua
+        return [guess in correct for guess in guesses]
+
+    def _raise_script_error(self, error):
+        if str(error).endswith(self.ERROR_INSTRUCTION_LIMIT_EXCEEDED):
+            raise RuntimeExecutionTimeExceededError()
+        elif str(error).endswith(self.ERROR_MEMORY_LIMIT_EXCEEDED):
+            raise RuntimeMemoryExceededError()
+        elif str(error).endswith(self.ERROR_SANDBOX_VIOLATION):
+            raise RuntimeSandboxViolationError(str(error).replace(" " + self.ERROR_SANDBOX_VIOLATION, ""))
+        else:
+            raise RuntimeExecutionError(error)
 
     def _sandbox_run(
             self,
@@ -94,55 +110,43 @@ class LuaRuntime(AbstractRuntime):
             parameters=None,
             instruction_limit=DEFAULT_INSTRUCTION_LIMIT,
             memory_limit=DEFAULT_MEMORY_LIMIT):
-        lua = self._create_lua_runtime()
-
-        # Load the sandbox Lua module
-        sandbox = lua.require('sandbox')
-
-        # Load parameters into the sandbox
-        if parameters is not None:
-            for key, value in parameters.items():
-                if sandbox.env[key] is not None:
-                    raise RuntimeExecutionError("Passed parameter '{}' overrides sandbox environment".format(key))
-                else:
-                    sandbox.env[key] = value
-
-        # Enable instruction and memory limits
-        sandbox.enable_limits(instruction_limit, memory_limit)
+        try:
+            with interpreter_pool.interpreter() as interpreter:
+                sandbox = interpreter.sandbox
+                chunk = interpreter.load(lua_script)
+                # Each run gets a fresh copy of the sandbox environment so nothing leaks between scripts
+                env = sandbox.create_env()
+
+                # Load parameters into the sandbox
+                if parameters is not None:
+                    for key, value in parameters.items():
+                        if env[key] is not None:
+                            raise RuntimeExecutionError("Passed parameter '{}' overrides sandbox environment".format(key))
+                        else:
+                            env[key] = value
+
+                # Enable instruction and memory limits
+                sandbox.enable_limits(instruction_limit, memory_limit)
+
+                result = sandbox.run(chunk, env)
+        except lupa.LuaError as error:
+            # An error has occurred in the sandbox runtime itself
+            raise RuntimeExecutionError("Sandbox") from error
 
         # The 'result' object here can be either a bool or a tuple depending on
         # the result of the Lua function, the following results are possible:
         #  - True:           script succeeded but returned nothing
         #  - (True, ...):    script succeeded with return values
         #  - (False, error): script raised an error during execution
-        #  - (None, error):  script syntax loading error
-        try:
-            result = sandbox.run(lua_script)
-            # If just a bool, return the empty result for success
-            if isinstance(result, bool) and result is True:
-                return []
-
-            # Check result of executing the Lua script
-            if result[0] is not True:
-                exit_status, error = result
-
-                if exit_status is None:
-                    raise SyntaxError(error)
-
-                if exit_status is False:
-                    if str(error).endswith(self.ERROR_INSTRUCTION_LIMIT_EXCEEDED):
-                        raise RuntimeExecutionTimeExceededError()
-                    elif str(error).endswith(self.ERROR_MEMORY_LIMIT_EXCEEDED):
-                        raise RuntimeMemoryExceededError()
-                    elif str(error).endswith(self.ERROR_SANDBOX_VIOLATION):
-                        raise RuntimeSandboxViolationError(str(error).replace(" " + self.ERROR_SANDBOX_VIOLATION, ""))
-                    else:
-                        raise RuntimeExecutionError(error)
-            else:
-                # Expand the return values to a list and return
-                exit_status, *return_values = result
-                return return_values
-
-        except lupa.LuaError as error:
-            # An error has occurred in the sandbox runtime itself
-            raise RuntimeExecutionError("Sandbox") from error
+        # If just a bool, return the empty result for success
+        if isinstance(result, bool) and result is True:
+            return []
+
+        # Check result of executing the Lua script
+        if result[0] is not True:
+            exit_status, error = result
+            self._raise_script_error(error)
+        else:
+            # Expand the return values to a list and return
+            exit_status, *return_values = result
+            return return_values
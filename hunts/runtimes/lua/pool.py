@@ -0,0 +1,164 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from prometheus_client import Counter
+
+from hunter2.cache import CacheInfo
+from . import lupa
+
+chunk_cache_hits = Counter('hunter2_lua_chunk_cache_hits', 'Lua scripts run without needing to be compiled')
+chunk_cache_misses = Counter('hunter2_lua_chunk_cache_misses', 'Lua scripts compiled because they were not cached')
+
+
+def create_lua_runtime():
+    # noinspection PyArgumentList
+    lua = lupa.LuaRuntime(
+        register_eval=False,
+        register_builtins=False,
+        unpack_returned_tuples=True,
+    )
+
+    # Ensure the local is consistent and ignore system Lua paths
+    lua.execute("assert(os.setlocale('C'))")
+    lua.globals().package.path  = ';'.join([
+        os.path.join(os.path.dirname(__file__), "?.lua"),
+        "/opt/hunter2/share/lua/5.2/?.lua",
+    ])
+
+    # TODO: Support cross platform libraries
+    lua.globals().package.cpath = ';'.join([
+        "/opt/hunter2/lib/lua/5.2/?.so",
+    ])
+
+    return lua
+
+
+class ChunkCacheStats:
+    """Process-wide hit and miss counts for the chunk caches of every interpreter"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        (chunk_cache_hits if hit else chunk_cache_misses).inc()
+
+    def cache_info(self):
+        # The current size is only for the interpreters belonging to the calling thread
+        return CacheInfo(self.hits, self.misses, settings.LUA_CHUNK_CACHE_SIZE, len(interpreter_pool.chunk_keys()))
+
+
+chunk_cache_stats = ChunkCacheStats()
+
+
+class SandboxInterpreter:
+    """A Lua interpreter with the sandbox module loaded, which can be reused for many sandboxed runs"""
+
+    def __init__(self):
+        self.lua = create_lua_runtime()
+        self.sandbox = self.lua.require('sandbox')
+        self._sethook = self.lua.globals().debug.sethook
+        self.uses = 0
+        # Keys of the chunks cached in the interpreter, least recently used first
+        self.chunks = OrderedDict()
+
+    def load(self, script):
+        """Return the compiled chunk for a script, compiling it only if this interpreter has not seen it before
+
+        Raises SyntaxError if the script can't be compiled.
+        """
+        key = hashlib.sha256(script.encode('utf-8')).hexdigest()
+        hit = key in self.chunks
+        chunk_cache_stats.record(hit)
+        if hit:
+            self.chunks.move_to_end(key)
+            return self.sandbox.chunks[key]
+
+        result = self.sandbox.load(script, key)
+        if isinstance(result, tuple):
+            _, message = result
+            raise SyntaxError(message)
+        self.chunks[key] = None
+        return result
+
+    def disable_limits(self):
+        # Calling the C function directly executes no Lua instructions, so this can't trip the hook it removes
+        self._sethook()
+
+    def reset(self):
+        """Return the interpreter to a clean state, ready for the next script"""
+        self.disable_limits()
+        while len(self.chunks) > settings.LUA_CHUNK_CACHE_SIZE:
+            key, _ = self.chunks.popitem(last=False)
+            self.sandbox.forget(key)
+        self.sandbox.reset()
+        self.uses += 1
+
+
+class InterpreterPool(threading.local):
+    """Per-thread pool of sandbox interpreters
+
+    Lua interpreters can't be shared between threads, so each thread has its own pool. Interpreters are reset between
+    scripts and replaced after `max_uses` runs, so that anything a script manages to leave behind is short-lived.
+    """
+
+    def __init__(self, size=None, max_uses=None):
+        self._size = size
+        self._max_uses = max_uses
+        self.idle = []
+
+    @property
+    def size(self):
+        return self._size if self._size is not None else settings.LUA_POOL_SIZE
+
+    @property
+    def max_uses(self):
+        return self._max_uses if self._max_uses is not None else settings.LUA_POOL_MAX_USES
+
+    @contextmanager
+    def interpreter(self):
+        interpreter = self.idle.pop() if self.idle else SandboxInterpreter()
+        reusable = True
+        try:
+            yield interpreter
+        except lupa.LuaError:
+            # Something went wrong outside the script's protected call, so don't trust this interpreter again
+            reusable = False
+            raise
+        finally:
+            if reusable:
+                interpreter.reset()
+                if interpreter.uses < self.max_uses and len(self.idle) < self.size:
+                    self.idle.append(interpreter)
+
+    def chunk_keys(self):
+        return {key for interpreter in self.idle for key in interpreter.chunks}
+
+    def clear(self):
+        self.idle = []
+
+
+interpreter_pool = InterpreterPool()
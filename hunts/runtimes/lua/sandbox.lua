@@ -158,17 +158,87 @@ sandbox.env = {
   },
 }
 
-function sandbox.enable_limits(instruction_limit, memory_limit)
+-- Create a copy of the environment for a single run, so that changes made by one script are not seen by the next
+function sandbox.create_env()
+  local env = {}
+  for k, v in pairs(sandbox.env) do
+    if type(v) == 'table' then
+      local library = {}
+      for name, value in pairs(v) do
+        library[name] = value
+      end
+      v = library
+    end
+    env[k] = v
+  end
+  return env
+end
+
+-- Compiled chunks, keyed by a hash of their source, so that scripts which are run repeatedly are only compiled once
+sandbox.chunks = {}
+sandbox.chunk_sizes = {}
+-- Memory used by cached chunks, which is not counted towards a script's memory limit
+sandbox.chunk_kilobytes = 0
+-- Memory used by the interpreter between runs, apart from cached chunks. Updated by each reset.
+sandbox.idle_kilobytes = 0
+
+function sandbox.load(sandboxed_code, key)
+  local chunk = sandbox.chunks[key]
+  if chunk then return chunk end
+
+  local before = collectgarbage('count')
+  local message
+  chunk, message = load(sandboxed_code, nil, 't', {})
+  if not chunk then return nil, message end
+  local size = math.max(collectgarbage('count') - before, 0)
+
+  sandbox.chunks[key] = chunk
+  sandbox.chunk_sizes[key] = size
+  sandbox.chunk_kilobytes = sandbox.chunk_kilobytes + size
+  return chunk
+end
+
+function sandbox.forget(key)
+  if sandbox.chunks[key] then
+    sandbox.chunk_kilobytes = sandbox.chunk_kilobytes - sandbox.chunk_sizes[key]
+    sandbox.chunks[key] = nil
+    sandbox.chunk_sizes[key] = nil
+  end
+end
+
+-- Clean up after a run so the interpreter can be reused
+function sandbox.reset()
+  -- Modules are shared by every script which requires them, so make sure the next script gets a fresh copy
+  for _, module in ipairs(sandbox.allowed_modules) do
+    package.loaded[module] = nil
+  end
+  -- Don't let a cached chunk keep the last run's environment alive
+  if sandbox.last_run then
+    debug.setupvalue(sandbox.last_run, 1, nil)
+    sandbox.last_run = nil
+  end
+  collectgarbage()
+  sandbox.idle_kilobytes = collectgarbage('count') - sandbox.chunk_kilobytes
+end
+
+-- Enable limits on the given coroutine, or the main thread if none is given.
+-- Memory is counted apart from excluded_kilobytes, which defaults to the memory used by cached chunks.
+function sandbox.enable_limits(instruction_limit, memory_limit, thread, excluded_kilobytes)
   sandbox.cpu_count = 0
-  debug.sethook(function()
+  local hook = function()
     sandbox.cpu_count = sandbox.cpu_count + 1
     local kilobytes, _ = collectgarbage('count')
-    if kilobytes > memory_limit then error("ERROR_MEMORY_LIMIT_EXCEEDED") end
+    if kilobytes - (excluded_kilobytes or sandbox.chunk_kilobytes) > memory_limit then error("ERROR_MEMORY_LIMIT_EXCEEDED") end
     if sandbox.cpu_count > instruction_limit then error("ERROR_INSTRUCTION_LIMIT_EXCEEDED") end
-  end, '', 10)
+  end
+  if thread then
+    debug.sethook(thread, hook, '', 10)
+  else
+    debug.sethook(hook, '', 10)
+  end
 end
 
-function sandbox.run(sandboxed_code, mem_limit, instruction_limit)
+function sandbox.protect_types()
   -- Replace string metatable with sandboxed version
   local metatable = {__index={}}
   for k, v in pairs(sandbox.env.string) do
@@ -180,10 +250,47 @@ function sandbox.run(sandboxed_code, mem_limit, instruction_limit)
   debug.setmetatable(1, nil)
   debug.setmetatable(function() end, nil)
   debug.setmetatable(true, nil)
+end
+
+function sandbox.run(sandboxed_function, env)
+  sandbox.protect_types()
 
-  local sandboxed_function, message = load(sandboxed_code, nil, 't', sandbox.env)
-  if not sandboxed_function then return nil, message end
+  -- The first upvalue of a chunk is its environment
+  debug.setupvalue(sandboxed_function, 1, env or sandbox.create_env())
+  sandbox.last_run = sandboxed_function
   return pcall(sandboxed_function)
 end
 
+-- Run a chunk once for each of the values, passed to it in the global with the given name.
+-- Each run is limited separately, in its own coroutine so that the limits don't apply to this function itself.
+-- Returns true and a table of the first value each run returned, or false and the first error.
+function sandbox.run_batch(sandboxed_function, name, values, instruction_limit, memory_limit)
+  sandbox.protect_types()
+  sandbox.last_run = sandboxed_function
+
+  local results = {}
+  for i = 1, #values do
+    local env = sandbox.create_env()
+    env[name] = values[i]
+    debug.setupvalue(sandboxed_function, 1, env)
+    -- Don't let earlier runs' garbage count against this one's memory limit
+    collectgarbage()
+
+    -- Neither the values nor the results count towards the limit, so each run has the same allowance as it would on
+    -- its own: everything in memory now is excluded except what the idle interpreter holds.
+    local excluded = math.max(collectgarbage('count') - sandbox.idle_kilobytes, sandbox.chunk_kilobytes)
+    local thread = coroutine.create(sandboxed_function)
+    sandbox.enable_limits(instruction_limit, memory_limit, thread, excluded)
+    local result = table.pack(coroutine.resume(thread))
+    if not result[1] then return false, result[2] end
+    if result.n < 2 then return false, "ERROR_NO_RETURN_VALUE" end
+    -- Truthiness is left to the caller, as it is for a single run
+    results[i] = result[2]
+  end
+  return true, results
+end
+
+collectgarbage()
+sandbox.idle_kilobytes = collectgarbage('count')
+
 return sandbox
@@ -11,11 +11,12 @@
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, override_settings
 from parameterized import parameterized
 
 from ..exceptions import RuntimeExecutionError, RuntimeExecutionTimeExceededError, RuntimeMemoryExceededError, RuntimeSandboxViolationError
 from . import LuaRuntime
+from .pool import chunk_cache_stats, interpreter_pool
 
 
 class LuaRuntimeTestCase(SimpleTestCase):
@@ -44,6 +45,59 @@ class LuaRuntimeTestCase(SimpleTestCase):
         with self.assertRaises(RuntimeExecutionError):
             lua_runtime.validate_guess(lua_script, None)
 
+    def test_validate_guesses(self):
+        lua_runtime = LuaRuntime()
+        lua_script = '''return (tonumber(guess) == 100 + 100)'''
+        guesses = ["200", "100", "two hundred", "200"]
+        self.assertEqual(lua_runtime.validate_guesses(lua_script, guesses), [True, False, False, True])
+
+    def test_validate_guesses_isolated(self):
+        lua_runtime = LuaRuntime()
+        lua_script = '''local seen = previous; previous = guess; return seen == nil'''
+        self.assertEqual(lua_runtime.validate_guesses(lua_script, ["a", "b", "c"]), [True, True, True])
+
+    def test_validate_guesses_limits_each_guess(self):
+        lua_runtime = LuaRuntime()
+        # Each guess is well within the limit, but all of them together would not be
+        lua_script = '''for i=1,2000000 do i=i end return true'''
+        self.assertEqual(lua_runtime.validate_guesses(lua_script, [str(i) for i in range(5)]), [True] * 5)
+        lua_script = '''if guess == "slow" then for i=1,1e9 do i=i end end return true'''
+        with self.assertRaises(RuntimeExecutionTimeExceededError):
+            lua_runtime.validate_guesses(lua_script, ["fast", "slow"])
+
+    def test_validate_guesses_many(self):
+        lua_runtime = LuaRuntime()
+        # Enough guesses that they would exceed the memory limit if they counted towards it
+        lua_script = '''for i=1,20 do i=i end return guess == "answer"'''
+        guesses = [f'guess number {i} {"x" * 50}' for i in range(5000)] + ['answer']
+        self.assertEqual(lua_runtime.validate_guesses(lua_script, guesses), [False] * 5000 + [True])
+
+    def test_validate_guesses_limits_memory(self):
+        lua_runtime = LuaRuntime()
+        lua_script = '''local t = {} for i=1,100000 do t[i] = i end return true'''
+        with self.assertRaises(RuntimeMemoryExceededError):
+            lua_runtime.validate_guesses(lua_script, ["a", "b"])
+
+    def test_validate_guesses_agrees_with_validate_guess(self):
+        lua_runtime = LuaRuntime()
+        for lua_script in ('''return 0''', '''return ""''', '''return nil''', '''return guess'''):
+            self.assertEqual(
+                lua_runtime.validate_guesses(lua_script, ["a"]),
+                [bool(lua_runtime.validate_guess(lua_script, "a"))],
+                lua_script,
+            )
+
+    def test_validate_guesses_requires_return_value(self):
+        lua_runtime = LuaRuntime()
+        with self.assertRaises(RuntimeExecutionError):
+            lua_runtime.validate_guesses('''if guess == "a" then return true end''', ["a", "b"])
+
+    def test_validate_guesses_error_fails(self):
+        lua_runtime = LuaRuntime()
+        with self.assertRaises(RuntimeExecutionError) as context:
+            lua_runtime.validate_guesses('''error("error_message")''', ["a"])
+        self.assertRegex(context.exception.message, ".*error_message$")
+
     def test_evaluate_syntax_error_fails(self):
         lua_runtime = LuaRuntime()
         lua_script = '''@'''
@@ -125,6 +179,108 @@ class LuaSandboxTestCase(SimpleTestCase):
             lua_runtime._sandbox_run(lua_script)
 
 
+class LuaInterpreterPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        interpreter_pool.clear()
+
+    def test_interpreter_reused(self):
+        lua_runtime = LuaRuntime()
+        lua_runtime._sandbox_run('return true')
+        interpreter = interpreter_pool.idle[0]
+        lua_runtime._sandbox_run('return true')
+        self.assertEqual(interpreter_pool.idle, [interpreter])
+        self.assertEqual(interpreter.uses, 2)
+
+    def test_globals_reset_between_runs(self):
+        lua_runtime = LuaRuntime()
+        lua_runtime._sandbox_run('leaked = true; string.upper = nil; return true')
+        result = lua_runtime._sandbox_run('return leaked == nil and string.upper ~= nil')[0]
+        self.assertTrue(result, "Changes to the sandbox environment were visible to a subsequent run")
+
+    def test_parameters_reset_between_runs(self):
+        lua_runtime = LuaRuntime()
+        lua_runtime.validate_guess('return true', 'guess')
+        self.assertTrue(lua_runtime._sandbox_run('return guess == nil')[0])
+
+    def test_modules_reset_between_runs(self):
+        lua_runtime = LuaRuntime()
+        lua_runtime._sandbox_run("require('cjson').leaked = true; return true")
+        result = lua_runtime._sandbox_run("return require('cjson').leaked == nil")[0]
+        self.assertTrue(result, "Changes to a module were visible to a subsequent run")
+
+    def test_limits_reset_between_runs(self):
+        lua_runtime = LuaRuntime()
+        with self.assertRaises(RuntimeExecutionTimeExceededError):
+            lua_runtime._sandbox_run('for i=1,100000 do i=i end', instruction_limit=100)
+        with self.assertRaises(RuntimeMemoryExceededError):
+            lua_runtime._sandbox_run('t = {} for i=1,10000 do t[i] = i end', memory_limit=100)
+        self.assertTrue(lua_runtime._sandbox_run('for i=1,10000 do i=i end return true')[0])
+
+    @override_settings(LUA_POOL_MAX_USES=2)
+    def test_interpreter_recycled(self):
+        lua_runtime = LuaRuntime()
+        lua_runtime._sandbox_run('return true')
+        interpreter = interpreter_pool.idle[0]
+        lua_runtime._sandbox_run('return true')
+        self.assertEqual(interpreter_pool.idle, [])
+        lua_runtime._sandbox_run('return true')
+        self.assertNotIn(interpreter, interpreter_pool.idle)
+
+    def test_interpreter_discarded_after_sandbox_error(self):
+        lua_runtime = LuaRuntime()
+        with self.assertRaises(RuntimeExecutionError):
+            lua_runtime._sandbox_run('return true', instruction_limit=10, memory_limit=10)
+        self.assertEqual(interpreter_pool.idle, [])
+        self.assertTrue(lua_runtime._sandbox_run('return true')[0])
+
+
+class LuaChunkCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        interpreter_pool.clear()
+
+    def test_chunk_reused(self):
+        lua_runtime = LuaRuntime()
+        lua_script = '''return (tonumber(guess) == 100 + 100)'''
+        hits, misses, _, _ = chunk_cache_stats.cache_info()
+        self.assertTrue(lua_runtime.validate_guess(lua_script, '200'))
+        self.assertFalse(lua_runtime.validate_guess(lua_script, '100'))
+        info = chunk_cache_stats.cache_info()
+        self.assertEqual(info.misses - misses, 1)
+        self.assertEqual(info.hits - hits, 1)
+        self.assertEqual(info.currsize, 1)
+
+    def test_check_script_runs_briefly(self):
+        lua_runtime = LuaRuntime()
+        self.assertTrue(lua_runtime.check_script('''while true do end'''))
+        self.assertEqual(chunk_cache_stats.cache_info().currsize, 1)
+        with self.assertRaises(RuntimeExecutionError):
+            lua_runtime.check_script('''error("error_message")''')
+        with self.assertRaises(SyntaxError):
+            lua_runtime.check_script('''@''')
+
+    def test_syntax_error_not_cached(self):
+        lua_runtime = LuaRuntime()
+        with self.assertRaises(SyntaxError):
+            lua_runtime.evaluate('''@''', None, None, None, None)
+        self.assertEqual(chunk_cache_stats.cache_info().currsize, 0)
+
+    @override_settings(LUA_CHUNK_CACHE_SIZE=2)
+    def test_least_recently_used_chunk_evicted(self):
+        lua_runtime = LuaRuntime()
+        for i in range(3):
+            lua_runtime._sandbox_run(f'return {i}')
+        interpreter = interpreter_pool.idle[0]
+        self.assertEqual(len(interpreter.chunks), 2)
+        self.assertEqual(lua_runtime._sandbox_run('return 2')[0], 2)
+
+    def test_cached_chunks_do_not_count_towards_memory_limit(self):
+        lua_runtime = LuaRuntime()
+        table = ', '.join(str(i) for i in range(100))
+        for i in range(100):
+            lua_runtime._sandbox_run(f'local t = {{{table}}} return {i}')
+        self.assertTrue(lua_runtime._sandbox_run('''return true''', memory_limit=100)[0])
+
+
 class LuaSandboxLibrariesTestCase(SimpleTestCase):
     # Functions that we do not want to expose to our sandbox
     SUPPORTED_LIBRARIES = [
@@ -22,17 +22,25 @@ class RegexRuntime(AbstractRuntime):
     def __init__(self, case_sensitive=False):
         self.flags = 0 if case_sensitive else re.IGNORECASE
 
-    def check_script(self, script):
+    def _compile(self, script):
         try:
-            re.compile(script, flags=self.flags)
+            return re.compile(script, flags=self.flags)
         except re.error as error:
             raise SyntaxError(error) from error
 
+    def check_script(self, script):
+        self._compile(script)
+
     def evaluate(self, script, team_puzzle_data, user_puzzle_data, team_data, user_data):
         raise NotImplementedError("RegexRuntime can not be used for static evaluation")
 
+    def compile_validator(self, validator):
+        return self._compile(validator).fullmatch
+
     def validate_guess(self, validator, guess):
-        try:
-            return re.fullmatch(validator, guess, flags=self.flags)
-        except re.error as error:
-            raise SyntaxError(error) from error
+        return self._compile(validator).fullmatch(guess)
+
+    def validate_guesses(self, validator, guesses):
+        pattern = self._compile(validator)
+        correct = {guess for guess in set(guesses) if pattern.fullmatch(guess)}
+        return [guess in correct for guess in guesses]
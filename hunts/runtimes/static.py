@@ -23,14 +23,30 @@ class StaticRuntime(AbstractRuntime):
     def evaluate(self, script, team_puzzle_data, user_puzzle_data, team_data, user_data):
         return script
 
-    def validate_guess(self, validator, guess):
+    def normalise(self, text):
         if self.strip:
-            guess = guess.strip()
-            validator = validator.strip()
+            text = text.strip()
 
         if self.case_handling == Case.FOLD:
-            return validator.casefold() == guess.casefold()
+            return text.casefold()
         elif self.case_handling == Case.LOWER:
-            return validator.lower() == guess.lower()
+            return text.lower()
         else:
-            return validator == guess
+            return text
+
+    def compile_validator(self, validator):
+        validator = self.normalise(validator)
+
+        def validate(guess):
+            return self.normalise(guess) == validator
+
+        return validate
+
+    def validate_guess(self, validator, guess):
+        return self.normalise(validator) == self.normalise(guess)
+
+    def validate_guesses(self, validator, guesses):
+        validator = self.normalise(validator)
+        # Teams often make the same guess, so only check each distinct guess once
+        correct = {guess for guess in set(guesses) if self.normalise(guess) == validator}
+        return [guess in correct for guess in guesses]
@@ -13,7 +13,7 @@
 
 from django.test import TestCase, SimpleTestCase
 
-from . import Runtime
+from . import Runtime, validator_cache
 from .iframe import IFrameRuntime
 from .options import Case
 from .regex import RegexRuntime
@@ -86,6 +86,17 @@ class RegexRuntimeTestCase(SimpleTestCase):
         with self.assertRaises(SyntaxError):
             regex_runtime.validate_guess(regex_script, "")
 
+    def test_validate_guesses(self):
+        regex_runtime = RegexRuntime(case_sensitive=False)
+        regex_script = r'Hello \w*!'
+        guesses = ["Hello Planet!", "Goodbye World!", "hello Friend!", "Hello Planet!", "Hello Planet"]
+        self.assertEqual(regex_runtime.validate_guesses(regex_script, guesses), [True, False, True, True, False])
+
+    def test_validate_guesses_syntax_error_fails(self):
+        regex_runtime = RegexRuntime(case_sensitive=False)
+        with self.assertRaises(SyntaxError):
+            regex_runtime.validate_guesses(r'[]', ["guess"])
+
 
 class StaticRuntimeTestCase(SimpleTestCase):
     def test_evaluate(self):
@@ -171,6 +182,18 @@ class StaticRuntimeTestCase(SimpleTestCase):
         result = static_runtime.validate_guess(static_script, guess)
         self.assertFalse(result)
 
+    def test_validate_guesses(self):
+        static_runtime = StaticRuntime(case_handling=Case.FOLD)
+        static_script = 'Guess '
+        guesses = ['Guess', 'gueß', 'GUESS ', 'G uess', 'Guess', 'incorrect guess']
+        self.assertEqual(static_runtime.validate_guesses(static_script, guesses), [True, True, True, False, True, False])
+
+    def test_validate_guesses_no_strip(self):
+        static_runtime = StaticRuntime(case_handling=Case.NONE, strip=False)
+        static_script = 'Guess'
+        guesses = ['Guess', 'Guess ', 'GUESS']
+        self.assertEqual(static_runtime.validate_guesses(static_script, guesses), [True, False, False])
+
     def test_validate_create_with_options(self):
         runtime = Runtime(Runtime.STATIC).create({"case_handling": "lower"})
         static_script = 'Guess'
@@ -183,3 +206,39 @@ class StaticRuntimeTestCase(SimpleTestCase):
         guess = 'gueß'
         result = runtime.validate_guess(static_script, guess)
         self.assertFalse(result)
+
+
+class ValidatorCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        validator_cache.clear()
+
+    def test_validator_is_reused(self):
+        validator = Runtime.STATIC.validator({'case_handling': 'fold'}, 'Guess')
+        self.assertIs(Runtime.STATIC.validator({'case_handling': 'fold'}, 'Guess'), validator)
+        self.assertTrue(validator('gueß'))
+        self.assertFalse(validator('incorrect guess'))
+
+    def test_validator_keyed_on_options(self):
+        lower = Runtime.STATIC.validator({'case_handling': 'lower', 'strip': True}, 'Guess')
+        # Key order in the options should not matter
+        self.assertIs(Runtime.STATIC.validator({'strip': True, 'case_handling': 'lower'}, 'Guess'), lower)
+        none = Runtime.STATIC.validator({'case_handling': 'none'}, 'Guess')
+        self.assertIsNot(none, lower)
+        self.assertTrue(lower('GUESS'))
+        self.assertFalse(none('GUESS'))
+
+    def test_validator_keyed_on_runtime(self):
+        static = Runtime.STATIC.validator({}, 'Guess.*')
+        regex = Runtime.REGEX.validator({}, 'Guess.*')
+        self.assertFalse(static('Guesses'))
+        self.assertTrue(regex('Guesses'))
+
+    def test_forget_validator(self):
+        validator = Runtime.REGEX.validator({'case_sensitive': True}, r'Hello \w*!')
+        Runtime.REGEX.forget_validator({'case_sensitive': True}, r'Hello \w*!')
+        self.assertIsNot(Runtime.REGEX.validator({'case_sensitive': True}, r'Hello \w*!'), validator)
+
+    def test_regex_validator_syntax_error(self):
+        with self.assertRaises(SyntaxError):
+            Runtime.REGEX.validator({}, r'[]')
+        self.assertEqual(validator_cache.cache_info().currsize, 0)
@@ -0,0 +1,49 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .. import models
+from ..availability import invalidate_availability, invalidate_team_availability
+
+
+@receiver(post_save, sender=models.Episode)
+@receiver(post_delete, sender=models.Episode)
+@receiver(post_save, sender=models.EpisodePrequel)
+@receiver(post_delete, sender=models.EpisodePrequel)
+@receiver(post_save, sender=models.Puzzle)
+@receiver(post_delete, sender=models.Puzzle)
+@receiver(m2m_changed, sender=models.Episode.headstart_from.through)
+def structure_changed(sender, *args, **kwargs):
+    invalidate_availability()
+
+
+@receiver(pre_save, sender=models.TeamPuzzleProgress)
+def progress_saved(sender, instance, *args, **kwargs):
+    old = instance.saved_instance()
+    if (old.solved_by_id if old else None) != instance.solved_by_id:
+        invalidate_team_availability(instance.team_id)
+
+
+@receiver(post_delete, sender=models.TeamPuzzleProgress)
+@receiver(post_delete, sender=models.Headstart)
+@receiver(post_save, sender=models.Headstart)
+def team_progress_changed(sender, instance, *args, **kwargs):
+    invalidate_team_availability(instance.team_id)
+
+
+@receiver(post_delete, sender=models.Guess)
+def guess_deleted(sender, instance, *args, **kwargs):
+    # Deleting a guess which solved a puzzle clears the progress's solved_by without sending any signals for it
+    if instance.by_team_id:
+        invalidate_team_availability(instance.by_team_id)
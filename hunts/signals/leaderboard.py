@@ -0,0 +1,61 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from teams.models import Team
+from .. import models
+from ..leaderboard import update_team
+
+# Changes to the structure of the event are handled by the availability signals, which start a fresh set of leaderboards.
+# These keep the current ones up to date as teams make progress.
+
+
+@receiver(post_save, sender=models.TeamPuzzleProgress)
+def progress_saved(sender, instance, raw, created, *args, **kwargs):
+    if raw:
+        return  # nocover
+    # The instance doesn't remember its new values until after post_save
+    old = None if created else instance.saved_instance()
+    if ((old.solved_by_id, old.late) if old else (None, False)) != (instance.solved_by_id, instance.late):
+        update_team(instance.team_id)
+
+
+@receiver(post_delete, sender=models.TeamPuzzleProgress)
+def progress_deleted(sender, instance, *args, **kwargs):
+    update_team(instance.team_id)
+
+
+@receiver(post_save, sender=models.Guess)
+def guess_saved(sender, instance, raw, created, *args, **kwargs):
+    if raw or created:
+        return
+    # Moving the guess which solved a puzzle changes when the team finished. Only correct guesses can have solved one.
+    if not instance.by_team_id or not instance.correct_for_id:
+        return
+    if instance.saved_instance().given != instance.given:
+        update_team(instance.by_team_id)
+
+
+@receiver(post_delete, sender=models.Guess)
+def guess_deleted(sender, instance, *args, **kwargs):
+    # Deleting a guess which solved a puzzle clears the progress's solved_by without sending any signals for it
+    if instance.by_team_id and instance.correct_for_id:
+        update_team(instance.by_team_id)
+
+
+@receiver(post_save, sender=Team)
+def team_saved(sender, instance, raw, created, *args, **kwargs):
+    # Only player teams are ranked, so this catches changes of role. New teams haven't finished anything.
+    if not raw and not created:
+        update_team(instance.id)
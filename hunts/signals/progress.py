@@ -10,13 +10,20 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+
 from django.contrib.auth import get_user_model
-from django.db.models.signals import pre_save, post_save, pre_delete, m2m_changed
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.db.models import Q
 from django.dispatch import receiver
 
 from teams.models import Team
 from .. import models
+from ..answer_index import answer_index, invalidate_answer_index
+
+# The IDs of the puzzles and unlocks being deleted by this thread, whose answer indexes have already been invalidated, so
+# that the answers deleted along with them needn't each do it again
+_deleting = threading.local()
 
 
 def pre_save_handler(sender):
@@ -43,34 +50,29 @@ def pre_delete_handler(sender):
     return pre_delete_decorator
 
 
-@pre_save_handler(models.Guess)
-def save_guess(sender, instance, raw, *args, **kwargs):
-    if raw:
-        return  # nocover
-    guess = instance
-    answers = guess.for_puzzle.answer_set.all()
+def post_delete_handler(sender):
+    def post_delete_decorator(func):
+        post_delete.connect(func, sender=sender)
+        return func
+
+    return post_delete_decorator
 
-    guess.correct_for = None
+
+def evaluate_guess(guess):
+    """Determine which answer, if any, a guess is correct for"""
+    guess.correct_for = answer_index(guess.for_puzzle_id).correct_answer(guess)
     guess.correct_current = True
 
-    for answer in answers:
-        if answer.validate_guess(guess):
-            guess.correct_for = answer
-            break
 
+def progress_for(guess, lock=False):
+    """Get or create the guessing team's progress on the guess's puzzle, returning it and whether it was created
 
-@post_save_handler(models.Guess)
-def saved_guess(sender, instance, raw, created, *args, **kwargs):
-    # Progress-related stuff happens post-save so that we can update FKs to the guess
-    if raw:
-        return  # nocover
-    # This should never happen in ordinary use
-    # TODO: enforce (after removing `get_correct_for`?)
-    if not created:
-        return  # nocover
-    guess = instance
-    answers = guess.for_puzzle.answer_set.all()
-    progress, created = models.TeamPuzzleProgress.objects.get_or_create(
+    `lock` locks the progress until the end of the transaction, so that guesses are recorded against it one at a time.
+    """
+    progresses = models.TeamPuzzleProgress.objects
+    if lock:
+        progresses = progresses.select_for_update()
+    return progresses.get_or_create(
         team=guess.by_team, puzzle=guess.for_puzzle,
         defaults={
             # If we do have to create this then we don't know the start time.
@@ -79,31 +81,143 @@ def saved_guess(sender, instance, raw, created, *args, **kwargs):
             'late': guess.late,
         },
     )
+
+
+def record_guess(guess, counted=False, progress=None):
+    """Update the guessing team's progress with a newly evaluated guess, unlocking anything it unlocks
+
+    `counted` means that the guess has already been counted in the progress summary. `progress` is the team's progress
+    on the puzzle, if the caller already has it.
+    """
+    if progress is None:
+        progress, created = progress_for(guess)
+        # A newly created progress counted the guess when its summary was filled in
+        counted = counted or created
+    if not counted:
+        models.TeamPuzzleProgress.objects.filter(pk=progress.pk).add_guess(guess)
+    # Kept on the guess so that describing it to admins doesn't look it up again
+    guess.progress = progress
     if guess.late and not progress.late:
         progress.late = True
         progress.save()
 
+    # Correctness was determined by the pre-save handler
+    if not progress.solved_by_id and guess.correct_for_id:
+        progress.solved_by = guess
+        guess.is_correct = True
+        progress.save()
+
+    unlockanswer_ids = answer_index(guess.for_puzzle_id).unlockanswer_ids(guess)
+    # As annotated on the guesses in the admin guess list
+    guess.unlocked = bool(unlockanswer_ids)
+    if not unlockanswer_ids:
+        return
+
     # hints are prefetched for the consumer signal handler
-    unlocks = guess.for_puzzle.unlock_set.all().prefetch_related(
-        'unlockanswer_set',
-        'unlockanswer_set__unlock__obsoletes',
-        'hint_set',
+    unlockanswers = models.UnlockAnswer.objects.filter(id__in=unlockanswer_ids).select_related('unlock').prefetch_related(
+        'unlock__obsoletes',
+        'unlock__hint_set',
     ).seal()
+    for unlockanswer in unlockanswers:
+        models.TeamUnlock(
+            team_puzzle_progress=progress, unlockanswer=unlockanswer, unlocked_by=guess
+        ).save()
+
+
+@pre_save_handler(models.Guess)
+def save_guess(sender, instance, raw, *args, **kwargs):
+    if raw:
+        return  # nocover
+    # Queued guesses are evaluated by a guess worker
+    if instance.queued:
+        return
+    evaluate_guess(instance)
 
-    if not progress.solved_by_id:
-        for answer in answers:
-            if answer.validate_guess(guess):
-                progress.solved_by = guess
-                guess.is_correct = True
-                progress.save()
-                break
 
-    for unlock in unlocks:
-        for unlockanswer in unlock.unlockanswer_set.all():
-            if unlockanswer.validate_guess(guess):
-                models.TeamUnlock(
-                    team_puzzle_progress=progress, unlockanswer=unlockanswer, unlocked_by=guess
-                ).save()
+@post_save_handler(models.Guess)
+def saved_guess(sender, instance, raw, created, *args, **kwargs):
+    # Progress-related stuff happens post-save so that we can update FKs to the guess
+    if raw:
+        return  # nocover
+    # This should never happen in ordinary use
+    # TODO: enforce (after removing `get_correct_for`?)
+    if not created:
+        return  # nocover
+    if instance.queued:
+        # Count the guess straight away so that it isn't missed if the progress is summarised before it is evaluated
+        models.TeamPuzzleProgress.objects.filter(team=instance.by_team, puzzle=instance.for_puzzle).add_guess(instance)
+        return
+    record_guess(instance)
+
+
+def _being_deleted(kind):
+    if not hasattr(_deleting, kind):
+        setattr(_deleting, kind, set())
+    return getattr(_deleting, kind)
+
+
+@post_save_handler(models.Answer)
+@post_delete_handler(models.Answer)
+def forget_answer_validator(sender, instance, *args, created=False, **kwargs):
+    # The validator cache is keyed on the answer text, so this never serves stale results; this just avoids keeping
+    # validators for answers we have finished with.
+    instance.runtime.forget_validator(instance.options, instance.answer)
+    if instance.for_puzzle_id in _being_deleted('puzzles'):
+        return
+    invalidate_answer_index(instance.for_puzzle_id)
+    old = None if created else instance.saved_instance()
+    # An answer moved to another puzzle must stop matching on its old one
+    if old is not None and old.for_puzzle_id != instance.for_puzzle_id:
+        invalidate_answer_index(old.for_puzzle_id)
+
+
+@post_save_handler(models.UnlockAnswer)
+@post_delete_handler(models.UnlockAnswer)
+def forget_unlockanswer_validator(sender, instance, *args, created=False, **kwargs):
+    instance.runtime.forget_validator(instance.options, instance.guess)
+    if instance.unlock_id in _being_deleted('unlocks'):
+        return
+    unlock_ids = {instance.unlock_id}
+    old = None if created else instance.saved_instance()
+    if old is not None:
+        unlock_ids.add(old.unlock_id)
+    # One query for however many unlocks are involved, rather than loading each of them
+    for puzzle_id in set(models.Unlock.objects.filter(id__in=unlock_ids).values_list('puzzle_id', flat=True)):
+        invalidate_answer_index(puzzle_id)
+
+
+@pre_delete_handler(models.Puzzle)
+def deleting_puzzle(sender, instance, *args, **kwargs):
+    invalidate_answer_index(instance.id)
+    _being_deleted('puzzles').add(instance.id)
+
+
+@post_delete_handler(models.Puzzle)
+def deleted_puzzle(sender, instance, *args, **kwargs):
+    _being_deleted('puzzles').discard(instance.id)
+
+
+@pre_delete_handler(models.Unlock)
+def deleting_unlock(sender, instance, *args, **kwargs):
+    if instance.puzzle_id not in _being_deleted('puzzles'):
+        invalidate_answer_index(instance.puzzle_id)
+    _being_deleted('unlocks').add(instance.id)
+
+
+@post_delete_handler(models.Unlock)
+def deleted_unlock(sender, instance, *args, **kwargs):
+    _being_deleted('unlocks').discard(instance.id)
+
+
+@post_save_handler(models.Unlock)
+def moved_unlock(sender, instance, raw, created, *args, **kwargs):
+    if raw or created:
+        return
+    # The unlock's answers move to the new puzzle with it
+    old = instance.saved_instance()
+    if old is not None and old.puzzle_id != instance.puzzle_id:
+        invalidate_answer_index(old.puzzle_id)
+        invalidate_answer_index(instance.puzzle_id)
 
 
 @post_save_handler(models.Answer)
@@ -147,11 +261,8 @@ def saved_unlockanswer(sender, instance, raw, *args, **kwargs):
     unlock = unlockanswer.unlock
     puzzle = unlock.puzzle
 
-    guesses = models.Guess.objects.filter(for_puzzle=puzzle).seal()
-    do_not_delete = []
-    for guess in guesses:
-        if unlockanswer.validate_guess(guess):
-            do_not_delete.append(guess)
+    guesses = list(models.Guess.objects.filter(for_puzzle=puzzle).seal())
+    do_not_delete = [guess for guess, unlocks in zip(guesses, unlockanswer.validate_guesses(guesses)) if unlocks]
     # TODO can't seal these because select_related doesn't propagate to the deletion handler, but sealing does???
     affected = models.TeamUnlock.objects.filter(unlockanswer=unlockanswer).exclude(unlocked_by__in=do_not_delete)
     affected.delete()
@@ -180,4 +291,6 @@ def members_changed(sender, instance, action, pk_set, **kwargs):
     if action == 'post_add':
         users = User.objects.filter(pk__in=pk_set)
         guesses = models.Guess.objects.filter(by__in=users)
+        old_team_ids = set(guesses.exclude(by_team=instance).values_list('by_team_id', flat=True))
         guesses.update(by_team=instance, correct_current=False)
+        models.TeamPuzzleProgress.objects.filter(team_id__in=old_team_ids | {instance.id}).refresh_summary()
@@ -0,0 +1,85 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .. import models
+
+# These keep the summary fields of TeamPuzzleProgress up to date. New guesses are counted as they are recorded; see
+# `record_guess`.
+
+
+@receiver(post_save, sender=models.TeamPuzzleProgress)
+def progress_created(sender, instance, raw, created, *args, **kwargs):
+    if raw or not created:
+        return
+    # This also counts the guess which caused the progress to be created, if there was one
+    models.TeamPuzzleProgress.objects.filter(pk=instance.pk).refresh_summary()
+
+
+@receiver(pre_save, sender=models.Guess)
+def guess_saving(sender, instance, raw, *args, **kwargs):
+    if raw:
+        return  # nocover
+    old = instance.saved_instance()
+    if old is None:
+        return
+    if (old.by_team_id, old.for_puzzle_id, old.given) != (instance.by_team_id, instance.for_puzzle_id, instance.given):
+        instance._summarised_in = (old.by_team_id, old.for_puzzle_id)
+
+
+@receiver(post_save, sender=models.Guess)
+def guess_saved(sender, instance, raw, created, *args, **kwargs):
+    if raw or created:
+        return
+    summarised_in = instance.__dict__.pop('_summarised_in', None)
+    if summarised_in is not None:
+        old_team_id, old_puzzle_id = summarised_in
+        models.TeamPuzzleProgress.objects.filter(
+            Q(team_id=old_team_id, puzzle_id=old_puzzle_id) | Q(team_id=instance.by_team_id, puzzle_id=instance.for_puzzle_id)
+        ).refresh_summary()
+
+
+@receiver(post_delete, sender=models.Guess)
+def guess_deleted(sender, instance, *args, **kwargs):
+    models.TeamPuzzleProgress.objects.filter(team_id=instance.by_team_id, puzzle_id=instance.for_puzzle_id).refresh_summary()
+
+
+@receiver(post_save, sender=models.TeamUnlock)
+@receiver(post_delete, sender=models.TeamUnlock)
+def teamunlock_changed(sender, instance, *args, **kwargs):
+    models.TeamPuzzleProgress.objects.filter(pk=instance.team_puzzle_progress_id).refresh_hints_scheduled()
+
+
+@receiver(post_save, sender=models.Hint)
+@receiver(post_delete, sender=models.Hint)
+def hint_changed(sender, instance, *args, **kwargs):
+    models.TeamPuzzleProgress.objects.filter(puzzle_id=instance.puzzle_id).refresh_hints_scheduled()
+
+
+@receiver(m2m_changed, sender=models.TeamPuzzleProgress.accepted_hints.through)
+def accepted_hints_changed(sender, instance, action, reverse, *args, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        progresses = models.TeamPuzzleProgress.objects.filter(puzzle_id=instance.puzzle_id)
+    else:
+        progresses = models.TeamPuzzleProgress.objects.filter(pk=instance.pk)
+    progresses.refresh_hints_scheduled()
+
+
+@receiver(post_save, sender=models.HintAcceptance)
+@receiver(post_delete, sender=models.HintAcceptance)
+def hint_acceptance_changed(sender, instance, *args, **kwargs):
+    models.TeamPuzzleProgress.objects.filter(pk=instance.team_puzzle_progress_id).refresh_hints_scheduled()
@@ -13,11 +13,16 @@
 
 import abc
 import inspect
+from datetime import timedelta
 from enum import Enum
 from typing import Mapping, Sequence, Tuple, Any
 
 from django.core.cache import caches
 from django.template.loader import render_to_string
+from django.utils import timezone
+
+from teams.models import Team
+from .streams import STREAMS
 
 cache = caches['stats']
 
@@ -111,19 +116,25 @@ class AbstractGenerator(abc.ABC):
             str(self.event.id),
         ]
         if self.episode:
-            key_parts.append(KeyType.EPISODE, self.episode.id)
+            key_parts += [KeyType.EPISODE.value, str(self.episode.id)]
         # Key separated by % since this is invalid in lots of identifiers including Python class names
         return '%'.join(key_parts)
 
     def data(self):
-        key = self.cache_key()
-        data = cache.get(key, version=self.version)
+        data = cache.get(self.cache_key(), version=self.version)
         if data is None:
-            try:
-                data = self.generate()
-                cache.set(key, data, timeout=None, version=self.version)
-            except ValueError:
-                cache.set(key, False)
+            data = self.refresh()
+        return data
+
+    def refresh(self):
+        """
+        Generates the data and replaces any cached copy of it.
+        """
+        try:
+            data = self.generate()
+        except ValueError:
+            data = False
+        cache.set(self.cache_key(), data, timeout=None, version=self.version)
         return data
 
     def render_data(self, data, team=None, user=None):
@@ -132,3 +143,100 @@ class AbstractGenerator(abc.ABC):
     def render(self, team=None, user=None):
         data = self.data()
         return self.render_data(data, team=team, user=user) if data else None
+
+
+class IncrementalGenerator(AbstractGenerator):
+    """
+    Abstract base class for generators whose data is aggregated from the streams of guesses and solves in `streams.STREAMS`.
+
+    The aggregates are kept in the stats cache along with a watermark for each stream, so each time the data is requested only the guesses and solves
+    which have been added since the last time need to be fetched and consumed. Changes to existing guesses and solves, such as an answer being edited
+    after the event, are not picked up until the aggregates are rebuilt with `warmstats --rebuild`. The exception is a solve which is recorded
+    late or changes to another guess, since solves are consumed in the order they were recorded.
+
+    Subclasses name the streams they consume in `streams` and implement a `consume_<stream>(state, items)` method for each.
+    """
+
+    # Guesses and solves more recent than this are left until next time, since transactions which are still open could yet commit
+    # items which belong before them in the stream
+    settle_time = timedelta(seconds=30)
+
+    @property
+    @abc.abstractmethod
+    def streams(self):
+        """
+        Subclasses should override this method to specify the names of the streams they consume.
+        """
+        raise NotImplementedError("Incremental Generator does not define a streams property")
+
+    @abc.abstractmethod
+    def initial_state(self):
+        """
+        Subclasses should override this method to return the aggregates for an event with no guesses or solves.
+        The state is pickled into the stats cache, so it should consist of simple containers of IDs and values rather than model instances.
+        """
+        raise NotImplementedError("Incremental Generator does not define an initial_state method")
+
+    @abc.abstractmethod
+    def finalise(self, state):
+        """
+        Subclasses should override this method to produce the generator's data from its aggregates.
+        """
+        raise NotImplementedError("Incremental Generator does not define a finalise method")
+
+    def generate(self):
+        state = self.initial_state()
+        for name in self.streams:
+            items, _ = STREAMS[name](episode=self.episode)
+            getattr(self, f'consume_{name}')(state, items)
+        return self.finalise(state)
+
+    @staticmethod
+    def team_names(team_ids):
+        """
+        Returns a mapping from the IDs of the given teams to their display names.
+        """
+        teams = Team.objects.filter(id__in=list(team_ids)).prefetch_related('members', 'members__anonymised_relation')
+        return {team.id: team.get_display_name() for team in teams}
+
+    def state_key(self):
+        return f'{self.cache_key()}%state'
+
+    def data(self):
+        key = self.state_key()
+        stored = cache.get(key, version=self.version)
+        if stored is None:
+            stored = {
+                'watermarks': {},
+                'state': self.initial_state(),
+                'data': None,
+            }
+
+        until = timezone.now() - self.settle_time
+        changed = stored['data'] is None
+        for name in self.streams:
+            items, stored['watermarks'][name] = STREAMS[name](episode=self.episode, watermark=stored['watermarks'].get(name), until=until)
+            if items:
+                getattr(self, f'consume_{name}')(stored['state'], items)
+                changed = True
+
+        if changed:
+            try:
+                stored['data'] = self.finalise(stored['state'])
+            except ValueError:
+                stored['data'] = False
+            cache.set(key, stored, timeout=None, version=self.version)
+        return stored['data']
+
+    def refresh(self):
+        """
+        Brings the aggregates up to date, which is all that is needed for the data to be current.
+        """
+        return self.data()
+
+    def rebuild(self):
+        """
+        Discards the aggregates and consumes the streams again from the start.
+        """
+        cache.delete(self.state_key(), version=self.version)
+        return self.data()
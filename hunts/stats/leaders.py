@@ -14,18 +14,40 @@ from datetime import datetime
 
 from schema import And, Schema
 
-from .abstract import AbstractGenerator
+from .abstract import IncrementalGenerator
+from .ranking import Ranking
 from ..models import Episode
 
 
-class LeadersGenerator(AbstractGenerator):
+def finish_times(solved, episodes):
+    """
+    Returns the time at which each team finished all of the given episodes
+
+    Keyword arguments:
+        solved   -- A mapping from team IDs to mappings from the IDs of the puzzles the team has solved to the time they solved them.
+        episodes -- The episodes which must all have been finished.
+    """
+    puzzle_sets = [set(episode.puzzle_set.values_list('id', flat=True)) for episode in episodes]
+    # Nobody can finish an episode with no puzzles
+    if not puzzle_sets or not all(puzzle_sets):
+        return {}
+    puzzles = set.union(*puzzle_sets)
+    return {
+        team_id: max(times[puzzle_id] for puzzle_id in puzzles)
+        for team_id, times in solved.items()
+        if puzzles <= times.keys()
+    }
+
+
+class LeadersGenerator(IncrementalGenerator):
     """
     Generates a table of the hunt leaders
 
     Leaders are defined as the first teams to finished all puzzles in all winning episodes.
     """
     title = 'Leaderboard'
-    version = 1
+    version = 3
+    streams = ('solves', )
 
     schema = Schema({
         'by_team': {
@@ -46,7 +68,16 @@ class LeadersGenerator(AbstractGenerator):
         super().__init__(**kwargs)
         self.number = number
 
-    def generate(self):
+    def initial_state(self):
+        return {
+            'solved': {},
+        }
+
+    def consume_solves(self, state, solves):
+        for solve in solves:
+            state['solved'].setdefault(solve.team_id, {})[solve.puzzle_id] = solve.time
+
+    def finalise(self, state):
         if self.episode is not None:
             episodes = [self.episode]
         else:
@@ -58,23 +89,16 @@ class LeadersGenerator(AbstractGenerator):
             if episodes.count() == 0:
                 raise ValueError("Event has no winning episodes")
 
-        # We have at least one episode, copy the first episode's finish times
-        team_times = {team: time for team, time in episodes[0].finished_times()}
-        # Iterate remaining episodes to find people who finished later than the existing time or did not finish
-        for episode in episodes[1:]:
-            old_times = team_times
-            team_times = {}
-            for team, time in episode.finished_times():
-                if team in old_times:
-                    team_times[team] = max(old_times[team], time)
-
-        sorted_team_times = list(sorted(team_times.items(), key=lambda x: x[1]))
-        top = [(position, team.get_display_name(), time) for position, (team, time) in enumerate(sorted_team_times, start=1)][:self.number]
+        # A team's finish time is the time they solved the last of the puzzles in all the episodes
+        ranking = Ranking(finish_times(state['solved'], episodes))
+        top = ranking.top(self.number)
+        names = self.team_names(team_id for _, team_id, _ in top)
+        top = [(position, names[team_id], time) for position, team_id, time in top]
         by_team = {
-            team.id: {
+            team_id: {
                 'position': position,
                 'finish_time': time,
-            } for position, (team, time) in enumerate(sorted_team_times, start=1)
+            } for position, team_id, time in ranking
         }
 
         return {
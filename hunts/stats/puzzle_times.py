@@ -21,65 +21,20 @@
 #  You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 from datetime import timedelta
 
-from django.db.models import F
 from schema import And, Schema
 
-from hunts.models import Episode, Puzzle, TeamPuzzleProgress
-from hunts.stats.abstract import AbstractGenerator
-from teams.models import TeamRole
+from hunts.models import Episode, Puzzle
+from hunts.stats.abstract import IncrementalGenerator
+from hunts.stats.ranking import Ranking
 
 
-def solve_time_tpps_for_puzzle(puzzle):
-    # In normal circumstances, getting solve times is a simple affair, but if team members get moved it can be that
-    # they are poorly defined. This is not usually a problem because nothing depends on them, but negative solve times
-    # would cause raised eyebrows in user-facing stats, so we make some effort to calculate a more sensible value
-    # in this situation.
-    tpps = TeamPuzzleProgress.objects.filter(
-        puzzle=puzzle,
-        start_time__isnull=False,
-        solved_by__isnull=False,
-        late=False,
-        team__role=TeamRole.PLAYER,
-    ).select_related(
-        'puzzle',
-        'puzzle__episode',
-        'solved_by',
-        'team',
-    ).prefetch_related(
-        'puzzle__episode__puzzle_set',
-        'team__members',
-        'team__members__anonymised_relation',
-    ).annotate(
-        solve_time=F('solved_by__given') - F('start_time'),
-    ).order_by('solve_time').seal()
-
-    for tpp in tpps:
-        if tpp.solve_time < timedelta(0):
-            puzzle_number = tpp.puzzle.get_relative_id()
-            if tpp.puzzle.episode.parallel or puzzle_number == 1:
-                start_time = tpp.puzzle.start_time_for(tpp.team)
-            else:
-                # The position we have is 1-indexed and we're indexing into a 0-indexed array
-                prior_puzzle = tpp.puzzle.episode.puzzle_set.all()[puzzle_number - 2]
-                try:
-                    start_time = TeamPuzzleProgress.objects.get(
-                        puzzle=prior_puzzle,
-                        team=tpp.team,
-                        solved_by__isnull=False,
-                    ).solved_by.given
-                except TeamPuzzleProgress.DoesNotExist:
-                    continue
-            tpp.solve_time = tpp.solved_by.given - start_time
-
-    return sorted(tpps, key=lambda x: x.solve_time)
-
-
-class PuzzleTimesGenerator(AbstractGenerator):
+class PuzzleTimesGenerator(IncrementalGenerator):
     """
     Generates a table of solve times per puzzle
     """
     title = 'Fastest Solve Times'
-    version = 2
+    version = 4
+    streams = ('solves', )
 
     schema = Schema([{
         'name': And(str, len),
@@ -107,48 +62,65 @@ class PuzzleTimesGenerator(AbstractGenerator):
 
     @staticmethod
     def format_solve_time(d):
-        hours, r = divmod(d, timedelta(hours=1))
-        minutes, r = divmod(r, timedelta(minutes=1))
-        seconds, _ = divmod(r, timedelta(seconds=1))
+        # Dividing integers is much quicker than dividing timedeltas, which matters when formatting every solve in the event
+        seconds = d // timedelta(seconds=1)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
         if hours > 0:
             return f'{hours:d}:{minutes:02d}:{seconds:02d}'
         else:
             return f'{minutes:d}:{seconds:02d}'
 
-    def generate(self):
+    def initial_state(self):
+        return {
+            'times': {},
+        }
+
+    def consume_solves(self, state, solves):
+        for solve in solves:
+            if solve.solve_time is not None:
+                state['times'].setdefault(solve.puzzle_id, {})[solve.team_id] = solve.solve_time
+
+    def finalise(self, state):
         if self.episode is not None:
             episodes = (self.episode, )
         else:
             episodes = Episode.objects.filter(no_stats=False)
 
         output = []
+        top_teams = set()
 
         for episode in episodes:
             puzzles = Puzzle.objects.filter(episode=episode).seal()
             puzzle_solve_times = []
             for puzzle in puzzles:
-                by_team = {}
-                by_time = []
-
-                tpps = solve_time_tpps_for_puzzle(puzzle)
-
-                for position, tpp in enumerate(tpps):
-                    team_name = tpp.team.get_display_name()
-                    by_team[tpp.team.id] = {
-                        'position': position + 1,
-                        'solve_time': self.format_solve_time(tpp.solve_time),
-                    }
-                    by_time.append((position + 1, team_name, self.format_solve_time(tpp.solve_time)))
+                ranking = Ranking(state['times'].get(puzzle.id, {}))
+                top = ranking.top(self.number)
+                top_teams.update(team_id for _, team_id, _ in top)
 
                 puzzle_solve_times.append({
                     'title': puzzle.title,
-                    'by_team': by_team,
-                    'top': by_time[:self.number],
+                    'by_team': {
+                        team_id: {
+                            'position': position,
+                            'solve_time': self.format_solve_time(solve_time),
+                        } for position, team_id, solve_time in ranking
+                    },
+                    'top': top,
                 })
             output.append({
                 'name': episode.name,
                 'puzzles': puzzle_solve_times,
             })
+
+        # Only look up the names which will be displayed
+        names = self.team_names(top_teams)
+        for episode in output:
+            for puzzle in episode['puzzles']:
+                puzzle['top'] = [
+                    (position, names[team_id], self.format_solve_time(solve_time))
+                    for position, team_id, solve_time in puzzle['top']
+                ]
         return output
 
     def render_data(self, data, team=None, user=None):
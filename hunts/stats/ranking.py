@@ -0,0 +1,62 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from itertools import count
+from math import floor
+from operator import itemgetter
+
+
+class Ranking:
+    """The entries of a mapping ordered by their values, such as teams by their solve times on a puzzle
+
+    Positions count from 1 and are never shared: entries with equal values keep the order they have in the mapping. The
+    values are kept in order alongside the IDs, so quantiles can be read straight off them.
+    """
+
+    def __init__(self, values, reverse=False):
+        ordered = sorted(values.items(), key=itemgetter(1), reverse=reverse)
+        self.ids = [id for id, _ in ordered]
+        self.values = [value for _, value in ordered]
+        self.reverse = reverse
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """Iterate over the (position, id, value) of each entry in order"""
+        return zip(count(1), self.ids, self.values)
+
+    def top(self, number):
+        """Return the (position, id, value) of the first `number` entries"""
+        return list(zip(count(1), self.ids[:number], self.values[:number]))
+
+    def quantile(self, q):
+        return quantile(self.values[::-1] if self.reverse else self.values, q)
+
+
+def quantile(values, q):
+    """Return the q-quantile of a sorted sequence of numbers, or 0.0 if it is empty
+
+    Quantiles which fall between two values are interpolated linearly, which is the default method of most statistics packages.
+    """
+    if not values:
+        return 0.0
+    N = len(values) - 1
+    idx = q * N
+    lo = floor(idx)
+    h = idx - lo
+    a = values[lo]
+    if h == 0:
+        return a
+    else:
+        b = values[min(lo + 1, N)]
+        return a + h * (b - a)
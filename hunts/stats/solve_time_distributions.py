@@ -20,37 +20,22 @@
 #
 #  You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 import json
-from math import floor
 
 from django.utils.safestring import mark_safe
 from schema import Schema
 
 from hunts.models import Episode, Puzzle
-from hunts.stats.abstract import AbstractGenerator
-from hunts.stats.puzzle_times import solve_time_tpps_for_puzzle
+from hunts.stats.abstract import IncrementalGenerator
+from hunts.stats.ranking import Ranking
 
 
-def _percentile(values, q):
-    if not values:
-        return 0.0
-    N = len(values) - 1
-    idx = q * N
-    lo = floor(idx)
-    h = idx - lo
-    a = values[lo]
-    if h == 0:
-        return a
-    else:
-        b = values[min(lo + 1, N)]
-        return a + h * (b - a)
-
-
-class SolveDistributionGenerator(AbstractGenerator):
+class SolveDistributionGenerator(IncrementalGenerator):
     """
     Generates a distribution of solve times per puzzle
     """
     title = 'Puzzle Solve Time Distributions'
-    version = 1
+    version = 3
+    streams = ('solves', )
 
     schema = Schema({
         'episodes': [{
@@ -67,7 +52,17 @@ class SolveDistributionGenerator(AbstractGenerator):
         }]
     })
 
-    def generate(self):
+    def initial_state(self):
+        return {
+            'times': {},
+        }
+
+    def consume_solves(self, state, solves):
+        for solve in solves:
+            if solve.solve_time is not None:
+                state['times'].setdefault(solve.puzzle_id, {})[solve.team_id] = solve.solve_time.total_seconds()
+
+    def finalise(self, state):
         if self.episode is not None:
             episodes = (self.episode, )
         else:
@@ -81,21 +76,14 @@ class SolveDistributionGenerator(AbstractGenerator):
             # The largest Q3 is used for bounds calculation in the frontend
             max_q3 = 0.0
             for puzzle in puzzles:
-                tpps = solve_time_tpps_for_puzzle(puzzle)
-                solve_times = {
-                    tpp.team_id: tpp.solve_time.total_seconds()
-                    for tpp in tpps
-                }
-
-                vals = list(solve_times.values())
-                max_q3 = max(max_q3, _percentile(vals, 0.75))
-                # 90th percentile is displayed in the frontend
-                ninetieth_percentile = _percentile(vals, 0.9)
+                ranking = Ranking(state['times'].get(puzzle.id, {}))
+                max_q3 = max(max_q3, ranking.quantile(0.75))
 
                 puzzle_solve_times.append({
                     'title': puzzle.title,
-                    'solve_times': solve_times,
-                    '90%': ninetieth_percentile,
+                    'solve_times': dict(zip(ranking.ids, ranking.values)),
+                    # 90th percentile is displayed in the frontend
+                    '90%': ranking.quantile(0.9),
                 })
 
             output.append({
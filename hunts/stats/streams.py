@@ -0,0 +1,167 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db.models import F, Q
+
+from teams.models import TeamRole
+from ..models import Episode, Guess, Headstart, TeamPuzzleProgress
+
+GuessItem = namedtuple('GuessItem', ('team_id', 'user_id', 'puzzle_id'))
+SolveItem = namedtuple('SolveItem', ('team_id', 'puzzle_id', 'episode_id', 'no_stats', 'time', 'solve_time'))
+
+
+def solve_times(tpps):
+    """Return the solved, on-time progress of player teams in `tpps`, with the time each took to solve its puzzle as `solve_time`
+
+    The solve time is None for progress without a start time.
+    """
+    tpps = list(tpps.filter(
+        solved_by__isnull=False,
+        late=False,
+        team__role=TeamRole.PLAYER,
+    ).select_related(
+        'puzzle',
+        'puzzle__episode',
+        'solved_by',
+        'team',
+    ).prefetch_related(
+        'puzzle__episode__puzzle_set',
+    ).annotate(
+        solve_time=F('solved_by__given') - F('start_time'),
+    ).seal())
+
+    # In normal circumstances, getting solve times is a simple affair, but if team members get moved it can be that
+    # they are poorly defined. This is not usually a problem because nothing depends on them, but negative solve times
+    # would cause raised eyebrows in user-facing stats, so we make some effort to calculate a more sensible value
+    # in this situation.
+    negative = [tpp for tpp in tpps if tpp.solve_time is not None and tpp.solve_time < timedelta(0)]
+    if negative:
+        _fix_solve_times(negative)
+    return tpps
+
+
+def _fix_solve_times(tpps):
+    # Everything needed is fetched for all the progress at once, so this takes the same number of queries however many
+    # solve times need fixing
+    from_start = []
+    from_prior = []
+    for tpp in tpps:
+        puzzle_number = tpp.puzzle.get_relative_id()
+        if tpp.puzzle.episode.parallel or puzzle_number == 1:
+            from_start.append(tpp)
+        else:
+            # The position we have is 1-indexed and we're indexing into a 0-indexed array
+            from_prior.append((tpp, tpp.puzzle.episode.puzzle_set.all()[puzzle_number - 2].id))
+
+    if from_start:
+        headstarts = _headstarts({tpp.team_id for tpp in from_start}, {tpp.puzzle.episode_id for tpp in from_start})
+        for tpp in from_start:
+            start_time = tpp.puzzle.start_time_for(tpp.team, headstarts[tpp.team_id, tpp.puzzle.episode_id])
+            tpp.solve_time = tpp.solved_by.given - start_time
+
+    if from_prior:
+        prior_solve_times = {
+            (team_id, puzzle_id): given
+            for team_id, puzzle_id, given in TeamPuzzleProgress.objects.filter(
+                team_id__in={tpp.team_id for tpp, _ in from_prior},
+                puzzle_id__in={prior_puzzle_id for _, prior_puzzle_id in from_prior},
+                solved_by__isnull=False,
+            ).values_list('team_id', 'puzzle_id', 'solved_by__given')
+        }
+        for tpp, prior_puzzle_id in from_prior:
+            try:
+                start_time = prior_solve_times[tpp.team_id, prior_puzzle_id]
+            except KeyError:
+                continue
+            tpp.solve_time = tpp.solved_by.given - start_time
+
+
+def _headstarts(team_ids, episode_ids):
+    """Return the headstart applied to each of the teams on each of the episodes, as Episode.headstart_applied would"""
+    episodes = Episode.objects.filter(id__in=episode_ids).prefetch_related('headstart_from')
+    sources = {episode.id: [source.id for source in episode.headstart_from.all()] for episode in episodes}
+    granted = TeamPuzzleProgress.objects.filter(
+        team_id__in=team_ids,
+        puzzle__episode_id__in={source for episode_sources in sources.values() for source in episode_sources},
+    ).headstart_granted()
+    adjustments = {
+        (team_id, episode_id): adjustment
+        for team_id, episode_id, adjustment in Headstart.objects.filter(
+            team_id__in=team_ids,
+            episode_id__in=episode_ids,
+        ).values_list('team_id', 'episode_id', 'headstart_adjustment')
+    }
+    return {
+        (team_id, episode_id): sum(
+            (granted.get((team_id, source), timedelta(0)) for source in sources[episode_id]),
+            start=adjustments.get((team_id, episode_id), timedelta(0)),
+        )
+        for team_id in team_ids
+        for episode_id in episode_ids
+    }
+
+
+def _after(queryset, time_field, id_field, watermark, until):
+    if watermark is not None:
+        time, id = watermark
+        queryset = queryset.filter(Q(**{f'{time_field}__gt': time}) | Q(**{time_field: time, f'{id_field}__gt': id}))
+    if until is not None:
+        queryset = queryset.filter(**{f'{time_field}__lt': until})
+    return queryset.order_by(time_field, id_field)
+
+
+def guesses(episode=None, watermark=None, until=None):
+    """Return the guesses counted in stats which come after `watermark` and were given before `until`, and the new watermark
+
+    Guesses are ordered by the time they were given, with their IDs breaking ties, and a watermark is the (time, ID) of the last
+    guess which has been consumed.
+    """
+    queryset = Guess.objects.filter(
+        by_team__role=TeamRole.PLAYER,
+        for_puzzle__episode__no_stats=False,
+        late=False,
+    )
+    if episode is not None:
+        queryset = queryset.filter(for_puzzle__episode=episode)
+    rows = list(_after(queryset, 'given', 'id', watermark, until).values_list('by_team_id', 'by_id', 'for_puzzle_id', 'given', 'id'))
+    if rows:
+        watermark = rows[-1][3:]
+    return [GuessItem(*row[:3]) for row in rows], watermark
+
+
+def solves(episode=None, watermark=None, until=None):
+    """Return the solves by player teams which come after `watermark` and were recorded before `until`, and the new watermark
+
+    Solves are ordered by the time they were recorded rather than the time of the solving guess, since a guess can be found to be correct
+    long after it was given. The watermark is the (time recorded, progress ID) of the last solve consumed. A progress whose solve changes
+    comes round again, and replaces what was consumed for it before. Solves of puzzles in episodes which are excluded from stats are
+    included, since they still count towards finishing the event.
+    """
+    queryset = TeamPuzzleProgress.objects.all()
+    if episode is not None:
+        queryset = queryset.filter(puzzle__episode=episode)
+    tpps = solve_times(_after(queryset, 'solved_at', 'id', watermark, until))
+    if tpps:
+        watermark = (tpps[-1].solved_at, tpps[-1].id)
+    return [
+        SolveItem(tpp.team_id, tpp.puzzle_id, tpp.puzzle.episode_id, tpp.puzzle.episode.no_stats, tpp.solved_by.given, tpp.solve_time)
+        for tpp in tpps
+    ], watermark
+
+
+STREAMS = {
+    'guesses': guesses,
+    'solves': solves,
+}
@@ -11,11 +11,15 @@
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
+from django.core.management import call_command
 from django.db.models.signals import post_save
 from django.test import SimpleTestCase
 from django.utils import timezone
 from faker import Faker
+import freezegun
 import pytest
 from schema import Schema
 
@@ -25,12 +29,15 @@ from events.models import Event
 from teams.factories import TeamFactory, TeamMemberFactory
 from teams.models import TeamRole
 from . import PuzzleTimesGenerator, SolveDistributionGenerator
-from ..factories import GuessFactory, PuzzleFactory, EpisodeFactory, TeamPuzzleProgressFactory
-from .abstract import AbstractGenerator
+from ..factories import AnswerFactory, GuessFactory, PuzzleFactory, EpisodeFactory, TeamPuzzleProgressFactory
+from ..runtimes import Runtime
+from .abstract import AbstractGenerator, IncrementalGenerator
 from .leaders import LeadersGenerator
+from .ranking import Ranking
+from .streams import solve_times
 from .top_guesses import TopGuessesGenerator
 from .totals import TotalsGenerator
-from ..models import TeamPuzzleProgress, Answer
+from ..models import TeamPuzzleProgress, Answer, Episode, Guess
 
 
 @pytest.fixture
@@ -85,6 +92,37 @@ class StatCacheTests(SimpleTestCase):
         self.stat.version = 3
         self.assertNotEqual(data, self.stat.data())
 
+    def test_episode_cache_miss(self):
+        episode_stat = MockStat(self.event, episode=Episode(id=1))
+        data = self.stat.data()
+        self.assertNotEqual(data, episode_stat.data())
+
+    def test_refresh(self):
+        data = self.stat.data()
+        refreshed = self.stat.refresh()
+        self.assertNotEqual(data, refreshed)
+        self.assertEqual(refreshed, self.stat.data())
+
+
+class RankingTests(SimpleTestCase):
+    def test_order(self):
+        ranking = Ranking({'a': 3, 'b': 1, 'c': 2, 'd': 1})
+        self.assertEqual(list(ranking), [(1, 'b', 1), (2, 'd', 1), (3, 'c', 2), (4, 'a', 3)])
+        self.assertEqual(ranking.top(2), [(1, 'b', 1), (2, 'd', 1)])
+
+    def test_reverse(self):
+        ranking = Ranking({'a': 3, 'b': 1, 'c': 2, 'd': 3}, reverse=True)
+        self.assertEqual(list(ranking), [(1, 'a', 3), (2, 'd', 3), (3, 'c', 2), (4, 'b', 1)])
+        self.assertEqual(ranking.quantile(0.25), 1.75)
+
+    def test_quantile(self):
+        ranking = Ranking({i: float(i * 10) for i in range(5)})
+        self.assertEqual(ranking.quantile(0), 0.0)
+        self.assertEqual(ranking.quantile(0.5), 20.0)
+        self.assertAlmostEqual(ranking.quantile(0.9), 36.0)
+        self.assertEqual(ranking.quantile(1), 40.0)
+        self.assertEqual(Ranking({}).quantile(0.5), 0.0)
+
 
 class TestLeaders:
     def test_event_leaders(self, event):
@@ -526,6 +564,33 @@ class TestPuzzleTimes:
         assert len(data) == 1
 
 
+class TestSolveTimes:
+    def test_negative_solve_times(self, event, django_assert_max_num_queries):
+        episode = EpisodeFactory(parallel=False)
+        first, second = sorted(PuzzleFactory.create_batch(2, episode=episode), key=lambda p: p.get_relative_id())
+        players = TeamMemberFactory.create_batch(3, team__role=TeamRole.PLAYER)
+        now = timezone.now()
+        for player in players:
+            team = player.team_at(event)
+            # The progress was started after the puzzles were solved, as can happen when players change team
+            for puzzle in (first, second):
+                TeamPuzzleProgressFactory(team=team, puzzle=puzzle, start_time=now)
+            GuessFactory(by=player, for_puzzle=first, correct=True, given=now - timedelta(minutes=10))
+            GuessFactory(by=player, for_puzzle=second, correct=True, given=now - timedelta(minutes=4))
+
+        # The number of queries doesn't depend on how many solve times need fixing
+        with django_assert_max_num_queries(7):
+            tpps = solve_times(TeamPuzzleProgress.objects.all())
+
+        assert len(tpps) == 6
+        for tpp in tpps:
+            if tpp.puzzle == first:
+                assert tpp.solve_time == tpp.solved_by.given - first.start_time_for(tpp.team)
+            else:
+                # The second puzzle was started when the first was solved
+                assert tpp.solve_time == timedelta(minutes=6)
+
+
 @pytest.mark.usefixtures("late_guesser")
 class TestSolveDistribution:
     def test_episode_puzzle_times(self, event):
@@ -574,3 +639,117 @@ class TestSolveDistribution:
         data = SolveDistributionGenerator(event=event).generate()
         assert SolveDistributionGenerator.schema.is_valid(data)
         assert len(data['episodes']) == 1
+
+
+class TestIncremental:
+    @staticmethod
+    def settled():
+        """Move past the time when everything recorded so far can be consumed"""
+        return freezegun.freeze_time(timezone.now() + IncrementalGenerator.settle_time + timedelta(seconds=1))
+
+    def test_new_guesses_consumed(self, event):
+        puzzle = PuzzleFactory()
+        player = TeamMemberFactory(team__role=TeamRole.PLAYER)
+        earlier = timezone.now() - timedelta(hours=1)
+        GuessFactory.create_batch(2, by=player, for_puzzle=puzzle, given=earlier)
+
+        generator = TotalsGenerator(event=event)
+        assert generator.rebuild()['guess_count'] == 2
+
+        GuessFactory(by=player, for_puzzle=puzzle, given=earlier + timedelta(minutes=1))
+        # This guess is too recent to be consumed yet
+        GuessFactory(by=player, for_puzzle=puzzle)
+        assert generator.data()['guess_count'] == 3
+
+    def test_unchanged_not_finalised(self, event):
+        puzzle = PuzzleFactory()
+        player = TeamMemberFactory(team__role=TeamRole.PLAYER)
+        GuessFactory(by=player, for_puzzle=puzzle, given=timezone.now() - timedelta(hours=1))
+
+        generator = TopGuessesGenerator(event=event)
+        data = generator.rebuild()
+        with mock.patch.object(TopGuessesGenerator, 'finalise') as finalise:
+            assert generator.data() == data
+        finalise.assert_not_called()
+
+    def test_new_solves_consumed(self, event):
+        puzzle = PuzzleFactory(episode__winning=True)
+        players = TeamMemberFactory.create_batch(2, team__role=TeamRole.PLAYER)
+        earlier = timezone.now() - timedelta(hours=1)
+        GuessFactory(by=players[0], for_puzzle=puzzle, correct=True, given=earlier)
+
+        generator = LeadersGenerator(event=event)
+        with self.settled():
+            assert len(generator.rebuild()['top']) == 1
+
+        guess = GuessFactory(by=players[1], for_puzzle=puzzle, correct=True, given=earlier + timedelta(minutes=1))
+        # The solve was only just recorded
+        assert len(generator.data()['top']) == 1
+        with self.settled():
+            data = generator.data()
+        assert data['top'][1] == (2, players[1].team_at(event).get_display_name(), guess.given)
+
+    def test_solve_recorded_late_consumed(self, event):
+        puzzle = PuzzleFactory(episode__winning=True)
+        players = TeamMemberFactory.create_batch(2, team__role=TeamRole.PLAYER)
+        earlier = timezone.now() - timedelta(hours=1)
+        late_guess = GuessFactory(by=players[1], for_puzzle=puzzle, guess='late', given=earlier)
+        GuessFactory(by=players[0], for_puzzle=puzzle, correct=True, given=earlier + timedelta(minutes=1))
+
+        generator = LeadersGenerator(event=event)
+        with self.settled():
+            assert len(generator.rebuild()['top']) == 1
+
+        # An answer added now makes a guess given before the consumed solve correct
+        AnswerFactory(for_puzzle=puzzle, runtime=Runtime.STATIC, answer='late')
+        with self.settled():
+            data = generator.data()
+        assert data['top'][0] == (1, players[1].team_at(event).get_display_name(), late_guess.given)
+        assert data == generator.generate()
+
+    def test_rebuild(self, event):
+        puzzle = PuzzleFactory()
+        player = TeamMemberFactory(team__role=TeamRole.PLAYER)
+        earlier = timezone.now() - timedelta(hours=1)
+        guess = GuessFactory(by=player, for_puzzle=puzzle, given=earlier)
+        GuessFactory(by=player, for_puzzle=puzzle, given=earlier)
+
+        generator = TotalsGenerator(event=event)
+        generator.rebuild()
+        Guess.objects.filter(id=guess.id).delete()
+        # Only new guesses are consumed, so the deletion is not noticed until the aggregates are rebuilt
+        assert generator.data()['guess_count'] == 2
+        assert generator.rebuild()['guess_count'] == 1
+
+    def test_incremental_matches_generate(self, event):
+        puzzles = PuzzleFactory.create_batch(2, episode__winning=True)
+        players = TeamMemberFactory.create_batch(3, team__role=TeamRole.PLAYER)
+        earlier = timezone.now() - timedelta(hours=1)
+        for i, player in enumerate(players):
+            GuessFactory.create_batch(i + 1, by=player, for_puzzle=puzzles[0], given=earlier + timedelta(minutes=i))
+            GuessFactory(by=player, for_puzzle=puzzles[0], correct=True, given=earlier + timedelta(minutes=i))
+
+        generators = [Generator(event=event) for Generator in (LeadersGenerator, TopGuessesGenerator, TotalsGenerator)]
+        with self.settled():
+            for generator in generators:
+                generator.rebuild()
+        for i, player in enumerate(players):
+            GuessFactory(by=player, for_puzzle=puzzles[1], correct=True, given=earlier + timedelta(minutes=10 - i))
+
+        with self.settled():
+            for generator in generators:
+                assert generator.data() == generator.generate()
+
+    def test_warmstats_command(self, event):
+        puzzle = PuzzleFactory()
+        player = TeamMemberFactory(team__role=TeamRole.PLAYER)
+        GuessFactory(by=player, for_puzzle=puzzle, given=timezone.now() - timedelta(hours=1))
+
+        output = StringIO()
+        call_command('warmstats', event.schema_name, processes=1, rebuild=True, stdout=output)
+        assert f'{event.schema_name}: totals took' in output.getvalue()
+        assert f'{event.schema_name} episode {puzzle.episode.id}: totals took' in output.getvalue()
+
+        with mock.patch.object(TotalsGenerator, 'finalise') as finalise:
+            assert TotalsGenerator(event=event).data()['guess_count'] == 1
+        finalise.assert_not_called()
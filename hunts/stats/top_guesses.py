@@ -13,21 +13,21 @@
 from datetime import datetime
 
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
 from schema import And, Schema
 
-from teams.models import Team, TeamRole
-from .abstract import AbstractGenerator
+from .abstract import IncrementalGenerator
+from .ranking import Ranking
 
 
-class TopGuessesGenerator(AbstractGenerator):
+class TopGuessesGenerator(IncrementalGenerator):
     """
     Generates table of the top guessing users and teams
 
     Guess counts are aggregated by user and team and those who submitted the most guesses are included in the output.
     """
     title = 'Most Guesses'
-    version = 1
+    version = 2
+    streams = ('guesses', )
 
     _by_entity_schema = Schema({
         'position': int,
@@ -59,39 +59,51 @@ class TopGuessesGenerator(AbstractGenerator):
         super().__init__(**kwargs)
         self._number = number
 
-    def generate(self):
+    def initial_state(self):
+        return {
+            'teams': {},
+            'users': {},
+        }
+
+    def consume_guesses(self, state, guesses):
+        for guess in guesses:
+            state['teams'][guess.team_id] = state['teams'].get(guess.team_id, 0) + 1
+            state['users'][guess.user_id] = state['users'].get(guess.user_id, 0) + 1
+
+    def finalise(self, state):
         User = get_user_model()
-        guesses_filter = Q(guess__for_puzzle__episode__no_stats=False, guess__late=False)
-        if self.episode is not None:
-            guesses_filter &= Q(guess__for_puzzle__episode=self.episode)
-        teams = Team.objects.filter(role=TeamRole.PLAYER).annotate(guess_count=Count('guess', filter=guesses_filter)).order_by('-guess_count')
-        users = User.objects.filter(teams__role=TeamRole.PLAYER).annotate(guess_count=Count('guess', filter=guesses_filter)).order_by('-guess_count')
+        teams = Ranking(state['teams'], reverse=True)
+        users = Ranking(state['users'], reverse=True)
+        top_teams = teams.top(self._number)
+        top_users = users.top(self._number)
+        team_names = self.team_names(team_id for _, team_id, _ in top_teams)
+        usernames = dict(User.objects.filter(id__in=[user_id for _, user_id, _ in top_users]).values_list('id', 'username'))
         return {
             'by_team': {
-                team.id: {
+                team_id: {
                     'position': position,
-                    'guess_count': team.guess_count,
-                } for position, team in enumerate(teams, start=1)
+                    'guess_count': guess_count,
+                } for position, team_id, guess_count in teams
             },
             'top_teams': [
                 (
                     position,
-                    team.get_display_name(),
-                    team.guess_count,
-                ) for position, team in enumerate(teams[:self._number], start=1)
+                    team_names[team_id],
+                    guess_count,
+                ) for position, team_id, guess_count in top_teams
             ],
             'by_user': {
-                user.id: {
+                user_id: {
                     'position': position,
-                    'guess_count': user.guess_count,
-                } for position, user in enumerate(users, start=1)
+                    'guess_count': guess_count,
+                } for position, user_id, guess_count in users
             },
             'top_users': [
                 (
                     position,
-                    user.username,
-                    user.guess_count,
-                ) for position, user in enumerate(users[:self._number], start=1)
+                    usernames[user_id],
+                    guess_count,
+                ) for position, user_id, guess_count in top_users
             ],
         }
 
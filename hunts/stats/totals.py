@@ -12,15 +12,13 @@
 
 
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
 from schema import Schema
 
-from hunts.models import Guess, TeamPuzzleProgress
-from teams.models import Team, TeamRole
-from .abstract import AbstractGenerator
+from .abstract import IncrementalGenerator
+from .leaders import finish_times
 
 
-class TotalsGenerator(AbstractGenerator):
+class TotalsGenerator(IncrementalGenerator):
     """
     Generates headline participation statistics
 
@@ -33,7 +31,8 @@ class TotalsGenerator(AbstractGenerator):
         - Guess Count    - The total number of guesses submitted by all players and teams.
     """
     title = 'Totals'
-    version = 3
+    version = 5
+    streams = ('guesses', 'solves')
 
     schema = Schema({
         'active_players': int,
@@ -43,41 +42,43 @@ class TotalsGenerator(AbstractGenerator):
         'guess_count': int,
     })
 
-    def generate(self):
+    def initial_state(self):
+        return {
+            'guess_count': 0,
+            'active_teams': set(),
+            'solved': {},
+            # Solves of these puzzles count towards finishing, but are otherwise excluded
+            'no_stats_puzzles': set(),
+        }
+
+    def consume_guesses(self, state, guesses):
+        for guess in guesses:
+            state['guess_count'] += 1
+            state['active_teams'].add(guess.team_id)
+
+    def consume_solves(self, state, solves):
+        for solve in solves:
+            state['solved'].setdefault(solve.team_id, {})[solve.puzzle_id] = solve.time
+            if solve.no_stats:
+                state['no_stats_puzzles'].add(solve.puzzle_id)
+
+    def finalise(self, state):
         User = get_user_model()
 
-        guesses_filter = Q(for_puzzle__episode__no_stats=False, late=False)
-        team_guesses_filter = Q(guess__for_puzzle__episode__no_stats=False, guess__late=False)
-        team_puzzle_progress_filter = Q(puzzle__episode__no_stats=False, late=False)
         if self.episode is not None:
-            guesses_filter &= Q(for_puzzle__episode=self.episode)
-            team_guesses_filter &= Q(guess__for_puzzle__episode=self.episode)
-            team_puzzle_progress_filter &= Q(puzzle__episode=self.episode)
             finishing_episodes = [self.episode]
         else:
             finishing_episodes = self.event.episode_set.filter(winning=True)
-        teams = Team.objects.filter(role=TeamRole.PLAYER).annotate(
-            guesses=Count('guess', filter=team_guesses_filter),
-            correct_guesses=Count('guess', filter=team_guesses_filter & Q(guess__correct_for__isnull=False, guess__correct_current=True)),
-        )
-        active_teams = teams.filter(guesses__gt=0)
-        correct_teams = active_teams.filter(correct_guesses__gt=0)
-        finished_teams = set.intersection(*[{
-            team for team, _ in episode.finished_times()
-        } for episode in finishing_episodes]) if len(finishing_episodes) > 0 else {}
-        active_players = User.objects.filter(teams__in=active_teams)
-        puzzles_solved = TeamPuzzleProgress.objects.filter(
-            team_puzzle_progress_filter,
-            team__role=TeamRole.PLAYER,
-            solved_by__isnull=False,
-            late=False,
-        )
-        guesses = Guess.objects.filter(guesses_filter & Q(by_team__role=TeamRole.PLAYER))
+        counted_solves = {
+            team_id: times.keys() - state['no_stats_puzzles']
+            for team_id, times in state['solved'].items()
+        }
+        active_players = User.objects.filter(teams__id__in=state['active_teams'])
         return {
             'active_players': active_players.count(),
-            'active_teams': active_teams.count(),
-            'correct_teams': correct_teams.count(),
-            'finished_teams': len(finished_teams),
-            'puzzles_solved': puzzles_solved.count(),
-            'guess_count': guesses.count()
+            'active_teams': len(state['active_teams']),
+            'correct_teams': len([puzzles for puzzles in counted_solves.values() if puzzles]),
+            'finished_teams': len(finish_times(state['solved'], finishing_episodes)),
+            'puzzles_solved': sum(len(puzzles) for puzzles in counted_solves.values()),
+            'guess_count': state['guess_count'],
         }
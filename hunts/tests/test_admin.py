@@ -11,13 +11,16 @@
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+from unittest import mock
 
 import freezegun
 import pytest
 from django.apps import apps
 from django.contrib import admin
+from django.db import connection
 from django.forms import inlineformset_factory
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
@@ -43,6 +46,7 @@ from ..models import EpisodePrequel, Hint, PuzzleFile, SolutionFile, TeamPuzzleD
     UserPuzzleData, TeamPuzzleProgress, \
     TeamUnlock, Guess, Puzzle, Answer, HintAcceptance
 from ..runtimes import Runtime
+from ..views.admin import GuessesList
 
 
 @pytest.mark.usefixtures('event')
@@ -263,6 +267,61 @@ class AdminContentTests(EventTestCase):
         response = self.client.get(f'{self.guesses_url}?episode={episode_id}')
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    @mock.patch.object(GuessesList, 'page_size', 2)
+    def test_guesses_cursor(self):
+        self.client.force_login(self.admin_user)
+        expected = sorted(self.guesses, key=lambda g: (g.given, g.id), reverse=True)
+
+        response = self.client.get(self.guesses_url)
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual(content['rows'], 5)
+        listed = [g['guess'] for g in content['guesses']]
+        while content['next']:
+            response = self.client.get(f'{self.guesses_url}?cursor={content["next"]}')
+            self.assertEqual(response.status_code, 200)
+            content = response.json()
+            listed += [g['guess'] for g in content['guesses']]
+        self.assertEqual(listed, [g.guess for g in expected])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    @mock.patch.object(GuessesList, 'page_size', 2)
+    def test_guesses_since(self):
+        self.client.force_login(self.admin_user)
+        latest = self.client.get(self.guesses_url).json()['latest']
+
+        response = self.client.get(f'{self.guesses_url}?since={latest}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['guesses'], [])
+        self.assertEqual(response.json()['latest'], latest)
+
+        new_guesses = GuessFactory.create_batch(3, for_puzzle=self.puzzle, given=timezone.now() + datetime.timedelta(minutes=1))
+        new_guesses.sort(key=lambda g: g.id)
+        response = self.client.get(f'{self.guesses_url}?since={latest}')
+        content = response.json()
+        # The oldest of the new guesses are returned first, so that none are skipped
+        self.assertEqual([g['guess'] for g in content['guesses']], [g.guess for g in reversed(new_guesses[:2])])
+        response = self.client.get(f'{self.guesses_url}?since={content["latest"]}')
+        self.assertEqual([g['guess'] for g in response.json()['guesses']], [new_guesses[2].guess])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_guesses_since_not_counted(self):
+        self.client.force_login(self.admin_user)
+        latest = self.client.get(self.guesses_url).json()['latest']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'{self.guesses_url}?since={latest}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['rows'])
+        self.assertFalse(any(
+            query['sql'].startswith('EXPLAIN') or query['sql'].startswith('SELECT COUNT(') for query in queries
+        ), 'Polling for new guesses should not count them')
+
+    def test_guesses_invalid_cursor(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.get(f'{self.guesses_url}?cursor=invalid')
+        self.assertEqual(response.status_code, 400)
+
     def test_can_view_stats(self):
         stats_url = reverse('admin_stats')
         self.client.force_login(self.admin_user)
@@ -871,6 +930,44 @@ class StatsTests(EventTestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class LeaderboardTests(EventTestCase):
+    def setUp(self):
+        self.admin_user = TeamMemberFactory(team__at_event=self.tenant, team__role=TeamRole.ADMIN)
+        self.episode = EpisodeFactory(event=self.tenant, winning=True)
+        self.puzzle = PuzzleFactory(episode=self.episode)
+
+    def test_leaderboard(self):
+        players = [TeamMemberFactory(team__at_event=self.tenant) for _ in range(3)]
+        for player in players:
+            GuessFactory(for_puzzle=self.puzzle, by=player, correct=True)
+        self.client.force_login(self.admin_user)
+
+        response = self.client.get(reverse('admin_leaderboard') + '?count=2')
+        self.assertEqual(response.status_code, 200)
+        teams = response.json()['teams']
+        self.assertEqual([team['position'] for team in teams], [1, 2])
+        self.assertEqual([team['name'] for team in teams], [player.team_at(self.tenant).name for player in players[:2]])
+
+        response = self.client.get(reverse('admin_leaderboard', kwargs={'episode_id': self.episode.id}))
+        self.assertEqual(len(response.json()['teams']), 3)
+
+    def test_invalid_count(self):
+        self.client.force_login(self.admin_user)
+        for count in ('0', '-1'):
+            response = self.client.get(reverse('admin_leaderboard') + f'?count={count}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_episode(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.get(reverse('admin_leaderboard', kwargs={'episode_id': self.episode.id + 1}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_admin(self):
+        self.client.force_login(UserFactory())
+        response = self.client.get(reverse('admin_leaderboard'))
+        self.assertEqual(response.status_code, 403)
+
+
 class AnswerFormValidationTests(EventTestCase):
     def setUp(self):
         self.episode = EpisodeFactory()
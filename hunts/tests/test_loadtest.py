@@ -0,0 +1,113 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import random
+
+from django.test import SimpleTestCase
+from django.urls import reverse
+from django_tenants.utils import tenant_context
+
+from accounts.models import User
+from events.models import Event
+from events.test import EventAwareTestCase
+from ..loadtest import Recorder, Websocket, build_scenario, destroy_scenario
+from ..models import Answer, Hint, Puzzle
+
+
+class RecorderTests(SimpleTestCase):
+    def test_summary(self):
+        recorder = Recorder()
+        latencies = list(range(1, 102))
+        random.shuffle(latencies)
+        for latency in latencies:
+            recorder.record('answer', latency, latency != 101)
+        recorder.record('event', 0.5, True)
+
+        answer, event = recorder.summary(elapsed=10)
+        self.assertEqual(answer.endpoint, 'answer')
+        self.assertEqual(answer.count, 101)
+        self.assertEqual(answer.errors, 1)
+        self.assertEqual(answer.throughput, 10.1)
+        self.assertEqual((answer.p50, answer.p95, answer.p99), (51, 96, 100))
+        self.assertEqual(event.endpoint, 'event')
+        self.assertEqual((event.count, event.errors, event.p50, event.p99), (1, 0, 0.5, 0.5))
+
+    def test_summary_interpolated(self):
+        recorder = Recorder()
+        for latency in (1, 2):
+            recorder.record('puzzle', latency, True)
+        summary, = recorder.summary(elapsed=4)
+        self.assertEqual(summary.throughput, 0.5)
+        self.assertEqual(summary.p50, 1.5)
+        self.assertAlmostEqual(summary.p95, 1.95)
+
+
+class WebsocketReadTests(SimpleTestCase):
+    def read(self, data):
+        """Read the frames in `data` as if the server had sent them, returning how many messages were counted"""
+        messages = []
+        websocket = Websocket.__new__(Websocket)
+        websocket._file = io.BytesIO(data)
+        websocket._on_message = lambda: messages.append(None)
+        websocket._read()
+        return len(messages)
+
+    def test_lengths(self):
+        self.assertEqual(self.read(bytes([0x81, 5]) + b'hello'), 1)
+        self.assertEqual(self.read(bytes([0x82, 126]) + (300).to_bytes(2, 'big') + b'x' * 300), 1)
+        self.assertEqual(self.read(bytes([0x81, 127]) + (70000).to_bytes(8, 'big') + b'y' * 70000), 1)
+
+    def test_frames_in_sequence(self):
+        frames = b''.join((
+            bytes([0x81, 5]) + b'hello',
+            # Control frames aren't messages
+            bytes([0x89, 0]),
+            bytes([0x82, 126]) + (126).to_bytes(2, 'big') + b'x' * 126,
+            # Masked, which servers shouldn't do but the length is still right
+            bytes([0x81, 0x83]) + b'mask' + b'abc',
+            bytes([0x81, 127]) + (65536).to_bytes(8, 'big') + b'y' * 65536,
+        ))
+        self.assertEqual(self.read(frames), 4)
+
+    def test_close(self):
+        frames = bytes([0x81, 2]) + b'hi' + bytes([0x88, 2]) + (1000).to_bytes(2, 'big') + bytes([0x81, 2]) + b'hi'
+        self.assertEqual(self.read(frames), 1)
+
+    def test_truncated(self):
+        self.assertEqual(self.read(bytes([0x81, 5]) + b'hello' + bytes([0x81])), 1)
+
+
+class ScenarioTests(EventAwareTestCase):
+    def test_build_and_destroy(self):
+        scenario = build_scenario(teams=3, episodes=2, puzzles=2, hints=2)
+        self.assertEqual(len(scenario.users), 3)
+        self.assertEqual(len(scenario.targets), 4)
+        self.assertEqual(scenario.host, scenario.event.get_primary_domain().domain)
+
+        with tenant_context(scenario.event):
+            self.assertEqual(scenario.event_url, reverse('event'))
+            self.assertEqual(Puzzle.objects.count(), 4)
+            self.assertEqual(Hint.objects.count(), 8)
+            for user in scenario.users:
+                self.assertIsNotNone(user.team_at(scenario.event))
+
+            target = scenario.targets[3]
+            self.assertEqual(target.puzzle_url, reverse('puzzle', kwargs={'episode_number': 2, 'puzzle_number': 2}))
+            self.assertEqual(target.websocket_path, '/ws/hunt/ep/2/pz/2/')
+            self.assertEqual(len(target.hint_ids), 2)
+            puzzle = Answer.objects.get(answer=target.answer).for_puzzle
+            self.assertEqual((puzzle.episode.get_relative_id(), puzzle.get_relative_id()), (2, 2))
+
+        destroy_scenario(scenario)
+        self.assertFalse(Event.objects.filter(id=scenario.event.id).exists())
+        self.assertFalse(User.objects.filter(id__in=[user.id for user in scenario.users]).exists())
@@ -12,6 +12,7 @@
 
 import datetime
 import random
+from unittest import mock
 
 import factory
 import freezegun
@@ -34,7 +35,7 @@ from ..factories import (
     UnlockAnswerFactory,
     UnlockFactory,
 )
-from ..models import TeamPuzzleProgress
+from ..models import Episode, Hint, Puzzle, TeamPuzzleProgress
 from ..runtimes import Runtime
 
 
@@ -355,6 +356,20 @@ class EpisodeBehaviourTests(EventTestCase):
                 self.assertEqual(puzzle.get_relative_id(), i + 1, msg='Relative ID should match index in episode')
                 self.assertEqual(episode.get_puzzle(puzzle.get_relative_id()), puzzle, msg='A Puzzle\'s relative ID should retrieve it from its Episode')
 
+    def test_numbers_missing_from_structure(self):
+        episode = EpisodeFactory(event=self.tenant)
+        puzzles = PuzzleFactory.create_batch(2, episode=episode)
+        with mock.patch('hunts.models.event_structure') as structure:
+            structure.return_value.episode_number.return_value = None
+            structure.return_value.puzzle_number.return_value = None
+            # Numbered from the database instead
+            self.assertEqual(Episode.objects.get(id=episode.id).get_relative_id(), 1)
+            self.assertEqual(Puzzle.objects.get(id=puzzles[1].id).get_relative_id(), 2)
+            # Unless they aren't there either
+            self.assertEqual(Episode(event=self.tenant).get_relative_id(), -1)
+            with self.assertRaises(RuntimeError):
+                Puzzle(episode=episode).get_relative_id()
+
     def test_upcoming_puzzle_parallel_episode(self):
         with freezegun.freeze_time() as frozen_datetime:
             ep_start = timezone.now() - datetime.timedelta(minutes=60)
@@ -754,6 +769,49 @@ class TestTeamPuzzleProgress:
             assert hints[None][1].obsolete
 
 
+class TrackedFieldsTests(EventTestCase):
+    def test_new_instance(self):
+        hint = HintFactory.build()
+        with self.assertNumQueries(0):
+            self.assertIsNone(hint.saved_instance())
+
+    def test_saved_instance(self):
+        hint = HintFactory(text='before')
+        hint.text = 'after'
+        with self.assertNumQueries(0):
+            self.assertEqual(hint.saved_instance().text, 'before')
+        hint.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(hint.saved_instance().text, 'after')
+
+    def test_loaded_instance(self):
+        hint = Hint.objects.get(pk=HintFactory(text='before').pk)
+        hint.text = 'after'
+        with self.assertNumQueries(0):
+            old = hint.saved_instance()
+        self.assertEqual(old.text, 'before')
+        self.assertEqual(old.puzzle_id, hint.puzzle_id)
+        self.assertFalse(old._state.adding)
+
+    def test_update_fields(self):
+        hint = HintFactory(text='before', time=datetime.timedelta(minutes=5))
+        hint.text = 'after'
+        hint.time = datetime.timedelta(minutes=10)
+        hint.save(update_fields=['text'])
+        old = hint.saved_instance()
+        self.assertEqual(old.text, 'after')
+        self.assertEqual(old.time, datetime.timedelta(minutes=5))
+
+    def test_deferred_fields(self):
+        hint = Hint.objects.defer('text').get(pk=HintFactory(text='before').pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(hint.saved_instance().text, 'before')
+        # Loading the deferred field means it is tracked too
+        self.assertEqual(hint.text, 'before')
+        with self.assertNumQueries(0):
+            self.assertEqual(hint.saved_instance().text, 'before')
+
+
 class UnlockAnswerTests(EventTestCase):
     def test_unlock_immutable(self):
         unlockanswer = UnlockAnswerFactory()
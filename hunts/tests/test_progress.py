@@ -12,26 +12,40 @@
 
 
 import datetime
+import json
+from unittest import mock
 
 import freezegun
+import redis
+from django.db import connection
+from django.http import Http404
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from accounts.factories import UserFactory
 from events.test import EventTestCase
 from teams.factories import TeamFactory, TeamMemberFactory
-from .. import utils
+from teams.models import TeamRole
+from .. import guess_queue, leaderboard, utils
+from ..answer_index import AnswerIndex, answer_index
+from ..availability import TeamAvailability, team_availability
+from ..guess_queue import process_guess, requeue, submit_guess
 from ..factories import (
     AnswerFactory,
     EpisodeFactory,
     GuessFactory,
+    HeadstartFactory,
+    HintFactory,
     PuzzleFactory,
     UnlockAnswerFactory,
+    UnlockFactory,
     TeamPuzzleProgressFactory,
 )
-from ..models import TeamPuzzleProgress, \
+from ..models import Episode, TeamPuzzleProgress, \
     TeamUnlock, Answer, \
-    Guess
+    Guess, UnlockAnswer
 from ..runtimes import Runtime
 
 
@@ -110,27 +124,33 @@ class EventWinningTests(EventTestCase):
         PuzzleFactory.create_batch(2, episode=self.ep1)
         PuzzleFactory.create_batch(2, episode=self.ep2)
 
+    def guess(self, **kwargs):
+        # The leaderboards are updated once the guess is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return GuessFactory.create(**kwargs)
+
     def test_win_single_linear_episode(self):
         # No correct answers => noone has finished => no finishing positions!
         self.assertEqual(utils.finishing_positions(self.tenant), [])
 
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(1), by=self.user1, correct=True)
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(1), by=self.user2, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(1), by=self.user1, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(1), by=self.user2, correct=True)
         # First episode still not complete
         self.assertEqual(utils.finishing_positions(self.tenant), [])
 
-        g = GuessFactory.create(for_puzzle=self.ep1.get_puzzle(2), by=self.user1, correct=True)
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(2), by=self.user2, correct=False)
+        g = self.guess(for_puzzle=self.ep1.get_puzzle(2), by=self.user1, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(2), by=self.user2, correct=False)
         # Team 1 has finished the only winning episode, but Team 2 has not
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team1])
 
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(2), by=self.user2, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(2), by=self.user2, correct=True)
         # Team 2 should now be second place
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team1, self.team2])
 
         # Make sure the order changes correctly
         g.given = timezone.now()
-        g.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            g.save()
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team2, self.team1])
 
     def test_win_two_linear_episodes(self):
@@ -141,30 +161,32 @@ class EventWinningTests(EventTestCase):
 
         for pz in self.ep1.puzzle_set.all():
             for user in (self.user1, self.user2):
-                GuessFactory.create(for_puzzle=pz, by=user, correct=True)
+                self.guess(for_puzzle=pz, by=user, correct=True)
         # We need to complete both episodes
         self.assertEqual(utils.finishing_positions(self.tenant), [])
 
         # both teams complete episode 2, but now their episode 1 guesses are wrong
         for pz in self.ep1.puzzle_set.all():
             for g in pz.guess_set.all():
-                g.delete()
+                with self.captureOnCommitCallbacks(execute=True):
+                    g.delete()
         for pz in self.ep1.puzzle_set.all():
             for user in (self.user1, self.user2):
-                GuessFactory.create(for_puzzle=pz, by=user, correct=False)
+                self.guess(for_puzzle=pz, by=user, correct=False)
 
         for pz in self.ep2.puzzle_set.all():
             for user in (self.user1, self.user2):
-                GuessFactory.create(for_puzzle=pz, by=user, correct=True)
+                self.guess(for_puzzle=pz, by=user, correct=True)
         # Should still have no-one finished
         self.assertEqual(utils.finishing_positions(self.tenant), [])
 
         # Make correct Episode 1 guesses again
         for pz in self.ep1.puzzle_set.all() | self.ep2.puzzle_set.all():
             for g in pz.guess_set.all():
-                g.delete()
+                with self.captureOnCommitCallbacks(execute=True):
+                    g.delete()
             for user in (self.user1, self.user2):
-                GuessFactory.create(for_puzzle=pz, by=user, correct=True)
+                self.guess(for_puzzle=pz, by=user, correct=True)
         # Now both teams should have finished, with team1 first
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team1, self.team2])
 
@@ -172,24 +194,102 @@ class EventWinningTests(EventTestCase):
         for pz in self.ep1.puzzle_set.all():
             for g in pz.guess_set.filter(by=self.user1):
                 g.given = timezone.now()
-                g.save()
+                with self.captureOnCommitCallbacks(execute=True):
+                    g.save()
         # team2 should be first
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team2, self.team1])
 
     def test_win_with_late_team(self):
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(1), by=self.user1, correct=True)
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(2), by=self.user1, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(1), by=self.user1, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(2), by=self.user1, correct=True)
 
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team1])
         self.assertEqual(utils.finishing_positions(self.tenant, include_late=True), [self.team1])
 
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(1), by=self.user2, correct=True)
-        GuessFactory.create(for_puzzle=self.ep1.get_puzzle(2), by=self.user2, correct=True, late=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(1), by=self.user2, correct=True)
+        self.guess(for_puzzle=self.ep1.get_puzzle(2), by=self.user2, correct=True, late=True)
 
         self.assertEqual(utils.finishing_positions(self.tenant), [self.team1])
         self.assertEqual(utils.finishing_positions(self.tenant, include_late=True), [self.team1, self.team2])
 
 
+class LeaderboardTests(EventTestCase):
+    def setUp(self):
+        self.episode = EpisodeFactory(winning=True)
+        self.puzzles = PuzzleFactory.create_batch(2, episode=self.episode)
+        self.user1 = UserFactory()
+        self.user2 = UserFactory()
+        self.team1 = TeamFactory(members=self.user1)
+        self.team2 = TeamFactory(members=self.user2)
+
+    def finish(self, user, late=False):
+        now = timezone.now()
+        # The leaderboards are updated once the guesses are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, puzzle in enumerate(self.puzzles):
+                GuessFactory(for_puzzle=puzzle, by=user, correct=True, given=now + datetime.timedelta(seconds=i), late=late)
+
+    def test_positions(self):
+        self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+        self.finish(self.user2)
+        self.finish(self.user1)
+        self.assertEqual(leaderboard.position(self.team2.id, self.episode.id), 0)
+        self.assertEqual(leaderboard.position(self.team1.id, self.episode.id), 1)
+        self.assertEqual(leaderboard.position(self.team1.id), 1)
+        self.assertEqual([team_id for team_id, _ in leaderboard.top(1)], [self.team2.id])
+
+    def test_late(self):
+        self.finish(self.user1, late=True)
+        self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+        self.assertEqual(leaderboard.position(self.team1.id, self.episode.id, include_late=True), 0)
+
+    def test_rebuild(self):
+        self.finish(self.user2)
+        self.finish(self.user1)
+        updated = leaderboard.finished_team_ids(self.episode.id)
+        leaderboard.rebuild()
+        self.assertEqual(leaderboard.finished_team_ids(self.episode.id), updated)
+        self.assertEqual(updated, [self.team2.id, self.team1.id])
+
+    def test_structure_changed(self):
+        self.finish(self.user1)
+        self.assertEqual(self.episode.finished_positions(), [self.team1])
+        # Nobody has finished the episode now that there's another puzzle on it
+        PuzzleFactory(episode=self.episode)
+        self.assertEqual(self.episode.finished_positions(), [])
+
+    def test_role_changed(self):
+        self.finish(self.user1)
+        self.team1.role = TeamRole.ADMIN
+        with self.captureOnCommitCallbacks(execute=True):
+            self.team1.save()
+        self.assertEqual(utils.finishing_positions(self.tenant), [])
+
+    def test_solve_undone(self):
+        self.finish(self.user1)
+        self.assertEqual(leaderboard.position(self.team1.id, self.episode.id), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Guess.objects.filter(for_puzzle=self.puzzles[1]).delete()
+        self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+
+    def test_not_updated_until_committed(self):
+        self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+        with self.captureOnCommitCallbacks() as callbacks:
+            for puzzle in self.puzzles:
+                GuessFactory(for_puzzle=puzzle, by=self.user1, correct=True)
+            self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(leaderboard.position(self.team1.id, self.episode.id), 0)
+
+    def test_redis_unavailable(self):
+        self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+        # The committed guesses stand; the leaderboard catches up when it is next rebuilt
+        with mock.patch.object(leaderboard, '_update_team', side_effect=redis.ConnectionError):
+            self.finish(self.user1)
+        self.assertIsNone(leaderboard.position(self.team1.id, self.episode.id))
+
+
 class ProgressSignalTests(EventTestCase):
     def setUp(self):
         self.answer = AnswerFactory(runtime=Runtime.REGEX, answer=r'correct\d')
@@ -401,6 +501,355 @@ class ProgressSignalTests(EventTestCase):
         self.assertEqual(first_time, second_time, msg='Start time does not alter on subsequent access')
 
 
+class AnswerIndexTests(EventTestCase):
+    def test_static_options(self):
+        index = AnswerIndex([
+            Answer(id=1, runtime=Runtime.STATIC, options={'case_handling': 'none'}, answer='Exact'),
+            Answer(id=2, runtime=Runtime.STATIC, options={'case_handling': 'fold', 'strip': False}, answer='gueß'),
+        ], [
+            UnlockAnswer(id=3, runtime=Runtime.STATIC, options={}, guess=' Unlock '),
+            UnlockAnswer(id=4, runtime=Runtime.STATIC, options={'case_handling': 'none'}, guess='Unlock'),
+        ])
+        self.assertEqual(index.correct_answer(Guess(guess='Exact')).id, 1)
+        self.assertIsNone(index.correct_answer(Guess(guess='exact')))
+        self.assertEqual(index.correct_answer(Guess(guess='GUESS')).id, 2)
+        self.assertIsNone(index.correct_answer(Guess(guess='GUESS ')))
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='Unlock')), {3, 4})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='unlock ')), {3})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='nothing')), set())
+
+    def test_first_answer_preferred(self):
+        index = AnswerIndex([
+            Answer(id=3, runtime=Runtime.STATIC, options={}, answer='answer'),
+            Answer(id=2, runtime=Runtime.REGEX, options={}, answer='answer|other'),
+            Answer(id=1, runtime=Runtime.STATIC, options={}, answer='other'),
+        ], [])
+        self.assertEqual(index.correct_answer(Guess(guess='answer')).id, 2)
+        self.assertEqual(index.correct_answer(Guess(guess='other')).id, 1)
+
+    def test_mixed_runtimes(self):
+        index = AnswerIndex([], [
+            UnlockAnswer(id=1, runtime=Runtime.STATIC, options={}, guess='unlock1'),
+            UnlockAnswer(id=2, runtime=Runtime.REGEX, options={}, guess=r'unlock\d'),
+        ])
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='unlock1')), {1, 2})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='unlock2')), {2})
+
+    def test_regex_combined(self):
+        index = AnswerIndex([
+            Answer(id=1, runtime=Runtime.REGEX, options={'case_sensitive': True}, answer='Answer'),
+            Answer(id=2, runtime=Runtime.REGEX, options={}, answer='answer|other'),
+        ], [
+            UnlockAnswer(id=3, runtime=Runtime.REGEX, options={}, guess='a.*'),
+            UnlockAnswer(id=4, runtime=Runtime.REGEX, options={}, guess='an'),
+            UnlockAnswer(id=5, runtime=Runtime.REGEX, options={'case_sensitive': True}, guess='[A-Z]+'),
+        ])
+        self.assertEqual(index.correct_answer(Guess(guess='Answer')).id, 1)
+        self.assertEqual(index.correct_answer(Guess(guess='ANSWER')).id, 2)
+        self.assertIsNone(index.correct_answer(Guess(guess='answers')))
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='an')), {3, 4})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='AN')), {3, 4, 5})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='ban')), set())
+
+    def test_regex_unmergeable(self):
+        index = AnswerIndex([], [
+            UnlockAnswer(id=1, runtime=Runtime.REGEX, options={}, guess=r'(.)\1'),
+            UnlockAnswer(id=2, runtime=Runtime.REGEX, options={}, guess=r'(?P<x>.)(?P=x)x'),
+            UnlockAnswer(id=3, runtime=Runtime.REGEX, options={'case_sensitive': True}, guess=r'(?i)aax'),
+            UnlockAnswer(id=4, runtime=Runtime.REGEX, options={}, guess=r'.*'),
+        ])
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='aa')), {1, 4})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='AAX')), {2, 3, 4})
+        self.assertEqual(index.unlockanswer_ids(Guess(guess='ab')), {4})
+
+    def test_regex_invalid(self):
+        index = AnswerIndex([], [
+            UnlockAnswer(id=1, runtime=Runtime.REGEX, options={}, guess='a)|(b'),
+            UnlockAnswer(id=2, runtime=Runtime.REGEX, options={}, guess='b'),
+        ])
+        with self.assertRaises(SyntaxError):
+            index.unlockanswer_ids(Guess(guess='b'))
+
+    def test_index_invalidated(self):
+        answer = AnswerFactory(runtime=Runtime.STATIC, answer='before')
+        puzzle = answer.for_puzzle
+        self.assertEqual(answer_index(puzzle.id).correct_answer(Guess(guess='before')), answer)
+        answer.answer = 'after'
+        answer.save()
+        self.assertIsNone(answer_index(puzzle.id).correct_answer(Guess(guess='before')))
+        self.assertEqual(answer_index(puzzle.id).correct_answer(Guess(guess='after')), answer)
+        unlockanswer = UnlockAnswerFactory(unlock__puzzle=puzzle, guess='unlock')
+        self.assertEqual(answer_index(puzzle.id).unlockanswer_ids(Guess(guess='unlock')), {unlockanswer.id})
+        unlockanswer.delete()
+        self.assertEqual(answer_index(puzzle.id).unlockanswer_ids(Guess(guess='unlock')), set())
+
+    def test_index_invalidated_when_moved(self):
+        answer = AnswerFactory(runtime=Runtime.STATIC, answer='moved')
+        unlockanswer = UnlockAnswerFactory(unlock__puzzle=answer.for_puzzle, guess='unlock')
+        old_puzzle = answer.for_puzzle
+        new_puzzle = PuzzleFactory(episode=old_puzzle.episode)
+        self.assertEqual(answer_index(old_puzzle.id).correct_answer(Guess(guess='moved')), answer)
+        self.assertEqual(answer_index(old_puzzle.id).unlockanswer_ids(Guess(guess='unlock')), {unlockanswer.id})
+        self.assertIsNone(answer_index(new_puzzle.id).correct_answer(Guess(guess='moved')))
+        answer.for_puzzle = new_puzzle
+        answer.save()
+        self.assertIsNone(answer_index(old_puzzle.id).correct_answer(Guess(guess='moved')))
+        self.assertEqual(answer_index(new_puzzle.id).correct_answer(Guess(guess='moved')), answer)
+        unlock = unlockanswer.unlock
+        unlock.puzzle = new_puzzle
+        unlock.save()
+        self.assertEqual(answer_index(old_puzzle.id).unlockanswer_ids(Guess(guess='unlock')), set())
+        self.assertEqual(answer_index(new_puzzle.id).unlockanswer_ids(Guess(guess='unlock')), {unlockanswer.id})
+
+    def test_index_invalidated_when_parent_deleted(self):
+        puzzle = PuzzleFactory()
+        unlock = UnlockFactory(puzzle=puzzle, answer=None)
+        UnlockAnswerFactory.create_batch(3, unlock=unlock, runtime=Runtime.STATIC, guess='unlock')
+        AnswerFactory.create_batch(3, for_puzzle=puzzle, runtime=Runtime.STATIC, answer='answer')
+        self.assertEqual(len(answer_index(puzzle.id).unlockanswer_ids(Guess(guess='unlock'))), 3)
+        with CaptureQueriesContext(connection) as queries:
+            unlock.delete()
+        self.assertEqual(answer_index(puzzle.id).unlockanswer_ids(Guess(guess='unlock')), set())
+        # The answers deleted with the unlock don't each look up its puzzle
+        self.assertFalse(any('"hunts_unlock"."puzzle_id"' in query['sql'] for query in queries))
+
+        self.assertIsNotNone(answer_index(puzzle.id).correct_answer(Guess(guess='answer')))
+        puzzle_id = puzzle.id
+        puzzle.delete()
+        self.assertIsNone(answer_index(puzzle_id).correct_answer(Guess(guess='answer')))
+
+    def test_static_guess_updates_progress(self):
+        answer = AnswerFactory(runtime=Runtime.STATIC, answer='Correct', options={'case_handling': 'none'})
+        puzzle = answer.for_puzzle
+        unlockanswer = UnlockAnswerFactory(unlock__puzzle=puzzle, runtime=Runtime.STATIC, guess='unlock')
+        user = TeamMemberFactory()
+        GuessFactory(for_puzzle=puzzle, by=user, guess='UNLOCK ')
+        guess = GuessFactory(for_puzzle=puzzle, by=user, guess='correct')
+        self.assertIsNone(guess.correct_for)
+        guess = GuessFactory(for_puzzle=puzzle, by=user, guess='Correct')
+        self.assertEqual(guess.correct_for, answer)
+        progress = TeamPuzzleProgress.objects.get(puzzle=puzzle, team=user.team_at(self.tenant))
+        self.assertEqual(progress.solved_by, guess)
+        self.assertTrue(TeamUnlock.objects.filter(team_puzzle_progress=progress, unlockanswer=unlockanswer).exists())
+
+
+class GuessQueueTests(EventTestCase):
+    def setUp(self):
+        self.answer = AnswerFactory(runtime=Runtime.STATIC, answer='correct')
+        self.puzzle = self.answer.for_puzzle
+        self.unlockanswer = UnlockAnswerFactory(unlock__puzzle=self.puzzle, runtime=Runtime.STATIC, guess='unlock')
+        self.user = TeamMemberFactory()
+        self.team = self.user.team_at(self.tenant)
+
+    def submit(self, text):
+        guess = Guess(for_puzzle=self.puzzle, by=self.user, guess=text, late=False)
+        # The guess is pushed to the queue on commit, which never happens here
+        with override_settings(ASYNC_GUESSES=True), self.captureOnCommitCallbacks():
+            submit_guess(guess)
+        self.assertTrue(guess.queued)
+        return guess
+
+    def test_queued_guess_not_evaluated(self):
+        guess = self.submit('correct')
+        guess.refresh_from_db()
+        self.assertFalse(guess.correct_current)
+        self.assertIsNone(guess.correct_for)
+        self.assertFalse(TeamPuzzleProgress.objects.filter(puzzle=self.puzzle, solved_by__isnull=False).exists())
+        self.assertFalse(TeamUnlock.objects.exists())
+
+    def test_queued_guesses_processed(self):
+        unlocking_guess = self.submit('unlock')
+        correct_guess = self.submit('correct')
+        process_guess(unlocking_guess.id)
+        process_guess(correct_guess.id)
+
+        correct_guess.refresh_from_db()
+        self.assertTrue(correct_guess.correct_current)
+        self.assertEqual(correct_guess.correct_for, self.answer)
+        progress = TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=self.team)
+        self.assertEqual(progress.solved_by, correct_guess)
+        self.assertTrue(TeamUnlock.objects.filter(
+            team_puzzle_progress=progress, unlockanswer=self.unlockanswer, unlocked_by=unlocking_guess
+        ).exists())
+        self.assertEqual(progress.guess_count, 2)
+        self.assertFalse(Guess.objects.filter(queued=True).exists())
+
+    def test_queued_guesses_processed_in_order(self):
+        first_guess = self.submit('correct')
+        second_guess = self.submit('correct')
+        # The second guess's worker got there first
+        process_guess(second_guess.id)
+        progress = TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=self.team)
+        self.assertEqual(progress.solved_by, first_guess)
+        first_guess.refresh_from_db()
+        self.assertFalse(first_guess.queued)
+        self.assertEqual(first_guess.correct_for, self.answer)
+
+    def test_processed_guess_skipped(self):
+        guess = self.submit('unlock')
+        process_guess(guess.id)
+        process_guess(guess.id)
+        self.assertEqual(TeamUnlock.objects.filter(unlocked_by=guess).count(), 1)
+        self.assertEqual(TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=self.team).guess_count, 1)
+
+    def test_evaluated_if_queue_unavailable(self):
+        guess = Guess(for_puzzle=self.puzzle, by=self.user, guess='correct', late=False)
+        with mock.patch.object(guess_queue, 'client') as client:
+            client.return_value.rpush.side_effect = redis.ConnectionError
+            with override_settings(ASYNC_GUESSES=True), self.captureOnCommitCallbacks(execute=True):
+                submit_guess(guess)
+        guess.refresh_from_db()
+        self.assertFalse(guess.queued)
+        self.assertEqual(TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=self.team).solved_by, guess)
+
+    def test_requeue(self):
+        process_guess(self.submit('unlock').id)
+        guess = self.submit('correct')
+        client = guess_queue.client()
+        client.delete(guess_queue.QUEUE_KEY)
+        client.rpush(guess_queue.FAILED_KEY, 'failed')
+        self.addCleanup(client.delete, guess_queue.QUEUE_KEY, guess_queue.FAILED_KEY)
+        self.assertEqual(requeue(), 1)
+        self.assertEqual(client.lrange(guess_queue.QUEUE_KEY, 0, -1), [
+            json.dumps({'schema': self.tenant.schema_name, 'guess': str(guess.id)}).encode(),
+        ])
+        self.assertFalse(client.exists(guess_queue.FAILED_KEY))
+
+    def test_synchronous_by_default(self):
+        guess = Guess(for_puzzle=self.puzzle, by=self.user, guess='correct', late=False)
+        submit_guess(guess)
+        self.assertFalse(guess.queued)
+        self.assertEqual(guess.correct_for, self.answer)
+        self.assertEqual(TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=self.team).solved_by, guess)
+
+
+class TeamAvailabilityTests(EventTestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.user = TeamMemberFactory()
+        self.team = self.user.team_at(self.tenant)
+        self.linear = EpisodeFactory(parallel=False, start_date=now - datetime.timedelta(hours=1))
+        self.parallel = EpisodeFactory(parallel=True, start_date=now - datetime.timedelta(hours=2), prequels=[self.linear])
+        self.later = EpisodeFactory(parallel=False, start_date=now + datetime.timedelta(minutes=30))
+        self.later.headstart_from.add(self.linear)
+        self.linear_puzzles = [
+            PuzzleFactory(episode=self.linear, headstart_granted=datetime.timedelta(minutes=20)),
+            PuzzleFactory(episode=self.linear, headstart_granted=datetime.timedelta(minutes=20)),
+            PuzzleFactory(episode=self.linear, start_date=now - datetime.timedelta(minutes=30)),
+            PuzzleFactory(episode=self.linear, start_date=now + datetime.timedelta(minutes=30)),
+        ]
+        self.parallel_puzzles = [
+            PuzzleFactory(episode=self.parallel),
+            PuzzleFactory(episode=self.parallel, start_date=now + datetime.timedelta(hours=1)),
+        ]
+        self.later_puzzles = PuzzleFactory.create_batch(2, episode=self.later)
+
+    def assertMatchesModels(self):
+        availability = TeamAvailability.build(self.tenant, self.team)
+        now = timezone.now()
+        for episode in Episode.objects.all():
+            self.assertEqual(availability.headstart(episode.id), episode.headstart_applied(self.team))
+            self.assertEqual(availability.episode_started(episode.id, now), episode.started_for(self.team))
+            self.assertEqual(availability.episode_available(episode.id, now), episode.available(self.team))
+            for puzzle in episode.puzzle_set.all():
+                self.assertEqual(availability.puzzle_started(puzzle.id, now), puzzle.started_for(self.team))
+                self.assertEqual(availability.puzzle_available(puzzle.id, now), puzzle.available(self.team))
+
+    def solve(self, puzzle):
+        GuessFactory(for_puzzle=puzzle, by=self.user, correct=True)
+
+    def test_matches_models(self):
+        self.assertMatchesModels()
+        for puzzle in self.linear_puzzles + self.parallel_puzzles:
+            self.solve(puzzle)
+            self.assertMatchesModels()
+        HeadstartFactory(episode=self.later, team=self.team, headstart_adjustment=datetime.timedelta(minutes=5))
+        self.assertMatchesModels()
+
+    def test_numbering(self):
+        availability = TeamAvailability.build(self.tenant, self.team)
+        self.assertEqual(availability.episode_id(2), self.parallel.id)
+        self.assertEqual(availability.puzzle_id(1, 3), self.linear_puzzles[2].id)
+        self.assertEqual(availability.puzzle_id(1, 4), utils.event_episode_puzzle(self.tenant, 1, 4)[1].id)
+        with self.assertRaises(Http404):
+            availability.episode_id(4)
+        with self.assertRaises(Http404):
+            availability.puzzle_id(2, 3)
+
+    def test_invalidated(self):
+        self.assertTrue(team_availability(self.tenant, self.team).puzzle_available(self.linear_puzzles[0].id, timezone.now()))
+        self.assertFalse(team_availability(self.tenant, self.team).puzzle_available(self.linear_puzzles[1].id, timezone.now()))
+        self.solve(self.linear_puzzles[0])
+        self.assertTrue(team_availability(self.tenant, self.team).puzzle_available(self.linear_puzzles[1].id, timezone.now()))
+        self.assertEqual(team_availability(self.tenant, self.team).headstart(self.later.id), datetime.timedelta(minutes=20))
+        HeadstartFactory(episode=self.later, team=self.team, headstart_adjustment=datetime.timedelta(minutes=5))
+        self.assertEqual(team_availability(self.tenant, self.team).headstart(self.later.id), datetime.timedelta(minutes=25))
+        PuzzleFactory(episode=self.later)
+        self.assertEqual(len(team_availability(self.tenant, self.team).puzzles[self.later.id]), 3)
+
+    def test_structure_shared(self):
+        team_availability(self.tenant, self.team)
+        other_team = TeamMemberFactory().team_at(self.tenant)
+        # Only the other team's ledger has to be built
+        with self.assertNumQueries(2):
+            availability = team_availability(self.tenant, other_team)
+        self.assertIs(availability.structure, team_availability(self.tenant, self.team).structure)
+
+
+class ProgressSummaryTests(EventTestCase):
+    def setUp(self):
+        self.puzzle = PuzzleFactory()
+        self.user = TeamMemberFactory()
+        self.team = self.user.team_at(self.tenant)
+
+    def progress(self):
+        return TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=self.team)
+
+    def test_guesses_counted(self):
+        now = timezone.now()
+        GuessFactory(for_puzzle=self.puzzle, by=self.user, given=now - datetime.timedelta(minutes=2))
+        latest = GuessFactory(for_puzzle=self.puzzle, by=self.user, given=now - datetime.timedelta(minutes=1))
+        GuessFactory(for_puzzle=self.puzzle, by=self.user, given=now - datetime.timedelta(minutes=3))
+        GuessFactory(for_puzzle=PuzzleFactory(episode=self.puzzle.episode), by=self.user)
+        progress = self.progress()
+        self.assertEqual(progress.guess_count, 3)
+        self.assertEqual(progress.latest_guess_time, latest.given)
+
+        latest.delete()
+        progress = self.progress()
+        self.assertEqual(progress.guess_count, 2)
+        self.assertEqual(progress.latest_guess_time, now - datetime.timedelta(minutes=2))
+
+    def test_guesses_counted_when_progress_created(self):
+        guess = GuessFactory(for_puzzle=self.puzzle, by=self.user)
+        TeamPuzzleProgress.objects.all().delete()
+        TeamPuzzleProgressFactory(puzzle=self.puzzle, team=self.team)
+        progress = self.progress()
+        self.assertEqual(progress.guess_count, 1)
+        self.assertEqual(progress.latest_guess_time, guess.given)
+
+    def test_guesses_moved_with_member(self):
+        GuessFactory(for_puzzle=self.puzzle, by=self.user)
+        other_team = TeamFactory()
+        TeamPuzzleProgressFactory(puzzle=self.puzzle, team=other_team)
+        other_team.members.add(self.user)
+        self.assertEqual(self.progress().guess_count, 0)
+        self.assertEqual(TeamPuzzleProgress.objects.get(puzzle=self.puzzle, team=other_team).guess_count, 1)
+
+    def test_hints_scheduled(self):
+        progress = TeamPuzzleProgressFactory(puzzle=self.puzzle, team=self.team)
+        self.assertFalse(self.progress().hints_scheduled)
+        unlockanswer = UnlockAnswerFactory(unlock__puzzle=self.puzzle, runtime=Runtime.STATIC, guess='unlock')
+        hint = HintFactory(puzzle=self.puzzle, start_after=unlockanswer.unlock)
+        self.assertFalse(self.progress().hints_scheduled)
+        GuessFactory(for_puzzle=self.puzzle, by=self.user, guess='unlock')
+        self.assertTrue(self.progress().hints_scheduled)
+        progress.accepted_hints.add(hint)
+        self.assertFalse(self.progress().hints_scheduled)
+        HintFactory(puzzle=self.puzzle, start_after=None)
+        self.assertTrue(self.progress().hints_scheduled)
+
+
 class ProgressionMethodTests(EventTestCase):
     def setUp(self):
         self.episode = EpisodeFactory()
@@ -433,8 +882,10 @@ class ProgressionMethodTests(EventTestCase):
         self.assertEqual(len(self.episode.finished_positions()), 0)
 
         # Answer all the questions correctly for both teams with team 1 ahead to begin with then falling behind
-        GuessFactory.create(for_puzzle=puzzle1, by=self.user1, correct=True)
-        GuessFactory.create(for_puzzle=puzzle2, by=self.user1, correct=True)
+        # The leaderboards are updated once the guesses are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            GuessFactory.create(for_puzzle=puzzle1, by=self.user1, correct=True)
+            GuessFactory.create(for_puzzle=puzzle2, by=self.user1, correct=True)
 
         # Check only the first team has finished the first questions
         self.assertEqual(len(puzzle1.finished_teams()), 1)
@@ -443,16 +894,18 @@ class ProgressionMethodTests(EventTestCase):
         self.assertEqual(puzzle1.position(self.team2), None)
 
         # Team 2 completes all answers
-        GuessFactory.create(for_puzzle=puzzle1, by=self.user2, correct=True)
-        GuessFactory.create(for_puzzle=puzzle2, by=self.user2, correct=True)
-        GuessFactory.create(for_puzzle=puzzle3, by=self.user2, correct=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            GuessFactory.create(for_puzzle=puzzle1, by=self.user2, correct=True)
+            GuessFactory.create(for_puzzle=puzzle2, by=self.user2, correct=True)
+            GuessFactory.create(for_puzzle=puzzle3, by=self.user2, correct=True)
 
         # Ensure this team has finished the questions and is listed as first in the finished teams
         self.assertEqual(len(self.episode.finished_positions()), 1)
         self.assertEqual(self.episode.finished_positions()[0], self.team2)
 
         # Team 1 finishes as well.
-        GuessFactory(for_puzzle=puzzle3, by=self.user1, correct=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            GuessFactory(for_puzzle=puzzle3, by=self.user1, correct=True)
 
         # Ensure both teams have finished, and are ordered correctly
         self.assertEqual(len(self.episode.finished_positions()), 2)
@@ -42,7 +42,7 @@ from ..factories import (
     TeamPuzzleProgressFactory,
     HintFactory,
 )
-from ..models import Guess
+from ..models import Guess, Puzzle
 
 
 class ErrorTests(EventTestCase):
@@ -627,6 +627,29 @@ class FileTests(EventTestCase):
             'SolutionFile response should not include the real filename in Content-Disposition'
         )
 
+    def test_files_map_cached(self):
+        puzzle = PuzzleFactory()
+        puzzlefile = PuzzleFileFactory(puzzle=puzzle)
+
+        def files_map():
+            request = RequestFactory().get('/')
+            request.tenant = self.tenant
+            return puzzle.files_map(request)
+
+        self.assertEqual(files_map()[self.eventfile.slug], self.eventfile.file.url)
+        # A hit needs nothing from the database, not even the puzzle's episode
+        puzzle = Puzzle.objects.get(id=puzzle.id)
+        with self.assertNumQueries(0):
+            files = files_map()
+        self.assertIn(puzzlefile.slug, files)
+
+        # Changing the files is seen straight away
+        new_puzzlefile = PuzzleFileFactory(puzzle=puzzle)
+        self.eventfile.delete()
+        files = files_map()
+        self.assertIn(new_puzzlefile.slug, files)
+        self.assertNotIn(self.eventfile.slug, files)
+
 
 class PlayerStatsViewTests(EventTestCase):
     def setUp(self):
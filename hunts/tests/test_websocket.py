@@ -10,17 +10,24 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
 import time
 
 import freezegun
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase
 from django.utils import timezone
 
 from accounts.factories import UserFactory
 from events.test import AsyncEventTestCase, ScopeOverrideCommunicator
 from hunter2.routing import application as websocket_app
 from teams.factories import TeamFactory, TeamMemberFactory
+from teams.models import TeamRole
+from ..broadcast import batched_sends, group_send
+from ..consumers import AdminWebsocket
 from ..factories import (
     AnnouncementFactory,
     GuessFactory,
@@ -34,6 +41,43 @@ from ..models import PuzzleData
 from ..utils import encode_uuid
 
 
+class BatchedSendTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.channels = [async_to_sync(self.layer.new_channel)() for _ in range(2)]
+        for i, channel in enumerate(self.channels):
+            async_to_sync(self.layer.group_add)(f'test-batched-sends-{i}', channel)
+
+    def tearDown(self):
+        for i, channel in enumerate(self.channels):
+            async_to_sync(self.layer.group_discard)(f'test-batched-sends-{i}', channel)
+
+    def receive(self, channel):
+        async def receive():
+            return await asyncio.wait_for(self.layer.receive(channel), timeout=1)
+        return async_to_sync(receive)()
+
+    def test_batched_sends(self):
+        with batched_sends():
+            for n in range(3):
+                for i in range(len(self.channels)):
+                    group_send(f'test-batched-sends-{i}', {'type': 'test', 'n': n})
+            with self.assertRaises(asyncio.TimeoutError):
+                self.receive(self.channels[0])
+
+        # Messages to each group arrive in the order they were sent
+        for channel in self.channels:
+            self.assertEqual([self.receive(channel)['n'] for _ in range(3)], [0, 1, 2])
+
+    def test_failed_batch_not_sent(self):
+        with self.assertRaises(ValueError):
+            with batched_sends():
+                group_send('test-batched-sends-0', {'type': 'test'})
+                raise ValueError
+        with self.assertRaises(asyncio.TimeoutError):
+            self.receive(self.channels[0])
+
+
 class AnnouncementWebsocketTests(AsyncEventTestCase):
     def setUp(self):
         super().setUp()
@@ -826,3 +870,88 @@ class PuzzleWebsocketTests(AsyncEventTestCase):
         self.assertEqual(output['content']['announcement_id'], id)
 
         self.run_async(comm.disconnect)()
+
+
+class AdminWebsocketTests(AsyncEventTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pz = PuzzleFactory()
+        self.url = 'ws/hunt/admin/'
+        self.admin = TeamMemberFactory(team__role=TeamRole.ADMIN)
+
+    def test_non_admin_rejected(self):
+        user = TeamMemberFactory()
+        comm = self.get_communicator(websocket_app, self.url, {'user': user})
+        connected, _ = self.run_async(comm.connect)()
+
+        self.assertFalse(connected)
+
+    def test_receive_guesses_and_solves(self):
+        user = TeamMemberFactory()
+        comm = self.get_communicator(websocket_app, self.url, {'user': self.admin})
+        connected, _ = self.run_async(comm.connect)()
+        self.assertTrue(connected)
+        self.assertTrue(self.run_async(comm.receive_nothing)())
+
+        guess = GuessFactory(for_puzzle=self.pz, by=user)
+        output = self.receive_json(comm, 'Websocket did not send new guess')
+        self.assertEqual(output['type'], 'new_guess')
+        self.assertEqual(output['content']['guess'], guess.guess)
+        self.assertEqual(output['content']['team']['id'], user.team_at(self.tenant).id)
+        self.assertEqual(output['content']['puzzle']['id'], self.pz.id)
+        self.assertFalse(output['content']['correct'])
+
+        guess = GuessFactory(for_puzzle=self.pz, by=user, correct=True)
+        messages = [self.receive_json(comm, 'Websocket did not send correct guess and solve') for _ in range(2)]
+        self.assertEqual(
+            {m['type'] for m in messages},
+            {'new_guess', 'solved'},
+        )
+        solved = next(m['content'] for m in messages if m['type'] == 'solved')
+        self.assertEqual(solved['team_id'], user.team_at(self.tenant).id)
+        self.assertEqual(solved['puzzle_id'], self.pz.id)
+        self.assertEqual(solved['guess'], guess.guess)
+
+        self.assertTrue(self.run_async(comm.receive_nothing)())
+        self.run_async(comm.disconnect)()
+
+    def test_receive_unlocks(self):
+        user = TeamMemberFactory()
+        unlockanswer = UnlockAnswerFactory(unlock__puzzle=self.pz)
+        comm = self.get_communicator(websocket_app, self.url, {'user': self.admin})
+        connected, _ = self.run_async(comm.connect)()
+        self.assertTrue(connected)
+
+        GuessFactory(for_puzzle=self.pz, by=user, guess=unlockanswer.guess)
+        messages = [self.receive_json(comm, 'Websocket did not send guess and unlock') for _ in range(2)]
+        unlock = next(m['content'] for m in messages if m['type'] == 'new_unlock')
+        self.assertEqual(unlock['unlock_uid'], unlockanswer.unlock.compact_id)
+        self.assertEqual(unlock['guess'], unlockanswer.guess)
+        guess = next(m['content'] for m in messages if m['type'] == 'new_guess')
+        self.assertTrue(guess['unlocked'])
+
+        self.run_async(comm.disconnect)()
+
+    def test_solve_without_start_time(self):
+        user = TeamMemberFactory()
+        # As with sample progress
+        TeamPuzzleProgressFactory(puzzle=self.pz, team=user.team_at(self.tenant), start_time=None)
+        comm = self.get_communicator(websocket_app, self.url, {'user': self.admin})
+        connected, _ = self.run_async(comm.connect)()
+        self.assertTrue(connected)
+
+        GuessFactory(for_puzzle=self.pz, by=user, correct=True)
+        messages = {m['type']: m['content'] for m in (self.receive_json(comm, 'Websocket did not send guess and solve') for _ in range(2))}
+        self.assertEqual(messages['new_guess']['time_on_puzzle'], 'P0DT00H00M00S')
+        self.assertEqual(messages['solved']['time_on'], 0)
+
+        self.run_async(comm.disconnect)()
+
+    def test_new_guess_from_recorded_guess(self):
+        user = TeamMemberFactory()
+        guess = GuessFactory(for_puzzle=self.pz, by=user)
+        # The answer view has already looked these up by the time the guess is sent
+        user.attendance_at(self.pz.episode.event)
+        self.pz.get_absolute_url()
+        with self.assertNumQueries(0):
+            AdminWebsocket.send_new_guess(guess)
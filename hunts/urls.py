@@ -29,6 +29,8 @@ eventadminpatterns = [
     path('stats', views.admin.Stats.as_view(), name='admin_stats'),
     path('stats_content/', views.admin.StatsContent.as_view(), name='admin_stats_content'),
     path('stats_content/<int:episode_id>', views.admin.StatsContent.as_view(), name='admin_stats_content'),
+    path('leaderboard', views.admin.Leaderboard.as_view(), name='admin_leaderboard'),
+    path('leaderboard/<int:episode_id>', views.admin.Leaderboard.as_view(), name='admin_leaderboard'),
     path('progress', views.admin.Progress.as_view(), name='admin_progress'),
     path('progress_content', views.admin.ProgressContent.as_view(), name='admin_progress_content'),
     path('teams', views.admin.TeamAdmin.as_view(), name='admin_team'),
@@ -12,7 +12,7 @@
 
 
 from base64 import urlsafe_b64encode, urlsafe_b64decode
-from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 
 from django.http import Http404
 from uuid import UUID
@@ -42,25 +42,17 @@ def event_episode_puzzle(event, episode_number, puzzle_number):
 
 
 def finishing_positions(event, include_late=False):
-    """Get an iterable of teams in the order in which they finished the whole Event"""
-    from .models import Episode
-    winning_episodes = Episode.objects.filter(event=event, winning=True)
-
-    team_times = defaultdict(list)
-    for ep in winning_episodes:
-        for team, time in ep.finished_times(include_late=include_late):
-            team_times[team].append(time)
+    """Get a list of teams in the order in which they finished the whole Event
 
-    num_winning_episodes = len(winning_episodes)
-    for team, times in list(team_times.items()):
-        if len(times) < num_winning_episodes:
-            # To win an event you have to win every winning episode
-            del team_times[team]
-        else:
-            # Your position is dictated by the maximum of your episode win times
-            team_times[team] = max(times)
+    To win an event you have to win every winning episode, and your position is dictated by the maximum of your episode
+    win times. These are kept up to date by `leaderboard`; the event must be the active tenant.
+    """
+    from teams.models import Team
+    from .leaderboard import finished_team_ids
 
-    return sorted(team_times.keys(), key=lambda t: team_times[t])
+    team_ids = finished_team_ids(include_late=include_late)
+    teams_by_id = Team.objects.filter(at_event=event).in_bulk(team_ids)
+    return [teams_by_id[team_id] for team_id in team_ids if team_id in teams_by_id]
 
 
 def position_for_display(position):
@@ -85,3 +77,24 @@ def encode_uuid(uuid):
 
 def decode_uuid(compact_id):
     return UUID(bytes=urlsafe_b64decode(compact_id + '=' * (len(compact_id) % 4)))
+
+
+_CURSOR_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_guess_cursor(guess):
+    """Return a string identifying a guess's position in the order guesses were given"""
+    micros = (guess.given - _CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f'{micros}.{encode_uuid(guess.id)}'
+
+
+def decode_guess_cursor(cursor):
+    """Return the (given, id) of the guess a cursor points at
+
+    Raises ValueError if the cursor is malformed.
+    """
+    micros, _, compact_id = cursor.partition('.')
+    try:
+        return _CURSOR_EPOCH + timedelta(microseconds=int(micros)), decode_uuid(compact_id)
+    except (OverflowError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
@@ -11,7 +11,6 @@
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
 from os import path
-from urllib.parse import quote_plus
 import itertools
 import tarfile
 
@@ -21,7 +20,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Count, Exists, Max, OuterRef, Prefetch, Subquery, Q, F, Min
+from django.db.models import Count, Exists, OuterRef, Prefetch, Subquery, Q, F, Min
 from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
@@ -35,7 +34,8 @@ from events.utils import annotate_user_queryset_with_seat
 from teams.models import Team, TeamRole
 from .mixins import PuzzleAdminMixin, EventAdminMixin, EventAdminJSONMixin, CacheMixin
 from ..forms import BulkUploadForm, ResetProgressForm
-from .. import models
+from ..consumers import AdminWebsocket
+from .. import leaderboard, models, utils
 
 
 class BulkUpload(LoginRequiredMixin, PuzzleAdminMixin, FormView):
@@ -91,10 +91,20 @@ class Guesses(EventAdminMixin, View):
 
 
 class GuessesList(EventAdminJSONMixin, CacheMixin, View):
+    """Lists guesses, most recent first
+
+    Pages are either numbered with `page`, or follow on from a guess identified by a cursor: `cursor` gives the guesses
+    which were given before that guess, and `since` the guesses given after it. Cursors are returned with each page; since
+    they don't require counting or skipping over the guesses before them, they are equally fast on any page.
+
+    The total number of matching guesses is only returned with `page` and `cursor` requests: `since` is polled
+    repeatedly to follow new guesses, and its callers can add those to the total they already have.
+    """
     # The cache timeout of 5 seconds is set equal to the refresh interval used on the page. A single user
     # will see virtually no difference, but multiple people observing the page will not cause additional
     # load (but will potentially be out of date by up to 10 instead of up to 5 seconds)
     cache_timeout = 5
+    page_size = 50
 
     def get(self, request):
         episode = request.GET.get('episode')
@@ -108,13 +118,17 @@ class GuessesList(EventAdminJSONMixin, CacheMixin, View):
         if episode:
             puzzles = puzzles.filter(episode_id=episode)
 
+        matching_guesses = models.Guess.objects.filter(for_puzzle__in=puzzles)
+        if team:
+            matching_guesses = matching_guesses.filter(by_team_id=team)
+        if user:
+            matching_guesses = matching_guesses.filter(by_id=user)
+
         # The following query is heavily optimised. We only retrieve the fields we will use here and
         # in the template, and we select and prefetch related objects so as not to perform any extra
         # queries.
-        all_guesses = models.Guess.objects.filter(
-            for_puzzle__in=puzzles,
-        ).order_by(
-            '-given'
+        all_guesses = matching_guesses.order_by(
+            '-given', '-id'
         ).select_related(
             'for_puzzle', 'for_puzzle__episode', 'by_team', 'by', 'correct_for', 'progress',
         ).only(
@@ -133,65 +147,53 @@ class GuessesList(EventAdminJSONMixin, CacheMixin, View):
         ).prefetch_related(
             Prefetch(
                 'for_puzzle__episode',
-                queryset=models.Episode.objects.only('id', 'name').all()
-            ),
-            Prefetch(
-                'for_puzzle__episode__event__episode_set',
-            ),
-            Prefetch(
-                'for_puzzle__episode__puzzle_set',
+                queryset=models.Episode.objects.only('id', 'name', 'event').all()
             ),
         ).seal()
 
-        if team:
-            all_guesses = all_guesses.filter(by_team_id=team)
-        if user:
-            all_guesses = all_guesses.filter(by_id=user)
-
-        guess_pages = Paginator(all_guesses, 50)
-        page = request.GET.get('page')
+        cursor = request.GET.get('cursor')
+        since = request.GET.get('since')
+        rows = None
+        if not since:
+            # Estimated rather than counted, because counting takes longer the more guesses there are
+            rows = matching_guesses.approximate_count()
         try:
-            guesses = guess_pages.page(page)
-        except PageNotAnInteger:
-            guesses = guess_pages.page(1)
-        except EmptyPage:
-            guesses = guess_pages.page(guess_pages.num_pages)
+            if since:
+                given, id = utils.decode_guess_cursor(since)
+                # Take the oldest of the newer guesses, so that fetching repeatedly never misses any
+                guesses = list(all_guesses.filter(
+                    Q(given__gt=given) | Q(given=given, id__gt=id), given__gte=given
+                ).order_by('given', 'id')[:self.page_size])
+                guesses.reverse()
+            elif cursor:
+                given, id = utils.decode_guess_cursor(cursor)
+                guesses = list(all_guesses.filter(
+                    Q(given__lt=given) | Q(given=given, id__lt=id), given__lte=given
+                )[:self.page_size])
+            else:
+                guess_pages = Paginator(all_guesses, self.page_size)
+                guess_pages.count = rows
+                page = request.GET.get('page')
+                try:
+                    guesses = guess_pages.page(page)
+                except PageNotAnInteger:
+                    guesses = guess_pages.page(1)
+                except EmptyPage:
+                    guesses = guess_pages.page(guess_pages.num_pages)
+                guesses = list(guesses)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
         guesses_list = [
-            {
-                'add_answer_url': f'{reverse("admin:hunts_answer_add")}?for_puzzle={g.for_puzzle.id}&answer={quote_plus(g.guess)}',
-                'add_unlock_url': f'{reverse("admin:hunts_unlock_add")}?puzzle={g.for_puzzle.id}&new_guess={quote_plus(g.guess)}',
-                'correct': bool(g.get_correct_for()),
-                'episode': {
-                    'id': g.for_puzzle.episode.id,
-                    'name': g.for_puzzle.episode.name,
-                },
-                'given': g.given,
-                'guess': g.guess,
-                'puzzle': {
-                    'id': g.for_puzzle.id,
-                    'title': g.for_puzzle.title,
-                    'admin_url': reverse('admin:hunts_puzzle_change', kwargs={'object_id': g.for_puzzle.id}),
-                    'site_url': g.for_puzzle.get_absolute_url(),
-                },
-                'team': {
-                    'id': g.by_team.id,
-                    'name': g.by_team.name,
-                },
-                'team_admin_view': f'{reverse("admin_team_detail", kwargs={"team_id": g.by_team.id})}#puzzle-{g.for_puzzle.id}',
-                'time_on_puzzle': g.time_on_puzzle(),
-                'user': {
-                    'id': g.by.id,
-                    'name': g.by.username,
-                    'seat': g.byseat,
-                },
-                'unlocked': g.unlocked,
-            } for g in guesses
+            AdminWebsocket.guess_json(g, g.byseat, g.unlocked, g.time_on_puzzle()) for g in guesses
         ]
 
         return JsonResponse({
             'guesses': guesses_list,
-            'rows': all_guesses.count(),
+            # Cursors for fetching the guesses before and after these ones
+            'next': utils.encode_guess_cursor(guesses[-1]) if len(guesses) == self.page_size else None,
+            'latest': utils.encode_guess_cursor(guesses[0]) if guesses else since,
+            'rows': rows,
             'seating': request.tenant.seat_assignments,
         })
 
@@ -293,6 +295,36 @@ class EpisodeList(EventAdminJSONMixin, View):
         } for episode in models.Episode.objects.filter(event=request.tenant)], safe=False)
 
 
+class Leaderboard(EventAdminJSONMixin, View):
+    """The teams who have finished the event, or an episode, in the order in which they finished
+
+    This is read from the leaderboards kept up to date as teams solve puzzles, so it is cheap enough to poll.
+    """
+
+    def get(self, request, episode_id=None):
+        if episode_id is not None and not models.Episode.objects.filter(pk=episode_id).exists():
+            raise Http404
+        try:
+            count = int(request.GET.get('count', 100))
+        except ValueError:
+            return JsonResponse({'error': 'count must be a number'}, status=400)
+        # Redis would take a count of 0 or less to mean everyone
+        if count < 1:
+            return JsonResponse({'error': 'count must be at least 1'}, status=400)
+        include_late = request.GET.get('late', 'true') == 'true'
+
+        finishes = leaderboard.top(count, episode_id, include_late=include_late)
+        names = dict(Team.objects.filter(pk__in=[team_id for team_id, _ in finishes]).values_list('id', 'name'))
+        return JsonResponse({
+            'teams': [{
+                'position': position + 1,
+                'id': team_id,
+                'name': names.get(team_id),
+                'finished': finished,
+            } for position, (team_id, finished) in enumerate(finishes)],
+        })
+
+
 class Progress(EventAdminMixin, View):
     def get(self, request):
         return TemplateResponse(
@@ -315,61 +347,35 @@ class ProgressContent(EventAdminJSONMixin, CacheMixin, View):
         ).prefetch_related(
             'episode__event__episode_set',
             'episode__puzzle_set',
-            'hint_set',
-            'hint_set__obsoleted_by',
         ).seal()
 
-        # Sort teams according to how urgently we expect them to need help
-        # Current implementation: number of unsolved, looked-at puzzles.
-        # for linear episodes, that would be be always be 1, so sort secondarily by number
-        # of solved puzzles to discriminate.
         teams = Team.objects.filter(
             at_event=request.tenant,
             role=TeamRole.PLAYER,
-        ).annotate(
-            # Django does not support multiple annotated aggregations, because they're implemented as joins and so
-            # interfere with one another. In the case of COUNTs though, `distinct` keeps them accurate.
-            num_solved_puzzles=Count(
-                'teampuzzleprogress', filter=Q(teampuzzleprogress__solved_by__isnull=False), distinct=True
-            ),
-            num_started_puzzles=Count(
-                'teampuzzleprogress', filter=Q(teampuzzleprogress__start_time__isnull=False), distinct=True
-            ),
-            num_guesses=Count('guess', distinct=True),
-            teampuzzleprogress_exists=Exists(models.TeamPuzzleProgress.objects.filter(team_id=OuterRef('id'))),
-            # Here we avoid an aggregation and instead manually write the subquery to avoid the same issue
-            most_recent_guess_time=Subquery(
-                models.Guess.objects.filter(by_team_id=OuterRef('id')).order_by('given').values('given')[:1]
-            ),
-        ).filter(
-            teampuzzleprogress_exists=True
-        ).order_by().prefetch_related('members').seal()  # ensure there is no default ordering (which will break the annotated aggregations)
+            teampuzzleprogress__isnull=False,
+        ).distinct().prefetch_related('members').seal()
 
+        # Guess counts and hint status are summarised on the progress objects as they change, so this is a single scan of
+        # the progress table no matter how many guesses have been made
         all_puzzle_progress = models.TeamPuzzleProgress.objects.filter(
-            team__in=teams,
-        ).annotate(
-            guess_count=Count('guesses'),
-            latest_guess_time=Max('guesses__given'),
-        ).filter(
-            start_time__isnull=False
+            team__at_event=request.tenant,
+            team__role=TeamRole.PLAYER,
         ).select_related(
             'solved_by'
-        ).prefetch_related(
-            Prefetch(
-                'accepted_hints',
-                queryset=models.Hint.objects.only('id')
-            ),
-            Prefetch(
-                'teamunlock_set',
-                queryset=models.TeamUnlock.objects.select_related(
-                    'unlockanswer',
-                    'unlocked_by',
-                )
-            )
         ).seal()
         puzzle_progress = defaultdict(dict)
+        num_solved_puzzles = defaultdict(int)
+        most_recent_guess_time = {}
         for progress in all_puzzle_progress:
-            puzzle_progress[progress.team_id][progress.puzzle_id] = progress
+            if progress.solved_by_id:
+                num_solved_puzzles[progress.team_id] += 1
+            if progress.latest_guess_time and (
+                progress.team_id not in most_recent_guess_time
+                or progress.latest_guess_time > most_recent_guess_time[progress.team_id]
+            ):
+                most_recent_guess_time[progress.team_id] = progress.latest_guess_time
+            if progress.start_time:
+                puzzle_progress[progress.team_id][progress.puzzle_id] = progress
 
         now = timezone.now()
 
@@ -391,22 +397,7 @@ class ProgressContent(EventAdminJSONMixin, CacheMixin, View):
                 guesses = progress.guess_count
                 time_on = (now - progress.start_time).total_seconds()
                 latest_guess = progress.latest_guess_time
-                unlocked_unlocks = {
-                    tu.unlockanswer.unlock_id: tu.unlocked_by.given
-                    for tu in progress.teamunlock_set.all()
-                }
-                accepted_hints = set(progress.accepted_hints.all())
-                hints_scheduled = any([
-                    True
-                    for h in puzzle.hint_set.all()
-                    if (
-                        not h.start_after_id
-                        or h.start_after_id in unlocked_unlocks
-                    ) and (
-                        h not in accepted_hints
-                        or not h.unlocked_by(team, progress, unlocked_unlocks=unlocked_unlocks)
-                    )
-                ])
+                hints_scheduled = progress.hints_scheduled
             return {
                 'puzzle_id': puzzle.id,
                 'episode_number': puzzle.episode.get_relative_id(),
@@ -437,10 +428,10 @@ class ProgressContent(EventAdminJSONMixin, CacheMixin, View):
             for tp_progress in team_progress[-time_spent_max_puzzles:]:
                 recently_opened_time_spent += min(now - tp_progress.start_time, time_spent_cap)
 
-            last_guessed = t.most_recent_guess_time
+            last_guessed = most_recent_guess_time.get(t.id)
 
             return (
-                t.num_solved_puzzles,
+                num_solved_puzzles[t.id],
                 -recently_opened_time_spent,
                 now - last_guessed if last_guessed else timedelta.max,
                 t.id
@@ -12,32 +12,39 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.http import Http404, JsonResponse
-from django.shortcuts import redirect
+from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.cache import cache_page
 
 from teams.permissions import is_admin_for_event
-from ..models import Puzzle
-from .. import utils
+from ..availability import team_availability
+from ..models import Episode, Puzzle
 
 # If PuzzleUnlockedMixin inherits from EpisodeUnlockedMixin the dispatch methods execute in the wrong order
 
 
 class EpisodeUnlockedMixin():
     def dispatch(self, request, episode_number, *args, **kwargs):
+        # Access checks use a snapshot of the team's progress rather than querying the models. Views can use it too.
+        availability = request.availability = team_availability(request.tenant, request.team)
+        now = timezone.now()
+        event_over = request.tenant.end_date < now
+
         # Views using this mixin inevitably want the episode object so keep it on the request
-        request.episode = utils.event_episode(request.tenant, episode_number)
+        request.episode = get_object_or_404(Episode, id=availability.episode_id(episode_number))
+        request.episode.event = request.tenant
+        request.episode.relative_id = int(episode_number)
         request.admin = is_admin_for_event.test(request.user, request.tenant)
 
-        if request.admin or request.episode.available(request.team):
+        if request.admin or event_over or availability.episode_available(request.episode.id, now):
             return super().dispatch(request, *args, episode_number=episode_number, **kwargs)
 
         if not request.accepts('text/html'):
             raise PermissionDenied
 
-        if not request.episode.started_for(request.team) and not request.admin:
+        if not availability.episode_started(request.episode.id, now) and not request.admin:
             if not request.accepts('text/html'):
                 raise PermissionDenied
             return TemplateResponse(
@@ -56,14 +63,23 @@ class EpisodeUnlockedMixin():
 
 class PuzzleUnlockedMixin():
     def dispatch(self, request, episode_number, puzzle_number, *args, **kwargs):
+        # Access checks use a snapshot of the team's progress rather than querying the models. Views can use it too.
+        availability = request.availability = team_availability(request.tenant, request.team)
+        now = timezone.now()
+        event_over = request.tenant.end_date < now
+
         # Views using this mixin inevitably want the episode and puzzle objects so keep it on the request
-        request.episode, request.puzzle = utils.event_episode_puzzle(request.tenant, episode_number, puzzle_number)
+        request.puzzle = get_object_or_404(Puzzle.objects.select_related('episode'), id=availability.puzzle_id(episode_number, puzzle_number))
+        request.puzzle.relative_id = int(puzzle_number)
+        request.episode = request.puzzle.episode
+        request.episode.event = request.tenant
+        request.episode.relative_id = int(episode_number)
         request.admin = is_admin_for_event.test(request.user, request.tenant)
 
-        if request.admin or request.puzzle.available(request.team):
+        if request.admin or event_over or availability.puzzle_available(request.puzzle.id, now):
             return super().dispatch(request, *args, episode_number=episode_number, puzzle_number=puzzle_number, **kwargs)
 
-        if not request.episode.available(request.team):
+        if not availability.episode_available(request.episode.id, now):
             if not request.accepts('text/html'):
                 raise PermissionDenied
             event_url = reverse('event')
@@ -72,7 +88,7 @@ class PuzzleUnlockedMixin():
         if not request.accepts('text/html'):
             raise PermissionDenied
 
-        if not request.puzzle.started_for(request.team):
+        if not availability.puzzle_started(request.puzzle.id, now):
             return TemplateResponse(
                 request,
                 'hunts/puzzlenotstarted.html',
@@ -21,7 +21,6 @@ from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.utils import timezone
 from django.utils.safestring import mark_safe
-from django.urls import reverse
 from django.views import View
 from django.views.generic import TemplateView, RedirectView
 from django_sendfile import sendfile
@@ -30,7 +29,9 @@ from events.utils import annotate_user_queryset_with_seat
 from teams.models import Team, TeamRole
 from teams.permissions import is_admin_for_event
 from .mixins import EpisodeUnlockedMixin, EventMustBeOverMixin, PuzzleUnlockedMixin
-from .. import models, utils
+from .. import leaderboard, models, utils
+from ..availability import team_availability
+from ..guess_queue import submit_guess
 from ..stats import __all__ as stats_generators
 
 
@@ -51,7 +52,7 @@ class EpisodeIndex(LoginRequiredMixin, EpisodeUnlockedMixin, View):
 class EpisodeContent(LoginRequiredMixin, EpisodeUnlockedMixin, View):
     def get(self, request, episode_number):
         now = timezone.now()
-        headstart = request.episode.headstart_applied(request.team)
+        headstart = request.availability.headstart(request.episode.id)
 
         puzzles = request.episode.puzzle_set.all().annotate_solved_by(request.team).seal()
         if request.episode.parallel or request.episode.event.end_date < now:
@@ -78,12 +79,10 @@ class EpisodeContent(LoginRequiredMixin, EpisodeUnlockedMixin, View):
 
         # Anyone who finishes the hunt late finishes it after anyone who finished it on time, so it is fine to
         # include late teams here.
-        positions = request.episode.finished_positions(include_late=True)
-        if request.team in positions:
-            position = positions.index(request.team)
+        position = leaderboard.position(request.team.id, request.episode.id, include_late=True)
+        if position is not None:
             position, position_text = utils.position_for_display(position)
         else:
-            position = None
             position_text = None
 
         files = request.tenant.files_map(request)
@@ -121,23 +120,21 @@ class EventIndex(LoginRequiredMixin, View):
 
         event = request.tenant
 
-        positions = utils.finishing_positions(event, include_late=True)
-        if request.team in positions:
-            position = positions.index(request.team)
+        position = leaderboard.position(request.team.id, include_late=True)
+        if position is not None:
             position, position_text = utils.position_for_display(position)
         else:
-            position = None
             position_text = None
 
-        episodes = [
-            e for e in
-            models.Episode.objects.filter(event=event.id).order_by('start_date')
-            if e.available(request.team)
-        ]
+        availability = team_availability(event, request.team)
+        now = timezone.now()
+        event_over = event.end_date < now
 
+        episodes = list(models.Episode.objects.filter(event=event.id).order_by('start_date'))
         # Annotate the episodes with their position in the event.
-        for episode in episodes:
-            episode.index = episode.get_relative_id()
+        for index, episode in enumerate(episodes, start=1):
+            episode.index = index
+        episodes = [e for e in episodes if event_over or availability.episode_available(e.id, now)]
 
         return TemplateResponse(
             request,
@@ -268,19 +265,7 @@ class SolutionContent(LoginRequiredMixin, PuzzleUnlockedMixin, View):
 
         data = models.PuzzleData(request.puzzle, request.team, request.user)
 
-        puzzle_files = puzzle.files_map(request)
-        solution_files = {f.slug: reverse(
-            'solution_file',
-            kwargs={
-                'episode_number': episode_number,
-                'puzzle_number': puzzle_number,
-                'file_path': f.url_path,
-            }) for f in puzzle.solutionfile_set.filter(slug__isnull=False)
-        }
-        files = {  # Solution files override puzzle files, which override event files.
-            **puzzle_files,
-            **solution_files,
-        }
+        files = puzzle.solution_files_map(request)
 
         text = Template(request.puzzle.soln_runtime.create(request.puzzle.soln_options).evaluate(
             request.puzzle.soln_content,
@@ -340,9 +325,10 @@ class Answer(LoginRequiredMixin, PuzzleUnlockedMixin, View):
             guess=given_answer,
             for_puzzle=request.puzzle,
             by=request.user,
+            by_team=request.team,
             late=late,
         )
-        guess.save()
+        submit_guess(guess)
 
         # progress record is updated by signals on save - get that info now.
         try:
@@ -356,7 +342,8 @@ class Answer(LoginRequiredMixin, PuzzleUnlockedMixin, View):
             response['guess'] = given_answer
             response['timeout_length'] = minimum_time.total_seconds() * 1000
             response['timeout_end'] = str(now + minimum_time)
-        response['correct'] = str(correct).lower()
+        # A queued guess's result arrives over the websocket. Until then the client treats it like a wrong one.
+        response['correct'] = 'pending' if guess.queued else str(correct).lower()
         response['by'] = request.user.username
 
         return JsonResponse(response)
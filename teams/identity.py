@@ -0,0 +1,72 @@
+# Copyright (C) 2023 The Hunter2 Contributors.
+#
+# This file is part of Hunter2.
+#
+# Hunter2 is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# Hunter2 is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import Team
+
+# Entries are invalidated when they change, so this only limits how long the entries of departed users linger
+IDENTITY_TIMEOUT = 60 * 60
+
+Identity = namedtuple('Identity', ('team', 'attendance'))
+
+
+def _key(event_id, user_id):
+    return f'hunter2:identity:{event_id}:{user_id}'
+
+
+def _detached(instance):
+    # Related objects would otherwise be cached along with the instance and go stale
+    instance = copy.copy(instance)
+    instance._state.fields_cache = {}
+    return instance
+
+
+def _team(user, event):
+    try:
+        return user.teams.get(at_event=event)
+    except Team.DoesNotExist:
+        try:
+            with transaction.atomic():
+                team = Team(at_event=event)
+                team.save()
+                team.members.add(user)
+            return team
+        except IntegrityError:
+            return user.teams.get(at_event=event)
+
+
+def identity(user, event):
+    """Return the team and attendance of a user at an event, creating them if they don't exist yet
+
+    Nearly every request needs these, so they are kept in the shared cache until the user's team or attendance changes.
+    """
+    key = _key(event.id, user.id)
+    user_identity = cache.get(key)
+    if user_identity is None:
+        attendance, _ = user.attendance_set.get_or_create(event=event)
+        user_identity = Identity(_detached(_team(user, event)), _detached(attendance))
+        cache.set(key, user_identity, IDENTITY_TIMEOUT)
+    user_identity.team.at_event = event
+    user_identity.attendance.event = event
+    return user_identity
+
+
+def invalidate_identity(event_id, user_id):
+    key = _key(event_id, user_id)
+    # Deleted again on commit, since another process could cache the old identity before the transaction finishes
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
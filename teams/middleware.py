@@ -9,9 +9,7 @@
 # PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
-from django.db import transaction, IntegrityError
-
-from .models import Team
+from .identity import identity
 
 
 class TeamMiddleware(object):
@@ -22,15 +20,8 @@ class TeamMiddleware(object):
         request.team = None
 
         if request.user.is_authenticated and request.tenant is not None:
-            try:
-                request.team = request.user.teams.get(at_event=request.tenant)
-            except Team.DoesNotExist:
-                try:
-                    with transaction.atomic():
-                        request.team = Team(at_event=request.tenant)
-                        request.team.save()
-                        request.team.members.add(request.user)
-                except IntegrityError:
-                    request.team = request.user.teams.get(at_event=request.tenant)
+            user_identity = identity(request.user, request.tenant)
+            request.team = user_identity.team
+            request.user.set_identity_at(request.tenant, user_identity.team, user_identity.attendance)
 
         return self.get_response(request)
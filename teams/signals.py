@@ -13,9 +13,12 @@
 
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
-from .models import Team
+
+from events.models import Attendance
+from .identity import invalidate_identity
+from .models import Team, TeamMembership
 
 
 @receiver(m2m_changed, sender=Team.members.through)
@@ -30,3 +33,31 @@ def members_changed(sender, instance, action, pk_set, **kwargs):
             if Team.objects.exclude(pk=instance.pk).filter(at_event=instance.at_event).filter(members=user).count() > 0:
                 pk_set.remove(user_id)
                 raise ValidationError('User can only join one team per same event')
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def members_added(sender, instance, action, pk_set, **kwargs):
+    # Removals delete memberships, which is handled below
+    if action == 'post_add':
+        for user_id in pk_set:
+            invalidate_identity(instance.at_event_id, user_id)
+
+
+@receiver(post_save, sender=TeamMembership)
+@receiver(post_delete, sender=TeamMembership)
+def membership_changed(sender, instance, **kwargs):
+    invalidate_identity(instance.team.at_event_id, instance.user_id)
+
+
+@receiver(post_save, sender=Team)
+def team_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    for user_id in instance.members.values_list('id', flat=True):
+        invalidate_identity(instance.at_event_id, user_id)
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def attendance_changed(sender, instance, **kwargs):
+    invalidate_identity(instance.event_id, instance.user_id)
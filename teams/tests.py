@@ -25,6 +25,7 @@ from accounts.factories import UserFactory
 from events.factories import EventFactory, EventFileFactory
 from events.test import EventAwareTestCase, EventTestCase
 from hunter2.models import APIToken
+from .identity import identity
 from .middleware import TeamMiddleware
 from .factories import TeamFactory, TeamMemberFactory
 from .models import Team, TeamRole, TeamMembership
@@ -126,6 +127,36 @@ class TeamCreateTests(EventTestCase):
         Team.objects.get(members=user)
 
 
+class IdentityTests(EventTestCase):
+    def setUp(self):
+        self.user = TeamMemberFactory()
+        self.team = self.user.team_at(self.tenant)
+
+    def test_identity_cached(self):
+        self.assertEqual(identity(self.user, self.tenant).team, self.team)
+        with self.assertNumQueries(0):
+            user_identity = identity(self.user, self.tenant)
+        self.assertEqual(user_identity.team, self.team)
+        self.assertEqual(user_identity.attendance.user, self.user)
+
+    def test_team_changed(self):
+        identity(self.user, self.tenant)
+        self.team.role = TeamRole.ADMIN
+        self.team.save()
+        self.assertEqual(identity(self.user, self.tenant).team.role, TeamRole.ADMIN)
+
+        other_team = TeamFactory()
+        self.team.members.remove(self.user)
+        other_team.members.add(self.user)
+        self.assertEqual(identity(self.user, self.tenant).team, other_team)
+
+    def test_attendance_changed(self):
+        attendance = identity(self.user, self.tenant).attendance
+        attendance.seat = 'A1'
+        attendance.save()
+        self.assertEqual(identity(self.user, self.tenant).attendance.seat, 'A1')
+
+
 class InviteTests(EventTestCase):
     def setUp(self):
         self.event = self.tenant